@@ -6,7 +6,9 @@
 # -------------------------------------------------------------------#
 from __future__ import division, print_function
 
+import io
 import os
+import time
 from PIL import Image, ImageFilter
 from multiprocessing import cpu_count
 from multiprocessing.pool import Pool
@@ -17,17 +19,25 @@ import numpy as np
 from tefla.da import data
 
 N_PROC = cpu_count()
+MANIFEST_PREFIX = '.convert_manifest'
 
 # pylint: disable=no-value-for-parameter
 
 
-def convert(fname, target_size=512):
-  img = Image.open(fname).convert('RGB')
+def open_rgb(fname, target_size=None):
+  """Opens an image as RGB, JPEGs are decoded at reduced size if `target_size`
+  is given, see `tefla.da.data.open_rgb`."""
+  return data.open_rgb(fname, target_size)
+
+
+def convert(fname, target_size=512, fast_decode=False):
+  img = open_rgb(fname, target_size if fast_decode else None)
 
   blurred = img.filter(ImageFilter.BLUR)
   ba = np.array(blurred)
   h, w, _ = ba.shape
 
+  bbox = None
   if w > 1.2 * h:
     left_max = ba[:, :w // 32, :].max(axis=(0, 1)).astype(int)
     right_max = ba[:, -w // 32:, :].max(axis=(0, 1)).astype(int)
@@ -36,17 +46,12 @@ def convert(fname, target_size=512):
     foreground = (ba > max_bg + 10).astype(np.uint8)
     bbox = Image.fromarray(foreground).getbbox()
 
-    if bbox is None:
-      print('bbox none for {} (???)'.format(fname))
-    else:
+    if bbox is not None:
       left, upper, right, lower = bbox
       # if we selected less than 80% of the original
       # height, just crop the square
       if right - left < 0.8 * h or lower - upper < 0.8 * h:
-        print('bbox too small for {}'.format(fname))
         bbox = None
-  else:
-    bbox = None
 
   if bbox is None:
     bbox = square_bbox(img, fname)
@@ -66,7 +71,6 @@ def convert_v2(fname, target_size=512):
 
 
 def full_bbox(img, fname):
-  print("full bbox conversion done for image: %s" % fname)
   w, h = img.size
   left = 0
   upper = 0
@@ -76,7 +80,6 @@ def full_bbox(img, fname):
 
 
 def square_bbox(img, fname):
-  print("square bbox conversion done for image: %s" % fname)
   w, h = img.size
   left = max((w - h) // 2, 0)
   upper = 0
@@ -87,7 +90,7 @@ def square_bbox(img, fname):
 
 def convert_square(fname, target_size):
   img = Image.open(fname)
-  bbox = square_bbox(img)
+  bbox = square_bbox(img, fname)
   cropped = img.crop(bbox)
   resized = cropped.resize([target_size, target_size])
   return resized
@@ -130,6 +133,291 @@ def save(img, fname):
   img.save(fname, quality=97)
 
 
+def save_atomic(img, fname):
+  """Saves through a temporary file in the same directory and renames it, so
+  that an interrupted conversion never leaves a truncated image behind.
+
+  Returns:
+    the size in bytes of the saved file.
+  """
+  dirname, basename = os.path.split(fname)
+  if dirname and not os.path.isdir(dirname):
+    try:
+      os.makedirs(dirname)
+    except OSError:
+      pass
+  tmp_fname = os.path.join(dirname, '.tmp-%d-%s' % (os.getpid(), basename))
+  save(img, tmp_fname)
+  os.rename(tmp_fname, fname)
+  return os.path.getsize(fname)
+
+
+class ConversionStats(object):
+  """Throughput statistics of a conversion run."""
+
+  def __init__(self):
+    self.start_time = time.time()
+    self.images = 0
+    self.skipped = 0
+    self.errors = 0
+    self.bytes_in = 0
+    self.bytes_out = 0
+
+  def update(self, bytes_in, bytes_out, status='ok'):
+    if status == 'ok':
+      self.images += 1
+      self.bytes_in += bytes_in
+      self.bytes_out += bytes_out
+    elif status == 'exists':
+      self.skipped += 1
+    else:
+      self.errors += 1
+
+  def report(self):
+    elapsed = max(time.time() - self.start_time, 1e-6)
+    return ('{} images ({} skipped, {} errors) in {:.1f}s: {:.1f} images/sec, '
+            '{:.2f} MB/s read, {:.2f} MB/s written'.format(
+                self.images, self.skipped, self.errors, elapsed, self.images / elapsed,
+                self.bytes_in / elapsed / 2**20, self.bytes_out / elapsed / 2**20))
+
+
+_npy_outputs = {}
+
+
+def _convert_task(task):
+  """Pool worker, converts one image and writes or returns it.
+
+  Args:
+    task: a tuple (index, fname, output, crop_size, output_format, fast_decode);
+      `output` is the converted file name for 'files', the (path, shape) of the
+      array for 'npy' and unused for 'tfrecords'.
+
+  Returns:
+    a tuple (index, fname, bytes_in, bytes_out, payload, status), `payload` is
+      the JPEG encoded image for 'tfrecords', `status` is 'ok', 'exists' or an
+      error message.
+  """
+  index, fname, output, crop_size, output_format, fast_decode = task
+  try:
+    bytes_in = os.path.getsize(fname)
+    if output_format == 'files' and os.path.exists(output):
+      return index, fname, 0, 0, None, 'exists'
+    img = convert(fname, crop_size, fast_decode=fast_decode)
+    payload = None
+    if output_format == 'files':
+      bytes_out = save_atomic(img, output)
+    elif output_format == 'npy':
+      path, shape = output
+      if path not in _npy_outputs:
+        _npy_outputs[path] = np.lib.format.open_memmap(path, mode='r+')
+      _npy_outputs[path][index] = np.asarray(img, dtype=np.uint8)
+      bytes_out = int(np.prod(shape[1:]))
+    else:
+      buf = io.BytesIO()
+      img.save(buf, format='JPEG', quality=97)
+      payload = buf.getvalue()
+      bytes_out = len(payload)
+    return index, fname, bytes_in, bytes_out, payload, 'ok'
+  except Exception as e:
+    return index, fname, 0, 0, None, '%s: %s' % (type(e).__name__, e)
+
+
+def manifest_path(convert_directory, output_format, crop_size):
+  return os.path.join(convert_directory, '%s-%s-%d' % (MANIFEST_PREFIX, output_format, crop_size))
+
+
+def read_manifest(manifest):
+  """Returns the set of source files listed as converted in a manifest."""
+  done = set()
+  if os.path.exists(manifest):
+    with open(manifest) as f:
+      for line in f:
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) >= 2 and fields[0] == 'ok':
+          done.add(fields[1])
+  return done
+
+
+class _TFRecordShards(object):
+  """Writes encoded images to TFRecord shards of `shard_size` examples.
+
+  A shard is written under a temporary name and renamed when complete, its
+  images are reported as done only then. Without `labels` the examples have no
+  `image/class/label` feature.
+  """
+
+  def __init__(self, prefix, shard_size, labels=None):
+    import tensorflow as tf
+    self._tf = tf
+    self.prefix = prefix
+    self.shard_size = shard_size
+    self.labels = labels
+    self._shard = 0
+    while tf.gfile.Exists(self._shard_name(self._shard)):
+      self._shard += 1
+    self._writer = None
+    self._pending = []
+
+  def _shard_name(self, shard):
+    return '%s-%05d.tfrecord' % (self.prefix, shard)
+
+  def _feature(self, value):
+    tf = self._tf
+    if isinstance(value, bytes):
+      return tf.train.Feature(bytes_list=tf.train.BytesList(value=[value]))
+    return tf.train.Feature(int64_list=tf.train.Int64List(value=[value]))
+
+  def write(self, fname, payload, size):
+    """Adds an image, returns the source files of a completed shard if any."""
+    tf = self._tf
+    if self._writer is None:
+      self._writer = tf.python_io.TFRecordWriter(self._shard_name(self._shard) + '.tmp')
+    feature = {
+        'image/height': self._feature(size),
+        'image/width': self._feature(size),
+        'image/channels': self._feature(3),
+        'image/format': self._feature(b'jpg'),
+        'image/filename': self._feature(os.path.basename(fname).encode('utf-8')),
+        'image/encoded/image': self._feature(payload)
+    }
+    if self.labels is not None:
+      feature['image/class/label'] = self._feature(int(self.labels[fname]))
+    example = tf.train.Example(features=tf.train.Features(feature=feature))
+    self._writer.write(example.SerializeToString())
+    self._pending.append(fname)
+    if len(self._pending) >= self.shard_size:
+      return self.close()
+    return []
+
+  def close(self):
+    if self._writer is None:
+      return []
+    self._writer.close()
+    self._tf.gfile.Rename(
+        self._shard_name(self._shard) + '.tmp', self._shard_name(self._shard), overwrite=True)
+    self._writer = None
+    self._shard += 1
+    done, self._pending = self._pending, []
+    return done
+
+
+def convert_images(filenames,
+                   directory,
+                   convert_directory,
+                   crop_size=256,
+                   extension='tiff',
+                   output_format='files',
+                   num_workers=N_PROC,
+                   chunksize=16,
+                   shard_size=1024,
+                   labels=None,
+                   fast_decode=False,
+                   report_every=1000):
+  """Converts images with a streaming multi-process pipeline.
+
+  Images are streamed through `Pool.imap_unordered`, every completed image is
+  appended to a manifest in `convert_directory` (one per output format and
+  size) and images listed there are skipped, so an interrupted run resumes
+  where it stopped. Outputs are written atomically.
+
+  Args:
+    filenames: list of source image files.
+    directory: the root directory of `filenames`.
+    convert_directory: output directory.
+    crop_size: int, size of the converted square images.
+    extension: file type of the converted images, for 'files' output.
+    output_format: 'files' (one image file per source image, mirroring the
+      source tree), 'tfrecords' (JPEG encoded TFRecord shards) or 'npy' (one
+      uint8 `(N, crop_size, crop_size, 3)` array, with the list of files).
+    num_workers: number of worker processes.
+    chunksize: number of images sent to a worker at once.
+    shard_size: number of images per TFRecord shard.
+    labels: optional dict source file -> int label, for 'tfrecords' output;
+      it must have the label of every file.
+    fast_decode: bool, decode JPEGs at reduced size (PIL draft mode), this
+      changes the pixels of the converted images.
+    report_every: print the throughput every `report_every` images.
+
+  Returns:
+    a `ConversionStats`.
+
+  Raises:
+    ValueError: if `output_format` is unknown or files have no label.
+  """
+  if output_format not in ('files', 'tfrecords', 'npy'):
+    raise ValueError('Unknown output format %s' % output_format)
+  if output_format == 'tfrecords' and labels is not None:
+    missing = [fname for fname in filenames if fname not in labels]
+    if missing:
+      raise ValueError('%d files have no label, e.g. %s' % (len(missing), missing[0]))
+  stats = ConversionStats()
+  manifest_file = manifest_path(convert_directory, output_format, crop_size)
+  done = read_manifest(manifest_file)
+  prefix = os.path.join(convert_directory, 'images_%d' % crop_size)
+  shards = None
+  if output_format == 'npy':
+    shape = (len(filenames), crop_size, crop_size, 3)
+    array_path = prefix + '.npy'
+    list_path = prefix + '.files.txt'
+    if os.path.exists(array_path):
+      with open(list_path) as f:
+        if [line.rstrip('\n') for line in f] != list(filenames):
+          raise ValueError('%s was created for a different list of files' % array_path)
+    else:
+      done = set()
+      if os.path.exists(manifest_file):
+        os.remove(manifest_file)
+      np.lib.format.open_memmap(array_path, mode='w+', dtype=np.uint8, shape=shape).flush()
+      with open(list_path, 'w') as f:
+        f.writelines(fname + '\n' for fname in filenames)
+  elif output_format == 'tfrecords':
+    shards = _TFRecordShards(prefix, shard_size, labels)
+
+  # the files of the manifest are counted here, as the tasks are consumed by
+  # the task feeder thread of the pool
+  tasks = []
+  for i, fname in enumerate(filenames):
+    if fname in done:
+      stats.skipped += 1
+      continue
+    if output_format == 'files':
+      output = get_convert_fname(fname, extension, directory, convert_directory)
+    elif output_format == 'npy':
+      output = (array_path, shape)
+    else:
+      output = None
+    tasks.append((i, fname, output, crop_size, output_format, fast_decode))
+
+  pool = Pool(num_workers)
+  with open(manifest_file, 'a') as manifest:
+    try:
+      for _, fname, bytes_in, bytes_out, payload, status in pool.imap_unordered(
+          _convert_task, tasks, chunksize):
+        stats.update(bytes_in, bytes_out, status)
+        if status not in ('ok', 'exists'):
+          print('Corrupted Image file %s (%s)' % (fname, status))
+          continue
+        completed = [fname] if shards is None else shards.write(fname, payload, crop_size)
+        for completed_fname in completed:
+          manifest.write('ok\t%s\n' % completed_fname)
+        if status == 'ok' and report_every and stats.images % report_every == 0:
+          manifest.flush()
+          print(stats.report())
+      if shards is not None:
+        for completed_fname in shards.close():
+          manifest.write('ok\t%s\n' % completed_fname)
+      pool.close()
+    except BaseException:
+      pool.terminate()
+      raise
+    finally:
+      pool.join()
+  if output_format == 'npy' and stats.images:
+    # workers write through their own memory maps, make sure the pages reach the disk
+    np.lib.format.open_memmap(array_path, mode='r+').flush()
+  return stats
+
+
 @click.command()
 @click.option(
     '--directory', default='data/train', show_default=True, help="Directory with original images.")
@@ -146,7 +434,24 @@ def save(img, fname):
     help="Convert images one by one and examine them on screen.")
 @click.option('--crop_size', default=256, show_default=True, help="Size of converted images.")
 @click.option('--extension', default='tiff', show_default=True, help="Filetype of converted images.")
-def main(directory, convert_directory, test, crop_size, extension):
+@click.option(
+    '--output_format',
+    default='files',
+    show_default=True,
+    type=click.Choice(['files', 'tfrecords', 'npy']),
+    help="Image files, TFRecord shards or a single uint8 .npy array.")
+@click.option('--num_workers', default=N_PROC, show_default=True, help="Worker processes.")
+@click.option('--chunksize', default=16, show_default=True, help="Images per worker task.")
+@click.option('--shard_size', default=1024, show_default=True, help="Images per TFRecord shard.")
+@click.option('--label_file', default=None, show_default=True, help="Labels csv, for TFRecords.")
+@click.option(
+    '--fast_decode',
+    is_flag=True,
+    default=False,
+    show_default=True,
+    help="Decode JPEGs at reduced resolution (PIL draft mode).")
+def main(directory, convert_directory, test, crop_size, extension, output_format, num_workers,
+         chunksize, shard_size, label_file, fast_decode):
   try:
     os.mkdir(convert_directory)
   except OSError:
@@ -176,22 +481,23 @@ def main(directory, convert_directory, test, crop_size, extension):
 
   print("Resizing images in {} to {}, this takes a while." "".format(directory, convert_directory))
 
-  n = len(filenames)
-  # process in batches, sometimes weird things happen with Pool on my machine
-  batchsize = 500
-  batches = n // batchsize + 1
-  pool = Pool(N_PROC)
-
-  args = []
-
-  for f in filenames:
-    args.append((convert, (directory, convert_directory, f, crop_size, extension)))
-
-  for i in range(batches):
-    print("batch {:>2} / {}".format(i + 1, batches))
-    pool.map(process, args[i * batchsize:(i + 1) * batchsize])
-
-  pool.close()
+  labels = None
+  if label_file is not None:
+    labels = dict(
+        zip(filenames, data.get_labels(data.get_names(filenames), label_file=label_file)))
+  stats = convert_images(
+      filenames,
+      directory,
+      convert_directory,
+      crop_size=crop_size,
+      extension=extension,
+      output_format=output_format,
+      num_workers=num_workers,
+      chunksize=chunksize,
+      shard_size=shard_size,
+      labels=labels,
+      fast_decode=fast_decode)
+  print(stats.report())
 
   print('done')
 
@@ -13,10 +13,15 @@ from functools import reduce
 from ..da.iterator import BatchIterator
 from .lr_policy import NoDecayPolicy
 from .losses import kappa_log_loss_clipped, dice_loss
+from . import checkpoint_ops
+from . import grad_reduce
+from . import mixed_precision
+from . import restore_ops
 from . import summary
 from . import logger as log
 import tensorflow as tf
 from tensorflow.python.framework import function
+from tensorflow.python.ops import data_flow_ops
 from tensorflow.python.training import moving_averages
 
 TRAINING_BATCH_SUMMARIES = 'training_batch_summaries'
@@ -67,6 +72,12 @@ class Base(object):
     self.weighted = weighted
     self.num_classes = num_classes
     self.label_smoothing = label_smoothing
+    self.input_placeholders = None
+    self.stage_op = None
+    self.accumulate_op = None
+    self.accumulate_steps = 1
+    self._num_micro_batches = 0
+    self.loss_scale_optimizer = None
     log.setFileHandler(log_file_name)
     log.setVerbosity(str(verbosity))
     super(Base, self).__init__()
@@ -147,6 +158,10 @@ class Base(object):
         decay: variable decay value, scalar
         momentum: momentum value, scalar
 
+    With `cnf['mixed_precision']`, the optimizer is wrapped in a
+    `LossScaleOptimizer` with the loss scale `cnf['loss_scale']`, `dynamic` by
+    default or a static scale.
+
     Returns:
         optimizer to use
     """
@@ -201,6 +216,10 @@ class Base(object):
           l2_regularization_strength=l2_reg,
           use_locking=False,
           name='Ftrl')
+    if self.cnf.get('mixed_precision', False):
+      log.info('Using mixed precision training')
+      opt = mixed_precision.LossScaleOptimizer(opt, self.cnf.get('loss_scale', 'dynamic'))
+      self.loss_scale_optimizer = opt
     return opt
 
   def _sigmoid_kl_with_logits(self, logits, targets):
@@ -229,6 +248,164 @@ class Base(object):
     variables_averages_op = variable_averages.apply(tf.trainable_variables())
     return variables_averages_op
 
+  def _apply_gradients(self, optimizer, grads_and_vars, clip_fn=None):
+    """Creates the op applying the gradients, with optional gradient accumulation.
+
+    With `cnf['accumulate_steps']` K > 1, the gradients of K micro-batches are
+    summed into non-trainable accumulators before being applied: for K - 1
+    steps `_run_training_step` runs `self.accumulate_op`, which only adds the
+    gradients; the K-th step runs the returned op, which also applies the mean
+    of the accumulated gradients and resets the accumulators. The effective
+    batch size is K times `batch_size_train`.
+
+    Args:
+      optimizer: the optimizer, e.g. a `MovingAverageOptimizer`.
+      grads_and_vars: list of `(gradient, variable)`.
+      clip_fn: optional function clipping a `(gradient, variable)` list,
+        applied to the gradients actually applied.
+
+    Returns:
+      the applied `(gradient, variable)` list and the apply op.
+    """
+    self.accumulate_steps = self.cnf.get('accumulate_steps', 1)
+    if self.accumulate_steps <= 1:
+      if clip_fn is not None:
+        grads_and_vars = clip_fn(grads_and_vars)
+      return grads_and_vars, optimizer.apply_gradients(grads_and_vars)
+
+    log.info('Accumulating gradients over %d micro-batches' % self.accumulate_steps)
+    accumulators = []
+    accumulate_ops = []
+    with tf.name_scope('gradient_accumulation'):
+      for grad, var in grads_and_vars:
+        if grad is None:
+          accumulators.append((None, var))
+          continue
+        with tf.device(var.device):
+          accumulator = tf.Variable(
+              tf.zeros(var.get_shape(), dtype=var.dtype.base_dtype),
+              trainable=False,
+              collections=[tf.GraphKeys.LOCAL_VARIABLES],
+              name=var.op.name.replace('/', '_'))
+          if isinstance(grad, tf.IndexedSlices):
+            accumulate_ops.append(tf.scatter_add(accumulator, grad.indices, grad.values))
+          else:
+            accumulate_ops.append(tf.assign_add(accumulator, grad))
+        accumulators.append((accumulator, var))
+      self.accumulate_op = tf.group(*accumulate_ops, name='accumulate')
+      with tf.control_dependencies([self.accumulate_op]):
+        # variables without gradient are kept, e.g. for `MovingAverageOptimizer`
+        grads_and_vars = [(None if accumulator is None else
+                           accumulator.read_value() / self.accumulate_steps, var)
+                          for accumulator, var in accumulators]
+    if clip_fn is not None:
+      grads_and_vars = clip_fn(grads_and_vars)
+    apply_op = optimizer.apply_gradients(grads_and_vars)
+    with tf.control_dependencies([apply_op]):
+      reset_op = tf.group(
+          *[
+              tf.assign(accumulator, tf.zeros_like(accumulator))
+              for accumulator, _ in accumulators
+              if accumulator is not None
+          ],
+          name='apply_accumulated_gradients')
+    return grads_and_vars, reset_op
+
+  def _stage_inputs(self):
+    """Stages the training inputs and labels on the device through a `StagingArea`.
+
+    `self.inputs` and `self.labels` become the tensors taken from the staging
+    area, the placeholders are kept in `self.input_placeholders` and are fed to
+    `self.stage_op`, which copies the next batch while the current batch is
+    processed; see `_training_feeds`.
+    """
+    self.input_placeholders = (self.inputs, self.labels)
+    with tf.device(self.cnf.get('staging_device', '/gpu:0')):
+      staging_area = data_flow_ops.StagingArea(
+          dtypes=[p.dtype for p in self.input_placeholders],
+          shapes=[p.get_shape() for p in self.input_placeholders],
+          name='input_staging_area')
+      self.stage_op = staging_area.put(self.input_placeholders)
+      self.inputs, self.labels = staging_area.get()
+
+  def _check_input_batch(self, placeholder, inputs):
+    """Raises a ValueError if an integer input placeholder is fed non integer
+    inputs, e.g. standardized float batches, which would be silently truncated."""
+    dtype = placeholder.dtype.base_dtype
+    if dtype.is_integer and not np.issubdtype(np.asarray(inputs).dtype, np.integer):
+      raise ValueError('Input batches of dtype %s fed to %s inputs, see cnf[\'input_dtype\']' %
+                       (np.asarray(inputs).dtype, dtype.name))
+
+  def _training_feeds(self, sess, batches):
+    """Yields the `(inputs, feed_dict)` of each training step.
+
+    Args:
+      sess: the training session.
+      batches: an iterable of `(inputs, labels)` batches.
+
+    Without staging the feed dict feeds the batch to `self.inputs` and
+    `self.labels`. With staging the batch of a step was put in the staging area
+    by the previous step and the feed dict holds the next batch, for
+    `self.stage_op` run by `_run_training_step`.
+    """
+
+    def batch_feed(batch):
+      placeholders = self.input_placeholders or (self.inputs, self.labels)
+      self._check_input_batch(placeholders[0], batch[0])
+      return {placeholders[0]: batch[0], placeholders[1]: self._adjust_ground_truth(batch[1])}
+
+    if self.stage_op is None:
+      for batch in batches:
+        yield batch[0], batch_feed(batch)
+      return
+    batches = iter(batches)
+    current = next(batches, None)
+    if current is None:
+      return
+    sess.run(self.stage_op, feed_dict=batch_feed(current))
+    for batch in batches:
+      yield current[0], batch_feed(batch)
+      current = batch
+    yield current[0], {}
+
+  def _run_training_step(self, sess, feed_dict=None, summary_op=None, extra_fetches=None):
+    """Runs a training step in a single `sess.run`.
+
+    The loss, the train op (or the gradient accumulation op, see
+    `_apply_gradients`), the update ops (e.g. batch norm moving statistics),
+    the optional summary and the staging of the next batch are run together, so
+    that the batch is transferred and the forward pass computed only once.
+
+    Args:
+      sess: the training session.
+      feed_dict: the step feed dict.
+      summary_op: optional summary op.
+      extra_fetches: optional `dict` of other tensors to fetch.
+
+    Returns:
+      a `dict` with the `loss`, the `summary` if `summary_op` is given, the
+      values of `extra_fetches` and `applied`, False for the steps that only
+      accumulated gradients.
+    """
+    fetches = dict(extra_fetches or {})
+    fetches['loss'] = self.training_loss
+    fetches['train_op'] = self.train_op
+    applied = True
+    if self.accumulate_op is not None:
+      self._num_micro_batches += 1
+      applied = self._num_micro_batches % self.accumulate_steps == 0
+      if not applied:
+        fetches['train_op'] = self.accumulate_op
+    if self.update_ops:
+      fetches['update_ops'] = self.update_ops
+    if summary_op is not None:
+      fetches['summary'] = summary_op
+    if self.stage_op is not None and feed_dict and self.input_placeholders[0] in feed_dict:
+      fetches['stage_op'] = self.stage_op
+    results = sess.run(fetches, feed_dict=feed_dict)
+    results['applied'] = applied
+    return results
+
   def _tensors_in_checkpoint_file(self, file_name, tensor_name=None, all_tensors=True):
     try:
       reader = tf.train.NewCheckpointReader(file_name)
@@ -249,27 +426,72 @@ class Base(object):
     except Exception as e:
       log.info("Partial restoring session.")
       try:
-        names_to_restore = self._tensors_in_checkpoint_file(weights_from)
-        variables_to_restore = []
-        for v_name in names_to_restore:
-          try:
-            temp = [v for v in tf.global_variables() if v.name.strip(':0') == str(v_name)][0]
-            variables_to_restore.append(temp)
-          except Exception:
-            log.info('Variable %s doesnt exist in new model' % v_name)
-        for var in variables_to_restore:
-          log.info("Loading: %s %s)" % (var.name, var.get_shape()))
-          restorer = tf.train.Saver([var])
-          try:
-            restorer.restore(sess, weights_from)
-          except Exception as e:
-            log.info("Problem loading: %s -- %s" % (var.name, e.message))
-            continue
+        restore_ops.restore_partial(sess, weights_from, rules=self.cnf.get('restore_rules'))
         log.info("Loaded weights from %s" % weights_from)
-      except ValueError:
+      except (ValueError, tf.errors.OpError):
         log.debug("Couldn't load weights from %s; starting from scratch" % weights_from)
         sess.run(tf.global_variables_initializer())
 
+  def _async_checkpoint_saver(self, max_to_keep=None):
+    """Creates the background checkpoint writer if `cnf['async_checkpoints']` is True.
+
+    Checkpointing is synchronous by default, None is returned unless the
+    background writer is enabled. Old checkpoints are removed as per
+    `cnf['checkpoint_retention']`, the `checkpoint_ops.RetentionPolicy`
+    arguments, e.g. `dict(keep_best=3, keep_every=10)` keeps the 3 checkpoints
+    with the lowest validation loss and one every 10 epochs. `max_to_keep` is
+    the default `keep_last`.
+    """
+    if not self.cnf.get('async_checkpoints', False):
+      return None
+    retention = dict(self.cnf.get('checkpoint_retention') or {})
+    if max_to_keep:
+      retention.setdefault('keep_last', max_to_keep)
+    return checkpoint_ops.AsyncCheckpointSaver(
+        getattr(self, 'swapped_var_list', None),
+        retention=checkpoint_ops.RetentionPolicy(**retention),
+        queue_size=self.cnf.get('checkpoint_queue_size', 1))
+
+  def _save_checkpoint(self, sess, saver, async_saver, weights_dir, epoch, metric=None):
+    save_path = "%s/model-epoch-%d.ckpt" % (weights_dir, epoch)
+    if async_saver is not None:
+      async_saver.save(
+          sess,
+          save_path,
+          epoch=epoch,
+          metric=metric,
+          callback=lambda: self._average_checkpoints(weights_dir))
+    else:
+      if getattr(self, 'swapped_saver', None) is not None:
+        saver = self.swapped_saver
+      saver.save(sess, save_path)
+      self._average_checkpoints(weights_dir)
+
+  def _average_checkpoints(self, weights_dir):
+    """Averages the latest epoch checkpoints, configured by `cnf['checkpoint_averaging']`.
+
+    e.g. `dict(last_k=5, mode='uniform')` averages the last 5 epoch checkpoints,
+    `dict(last_k=None, mode='ema', decay=0.9)` keeps a moving average over all
+    epochs, updated from the previous average and the latest checkpoint only.
+    The average is written to `weights_dir/model-avg.ckpt` unless `output` is given.
+    """
+    avg_cnf = dict(self.cnf.get('checkpoint_averaging') or {})
+    if not avg_cnf:
+      return
+    last_k = avg_cnf.pop('last_k', 5)
+    output_path = os.path.join(weights_dir, avg_cnf.pop('output', 'model-avg.ckpt'))
+    checkpoints = checkpoint_ops.epoch_checkpoints(weights_dir, last_k)
+    if not checkpoints:
+      return
+    if avg_cnf.get('mode') == 'ema' and last_k is None:
+      decay = avg_cnf.get('decay', 0.9)
+      if checkpoint_ops.checkpoint_exists(output_path):
+        checkpoints = [output_path, checkpoints[-1]]
+      else:
+        checkpoints = checkpoints[-1:]
+      avg_cnf.update(mode='weighted', weights=[decay, 1.0 - decay][-len(checkpoints):])
+    checkpoint_ops.average_checkpoints(checkpoints, output_path, **avg_cnf)
+
   def _print_layer_shapes(self, end_points, log):
     log.info("\nModel layer output shapes:")
     for k, v in end_points.items():
@@ -282,22 +504,17 @@ class Base(object):
       return y if self.classification else y.reshape(-1, 1).astype(np.float32)
 
   def _average_gradients(self, tower_grads):
-    average_grads = []
-    for grad_and_vars in zip(*tower_grads):
-      grads = []
-      for g, _ in grad_and_vars:
-        expanded_g = tf.expand_dims(g, 0)
-        grads.append(expanded_g)
-      try:
-        grad = tf.concat(grads, 0)
-      except Exception:
-        grad = tf.concat(0, grads)
-      grad = tf.reduce_mean(grad, 0)
+    """Averages the tower gradients, see `grad_reduce.average_gradients`.
 
-      v = grad_and_vars[0][1]
-      grad_and_var = (grad, v)
-      average_grads.append(grad_and_var)
-    return average_grads
+    The reduction is configured by `cnf['gradient_reduction']` (`add_n`,
+    `nccl` or `concat`), `cnf['gradient_bucket_mb']` and
+    `cnf['gradient_reduce_device']`.
+    """
+    return grad_reduce.average_gradients(
+        tower_grads,
+        method=self.cnf.get('gradient_reduction', 'add_n'),
+        bucket_size_mb=self.cnf.get('gradient_bucket_mb', 32),
+        reduce_device=self.cnf.get('gradient_reduce_device'))
 
   def _clip_grad_norms(self, gradients_to_variables, max_norm=5):
     """Clips the gradients by the given value.
@@ -343,6 +560,9 @@ class Base(object):
         A list of clipped gradient to variable pairs.
     """
     var_refs = [v.read_value() for v in tvars]
+    loss_scaler = getattr(self, 'loss_scale_optimizer', None)
+    if loss_scaler is not None:
+      loss = loss_scaler.scale_loss(loss)
     grads = tf.gradients(
         loss,
         var_refs,
@@ -350,6 +570,8 @@ class Base(object):
         gate_gradients=(gate_gradients == 1),
         aggregation_method=agre_method,
         colocate_gradients_with_ops=col_grad_ops)
+    if loss_scaler is not None:
+      grads = loss_scaler.unscale_gradients(grads)
     if gradient_noise_scale is not None:
       grads = self._add_scaled_noise_to_gradients(
           list(zip(grads, tvars)), gradient_noise_scale=gradient_noise_scale)
@@ -840,6 +1062,11 @@ class BaseMixin(object):
                   y_pow=2,
                   is_classification=True,
                   gpu_id=0):
+    if self.cnf.get('mixed_precision', False):
+      model = mixed_precision.mixed_precision_model(model)
+    else:
+      # e.g. uint8 or float16 inputs, see `cnf['input_dtype']`
+      images = tf.cast(images, tf.float32)
     if is_training:
       self.training_end_points = model(
           images, is_training=is_training, reuse=reuse, num_classes=self.num_classes)
@@ -888,16 +1115,14 @@ class BaseMixin(object):
     return total_loss
 
   def _average_gradients(self, tower_grads):
-    average_grads = []
-    for grad_and_vars in zip(*tower_grads):
-      grads = []
-      for g, _ in grad_and_vars:
-        expanded_g = tf.expand_dims(g, 0)
-        grads.append(expanded_g)
-      grad = tf.concat(grads, 0)
-      grad = tf.reduce_mean(grad, 0)
-
-      v = grad_and_vars[0][1]
-      grad_and_var = (grad, v)
-      average_grads.append(grad_and_var)
-    return average_grads
+    """Averages the tower gradients, see `grad_reduce.average_gradients`.
+
+    The reduction is configured by `cnf['gradient_reduction']` (`add_n`,
+    `nccl` or `concat`), `cnf['gradient_bucket_mb']` and
+    `cnf['gradient_reduce_device']`.
+    """
+    return grad_reduce.average_gradients(
+        tower_grads,
+        method=self.cnf.get('gradient_reduction', 'add_n'),
+        bucket_size_mb=self.cnf.get('gradient_bucket_mb', 32),
+        reduce_device=self.cnf.get('gradient_reduce_device'))
@@ -79,9 +79,42 @@ def gather_tree_py(values, parents):
 
 
 def gather_tree(values, parents):
-  """Tensor version of gather_tree_py."""
-  res = tf.py_func(func=gather_tree_py, inp=[values, parents], Tout=values.dtype)
-  res.set_shape(values.get_shape().as_list())
+  """Gathers path through a tree backwards from the leave nodes, in the graph.
+
+  Used to reconstruct beams given their parents, same outputs as
+  `gather_tree_py`. The parent indices of all the levels are computed by a
+  single backward `tf.scan`, then the values of all the beams are gathered at
+  once.
+
+  Args:
+    values: a Tensor [length, beam_width] or [length, batch_size, beam_width].
+    parents: an integer Tensor of the same shape as `values`, the beam index
+      of the parent of each node in the previous level.
+
+  Returns:
+    a Tensor of the same shape and dtype as `values`.
+  """
+  with tf.name_scope("gather_tree", values=[values, parents]):
+    values = tf.convert_to_tensor(values)
+    parents = tf.to_int32(parents)
+    shape = tf.shape(values)
+    beam_width = shape[-1]
+    # [length, batch_size, beam_width], batch_size is 1 for 2-D values
+    parents = tf.reshape(parents, [shape[0], -1, beam_width])
+    beam_ids = tf.zeros_like(parents[0]) + tf.range(beam_width)
+    row_offsets = tf.expand_dims(tf.range(tf.shape(parents)[1]) * beam_width, 1)
+
+    def parent_ids(ids, level_parents):
+      return tf.gather(tf.reshape(level_parents, [-1]), ids + row_offsets)
+
+    # the output at each level is the beam index of the parents in the previous
+    # level, scanning all the levels keeps the scan non empty for length 1
+    ids = tf.scan(parent_ids, parents, initializer=beam_ids, reverse=True)
+    ids = tf.concat([ids[1:], tf.expand_dims(beam_ids, 0)], 0)
+    offsets = tf.reshape(tf.range(tf.size(ids) // beam_width) * beam_width, tf.shape(ids[..., :1]))
+    res = tf.gather(tf.reshape(values, [-1]), ids + offsets)
+    res = tf.reshape(res, shape)
+  res.set_shape(values.get_shape())
   return res
 
 
@@ -0,0 +1,357 @@
+"""Checkpoint averaging and asynchronous checkpoint saving.
+
+Checkpoints are averaged one variable at a time: worker threads, each with its
+own `CheckpointReader`s, read a variable from every checkpoint, accumulate its
+weighted sum and write it to a single-tensor checkpoint shard. Shards are then
+merged into the output checkpoint, so that at most one averaged variable per
+thread is held in memory.
+
+`AsyncCheckpointSaver` snapshots the variables to host memory and writes the
+checkpoints from a background thread, so that training only waits for the
+snapshot.
+"""
+from __future__ import division, print_function, absolute_import
+
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+
+import numpy as np
+import six
+import tensorflow as tf
+from tensorflow.python.ops import io_ops
+
+from . import logger as log
+
+AVERAGING_MODES = ('uniform', 'weighted', 'ema')
+
+
+def checkpoint_exists(path):
+  return (tf.gfile.Exists(path) or tf.gfile.Exists(path + ".meta")
+          or tf.gfile.Exists(path + ".index"))
+
+
+def averaging_weights(num_checkpoints, mode='uniform', weights=None, decay=0.9):
+  """Normalized averaging weights of checkpoints ordered from oldest to newest.
+
+  Args:
+    num_checkpoints: number of checkpoints.
+    mode: one of `uniform`, `weighted` or `ema`.
+    weights: per checkpoint weights, for `weighted` mode.
+    decay: decay of the exponential moving average over checkpoints, for `ema`
+      mode; the oldest checkpoint initializes the average.
+
+  Returns:
+    a float64 array of weights summing to 1.
+  """
+  if mode == 'uniform':
+    weights = np.ones(num_checkpoints)
+  elif mode == 'weighted':
+    weights = np.asarray(weights, dtype=np.float64)
+    if weights.shape != (num_checkpoints,):
+      raise ValueError('Expected %d weights, got %s' % (num_checkpoints, weights.shape))
+  elif mode == 'ema':
+    weights = (1.0 - decay) * decay**np.arange(num_checkpoints - 1, -1, -1, dtype=np.float64)
+    weights[0] = decay**(num_checkpoints - 1)
+  else:
+    raise ValueError('Unknown averaging mode %s, expected one of %s' % (mode, AVERAGING_MODES))
+  return weights / weights.sum()
+
+
+def epoch_checkpoints(weights_dir, last_k=None):
+  """Returns the `model-epoch-%d.ckpt` checkpoints of a directory, by epoch.
+
+  Args:
+    weights_dir: directory of the checkpoints.
+    last_k: if not None, only the `last_k` latest epochs are returned.
+  """
+  pattern = re.compile(r'^model-epoch-(\d+)\.ckpt\.index$')
+  epochs = []
+  for fname in tf.gfile.ListDirectory(weights_dir):
+    match = pattern.match(fname)
+    if match:
+      epochs.append(int(match.group(1)))
+  checkpoints = [
+      os.path.join(weights_dir, 'model-epoch-%d.ckpt' % epoch) for epoch in sorted(epochs)
+  ]
+  return checkpoints[-last_k:] if last_k else checkpoints
+
+
+def _accumulator_dtype(dtype):
+  """Returns the numpy scalar type used to accumulate `dtype` values."""
+  dtype = np.dtype(dtype)
+  if dtype in (np.float32, np.float64):
+    return dtype.type
+  return np.float32
+
+
+class _ShardWriter(object):
+  """Writes single tensors to checkpoint shards, one save op per dtype."""
+
+  def __init__(self):
+    self._graph = tf.Graph()
+    self._ops = {}
+    self._lock = threading.Lock()
+    with self._graph.as_default():
+      self._prefix = tf.placeholder(tf.string, shape=[])
+      self._name = tf.placeholder(tf.string, shape=[])
+    self._sess = tf.Session(graph=self._graph)
+
+  def _save_op(self, dtype):
+    with self._lock:
+      if dtype not in self._ops:
+        with self._graph.as_default():
+          value = tf.placeholder(tf.as_dtype(dtype))
+          save = io_ops.save_v2(self._prefix, tf.expand_dims(self._name, 0), [''], [value])
+          self._ops[dtype] = (value, save)
+      return self._ops[dtype]
+
+  def write(self, prefix, name, tensor):
+    value, save = self._save_op(tensor.dtype)
+    self._sess.run(save, {self._prefix: prefix, self._name: name, value: tensor})
+
+  def merge(self, prefixes, output_path):
+    with self._graph.as_default():
+      merge = io_ops.merge_v2_checkpoints(prefixes, output_path, delete_old_dirs=True)
+    self._sess.run(merge)
+
+  def close(self):
+    self._sess.close()
+
+
+def average_checkpoints(checkpoints,
+                        output_path,
+                        mode='uniform',
+                        weights=None,
+                        decay=0.9,
+                        num_threads=4,
+                        exclude=None):
+  """Averages the variables of checkpoints into a new checkpoint.
+
+  Floating point variables are averaged, accumulating in their own dtype for
+  float32/float64 and in float32 for lower precisions. Other variables, e.g.
+  `global_step`, are copied from the last checkpoint.
+
+  Args:
+    checkpoints: checkpoint paths, ordered from oldest to newest.
+    output_path: path of the averaged checkpoint, may be one of `checkpoints`.
+    mode: one of `uniform`, `weighted` or `ema`, see `averaging_weights`.
+    weights: per checkpoint weights, for `weighted` mode.
+    decay: exponential moving average decay, for `ema` mode.
+    num_threads: number of variables averaged concurrently.
+    exclude: optional regex, variables matching it are not written.
+
+  Returns:
+    the number of variables written.
+  """
+  if not checkpoints:
+    raise ValueError('No checkpoints provided for averaging.')
+  start_time = time.time()
+  checkpoints = list(checkpoints)
+  weights = averaging_weights(len(checkpoints), mode, weights, decay)
+  names = sorted(tf.train.NewCheckpointReader(checkpoints[0]).get_variable_to_shape_map())
+  if exclude:
+    names = [name for name in names if not re.match(exclude, name)]
+
+  local = threading.local()
+  writer = _ShardWriter()
+  shard_dir = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(output_path)))
+
+  def average(item):
+    index, name = item
+    if not hasattr(local, 'readers'):
+      local.readers = [tf.train.NewCheckpointReader(c) for c in checkpoints]
+    last = local.readers[-1].get_tensor(name)
+    if np.issubdtype(last.dtype, np.floating) and len(checkpoints) > 1:
+      acc_dtype = _accumulator_dtype(last.dtype)
+      total = last.astype(acc_dtype, copy=False) * acc_dtype(weights[-1])
+      for reader, weight in zip(local.readers[:-1], weights[:-1]):
+        total += reader.get_tensor(name).astype(acc_dtype, copy=False) * acc_dtype(weight)
+      last = total.astype(last.dtype, copy=False)
+    prefix = os.path.join(shard_dir, 'var-%d' % index)
+    writer.write(prefix, name, last)
+    return prefix
+
+  pool = ThreadPool(num_threads)
+  try:
+    prefixes = pool.map(average, list(enumerate(names)))
+    # The output is staged, as it may overwrite one of the input checkpoints.
+    staged_path = os.path.join(shard_dir, 'merged')
+    writer.merge(prefixes, staged_path)
+    for fname in tf.gfile.Glob(staged_path + '.data-*') + [staged_path + '.index']:
+      tf.gfile.Rename(
+          fname, output_path + os.path.basename(fname)[len('merged'):], overwrite=True)
+  finally:
+    pool.close()
+    writer.close()
+    shutil.rmtree(shard_dir, ignore_errors=True)
+  log.info('Averaged %d variables of %d checkpoints (%s) to %s in %.2fs' %
+           (len(names), len(checkpoints), mode, output_path, time.time() - start_time))
+  return len(names)
+
+
+class RetentionPolicy(object):
+  """Selects the checkpoints to keep.
+
+  A checkpoint is kept if it satisfies any of the rules; with no rule all the
+  checkpoints are kept.
+
+  Args:
+    keep_last: number of most recent checkpoints to keep.
+    keep_best: number of checkpoints with the best metric to keep.
+    best_mode: `min` or `max`, whether a lower or higher metric is better.
+    keep_every: keep the checkpoints of every `keep_every` epochs.
+  """
+
+  def __init__(self, keep_last=None, keep_best=None, best_mode='min', keep_every=None):
+    if best_mode not in ('min', 'max'):
+      raise ValueError('best_mode must be min or max, got %s' % best_mode)
+    self.keep_last = keep_last
+    self.keep_best = keep_best
+    self.best_mode = best_mode
+    self.keep_every = keep_every
+
+  def select(self, records):
+    """Returns the set of kept paths from a list of `(path, epoch, metric)`."""
+    if not (self.keep_last or self.keep_best or self.keep_every):
+      return set(path for path, _, _ in records)
+    kept = set()
+    if self.keep_last:
+      kept.update(path for path, _, _ in records[-self.keep_last:])
+    if self.keep_best:
+      scored = [r for r in records if r[2] is not None]
+      scored.sort(key=lambda r: r[2], reverse=self.best_mode == 'max')
+      kept.update(path for path, _, _ in scored[:self.keep_best])
+    if self.keep_every:
+      kept.update(path for path, epoch, _ in records
+                  if epoch is not None and epoch % self.keep_every == 0)
+    return kept
+
+
+def remove_checkpoint(path):
+  for fname in tf.gfile.Glob(path + '.*'):
+    tf.gfile.Remove(fname)
+
+
+class AsyncCheckpointSaver(object):
+  """Saves checkpoints from a background thread.
+
+  `save` copies the variables to host memory with a single `sess.run` and
+  queues the copy; a writer thread writes it with a `SaveV2` op of its own
+  graph, updates the `checkpoint` state file and applies the retention policy.
+  The queue is bounded, `save` blocks when `queue_size` copies are pending.
+
+  Args:
+    var_list: variables to save, a list or a `dict` name -> variable as for
+      `tf.train.Saver`; all the global variables if None.
+    retention: a `RetentionPolicy`, keeps all the checkpoints if None.
+    queue_size: maximum number of pending checkpoints.
+  """
+
+  def __init__(self, var_list=None, retention=None, queue_size=1):
+    if var_list is None:
+      var_list = tf.global_variables()
+    if not isinstance(var_list, dict):
+      var_list = {var.op.name: var for var in var_list}
+    self._var_list = var_list
+    self._names = sorted(var_list)
+    self.retention = retention or RetentionPolicy()
+    self._records = []
+    self._queue = six.moves.queue.Queue(maxsize=queue_size)
+    self._error = None
+    self.blocked_secs = 0.0
+    self.write_secs = 0.0
+    self._graph = tf.Graph()
+    with self._graph.as_default():
+      self._prefix = tf.placeholder(tf.string, shape=[])
+      self._values = [
+          tf.placeholder(var_list[name].dtype.base_dtype, shape=var_list[name].get_shape())
+          for name in self._names
+      ]
+      self._save = io_ops.save_v2(self._prefix, self._names, [''] * len(self._names),
+                                  self._values)
+    self._sess = tf.Session(graph=self._graph)
+    self._thread = threading.Thread(target=self._run, name='async_checkpoint_saver')
+    self._thread.daemon = True
+    self._thread.start()
+
+  def save(self, sess, save_path, epoch=None, metric=None, callback=None):
+    """Snapshots the variables and queues the checkpoint write.
+
+    Args:
+      sess: the training `tf.Session`.
+      save_path: checkpoint path.
+      epoch: epoch of the checkpoint, used by `keep_every` retention.
+      metric: validation metric of the checkpoint, used by `keep_best`
+        retention.
+      callback: optional function called by the writer thread once the
+        checkpoint is written.
+    """
+    self._raise_error()
+    start_time = time.time()
+    values = sess.run({name: self._var_list[name] for name in self._names})
+    self._queue.put((save_path, epoch, metric, values, callback))
+    blocked = time.time() - start_time
+    self.blocked_secs += blocked
+    log.debug('Queued checkpoint %s, blocked %.2fs' % (save_path, blocked))
+
+  def _run(self):
+    while True:
+      item = self._queue.get()
+      try:
+        if item is None:
+          return
+        self._write(*item)
+      except Exception as e:  # pylint: disable=broad-except
+        log.error('Writing checkpoint failed: %s' % e)
+        self._error = e
+      finally:
+        self._queue.task_done()
+
+  def _write(self, save_path, epoch, metric, values, callback):
+    start_time = time.time()
+    feed_dict = {p: values[name] for p, name in zip(self._values, self._names)}
+    feed_dict[self._prefix] = save_path
+    self._sess.run(self._save, feed_dict)
+    self._records.append((save_path, epoch, metric))
+    kept = self.retention.select(self._records)
+    for path, _, _ in self._records:
+      if path not in kept:
+        remove_checkpoint(path)
+    self._records = [r for r in self._records if r[0] in kept]
+    tf.train.update_checkpoint_state(
+        os.path.dirname(os.path.abspath(save_path)),
+        save_path,
+        all_model_checkpoint_paths=[path for path, _, _ in self._records])
+    if callback is not None:
+      callback()
+    self.write_secs += time.time() - start_time
+
+  def _raise_error(self):
+    if self._error is not None:
+      error, self._error = self._error, None
+      raise error
+
+  def wait(self):
+    """Blocks until all the queued checkpoints are written."""
+    start_time = time.time()
+    self._queue.join()
+    self.blocked_secs += time.time() - start_time
+    self._raise_error()
+
+  def close(self):
+    """Writes the pending checkpoints and stops the writer thread."""
+    start_time = time.time()
+    self._queue.put(None)
+    self._thread.join()
+    waited = time.time() - start_time
+    self.blocked_secs += waited
+    self._sess.close()
+    log.info('Checkpoint I/O: %.2fs written in background, %.2fs overlapped with training, '
+             '%.2fs blocking training' % (self.write_secs, max(self.write_secs - waited, 0.0),
+                                          self.blocked_secs))
+    self._raise_error()
@@ -14,11 +14,14 @@ from __future__ import division
 from __future__ import print_function
 
 import functools
+import os
 import sys
 import tarfile
 from six.moves import urllib
+import numpy as np
 import tensorflow as tf
 
+from . import logger as log
 from .layers import flatten
 
 __all__ = [
@@ -32,6 +35,10 @@ __all__ = [
     'classifier_score',
     'frechet_inception_distance',
     'frechet_classifier_distance',
+    'frechet_distance_from_statistics',
+    'ActivationStatistics',
+    'ClassifierScoreStatistics',
+    'StreamingClassifierEvaluator',
     'INCEPTION_DEFAULT_IMAGE_SIZE',
 ]
 
@@ -408,3 +415,214 @@ def frechet_classifier_distance(real_images, generated_images, classifier_fn, nu
 frechet_inception_distance = functools.partial(
     frechet_classifier_distance,
     classifier_fn=functools.partial(run_inception, output_tensor=INCEPTION_FINAL_POOL))
+
+
+class ActivationStatistics(object):
+  """Running mean and covariance of classifier activations.
+
+  Activations are accumulated batch by batch in float64, as a sum and a sum of
+  outer products, so memory is O(feature_dim^2) whatever the number of images.
+  Sums are taken around the mean of the first batch to limit cancellation when
+  the covariance is finished.
+
+  Args:
+    mean: optional precomputed mean, e.g. loaded reference statistics.
+    cov: optional precomputed covariance, required with `mean`.
+    count: number of examples behind `mean` and `cov`.
+  """
+
+  def __init__(self, mean=None, cov=None, count=0):
+    self.count = int(count)
+    self._shift = None
+    self._sum = None
+    self._outer = None
+    if mean is not None:
+      self._shift = np.asarray(mean, dtype=np.float64)
+      self._sum = np.zeros_like(self._shift)
+      self._outer = np.asarray(cov, dtype=np.float64) * max(self.count - 1, 0)
+
+  def update(self, activations):
+    """Adds a batch of activations, an array of shape `[batch_size, ...]`."""
+    activations = np.asarray(activations, dtype=np.float64)
+    activations = activations.reshape(activations.shape[0], -1)
+    if not activations.shape[0]:
+      return
+    if self._shift is None:
+      self._shift = activations.mean(axis=0)
+      self._sum = np.zeros_like(self._shift)
+      self._outer = np.zeros((self._shift.size, self._shift.size), dtype=np.float64)
+    centered = activations - self._shift
+    self._sum += centered.sum(axis=0)
+    self._outer += np.dot(centered.T, centered)
+    self.count += activations.shape[0]
+
+  @property
+  def mean(self):
+    return self._shift + self._sum / self.count
+
+  @property
+  def cov(self):
+    if self.count < 2:
+      raise ValueError('At least 2 examples are needed for a covariance, got %d' % self.count)
+    delta = self._sum / self.count
+    return (self._outer - self.count * np.outer(delta, delta)) / (self.count - 1)
+
+  def save(self, filename):
+    """Saves mean, covariance and count to a `.npz` file."""
+    tmp_filename = filename + '.tmp'
+    with tf.gfile.Open(tmp_filename, 'wb') as f:
+      np.savez(f, mean=self.mean, cov=self.cov, count=self.count)
+    tf.gfile.Rename(tmp_filename, filename, overwrite=True)
+
+  @classmethod
+  def load(cls, filename):
+    with tf.gfile.Open(filename, 'rb') as f:
+      stats = np.load(f)
+      return cls(stats['mean'], stats['cov'], int(stats['count']))
+
+
+class ClassifierScoreStatistics(object):
+  """Running statistics of classifier logits for the classifier score.
+
+  `E[KL(p(y|x) || p(y))]` is `E[sum p log p] - sum q log q` with `q = E[p]`, so
+  only the sum of `p` and the sum of `p log p` are kept.
+  """
+
+  def __init__(self):
+    self.count = 0
+    self._p_sum = None
+    self._neg_entropy_sum = 0.0
+
+  def update(self, logits):
+    """Adds a batch of logits, an array of shape `[batch_size, num_classes]`."""
+    logits = np.asarray(logits, dtype=np.float64)
+    log_p = logits - logits.max(axis=1, keepdims=True)
+    log_p -= np.log(np.exp(log_p).sum(axis=1, keepdims=True))
+    p = np.exp(log_p)
+    if self._p_sum is None:
+      self._p_sum = np.zeros(p.shape[1], dtype=np.float64)
+    self._p_sum += p.sum(axis=0)
+    self._neg_entropy_sum += float((p * log_p).sum())
+    self.count += p.shape[0]
+
+  @property
+  def score(self):
+    q = self._p_sum / self.count
+    log_q = np.log(np.where(q > 0, q, 1.0))
+    return float(np.exp(self._neg_entropy_sum / self.count - np.dot(q, log_q)))
+
+
+def frechet_distance_from_statistics(mean, cov, mean_v, cov_v):
+  """Frechet distance between two Gaussians, computed in NumPy.
+
+  Args:
+    mean, cov: mean and covariance of the first distribution.
+    mean_v, cov_v: mean and covariance of the second distribution.
+
+  Returns:
+    The Frechet distance, a python float.
+  """
+  mean, cov, mean_v, cov_v = [np.asarray(x, dtype=np.float64) for x in (mean, cov, mean_v, cov_v)]
+  # Tr(sqrt(cov cov_v)) = Tr(sqrt(sqrt(cov) cov_v sqrt(cov))), see `trace_sqrt_product`.
+  w, v = np.linalg.eigh(cov)
+  sqrt_cov = np.dot(v * np.sqrt(np.maximum(w, 0)), v.T)
+  sqrt_a_sigmav_a = np.dot(sqrt_cov, np.dot(cov_v, sqrt_cov))
+  eigvals = np.linalg.eigvalsh((sqrt_a_sigmav_a + sqrt_a_sigmav_a.T) / 2.0)
+  sqrt_trace_component = np.sqrt(np.maximum(eigvals, 0)).sum()
+  trace = np.trace(cov) + np.trace(cov_v) - 2.0 * sqrt_trace_component
+  return float(trace + np.square(mean - mean_v).sum())
+
+
+class StreamingClassifierEvaluator(object):
+  """Computes FID and classifier scores over streams of image batches.
+
+  The classifier graph is built once; batches are then run through it one at a
+  time and only running statistics are kept. Statistics of the real images can
+  be cached to `.npz` files, so that periodic FID evaluation during training
+  only runs the generated images through the classifier.
+
+  Args:
+    classifier_fn: function taking images and returning activations (for FID)
+      or logits (for the classifier score).
+    images: optional image tensor, e.g. the output of a generator. A float32
+      placeholder of shape `image_shape` is used if None.
+    image_shape: shape of the image placeholder, batch dimension included.
+    cache_dir: directory of the cached reference statistics.
+  """
+
+  def __init__(self, classifier_fn, images=None, image_shape=None, cache_dir=None):
+    if images is None:
+      if image_shape is None:
+        raise ValueError('One of `images` or `image_shape` must be given')
+      images = tf.placeholder(tf.float32, shape=image_shape, name='streaming_images')
+    self.images = images
+    self.outputs = classifier_fn(images)
+    self.cache_dir = cache_dir
+
+  def _run_batches(self, sess, stats, batches=None, num_batches=None, feed_dict=None):
+    if batches is None:
+      if num_batches is None:
+        raise ValueError('One of `batches` or `num_batches` must be given')
+      for _ in range(num_batches):
+        stats.update(sess.run(self.outputs, feed_dict))
+    else:
+      for batch in batches:
+        batch_feed = dict(feed_dict or {})
+        batch_feed[self.images] = batch
+        stats.update(sess.run(self.outputs, batch_feed))
+    return stats
+
+  def activation_statistics(self, sess, batches=None, num_batches=None, feed_dict=None):
+    """Activation statistics of a stream of images.
+
+    Args:
+      sess: a `tf.Session`.
+      batches: an iterable of image batches fed to `images`.
+      num_batches: if `batches` is None, number of times `images` is evaluated,
+        e.g. generator samples.
+      feed_dict: extra feeds for every run.
+
+    Returns:
+      an `ActivationStatistics`.
+    """
+    return self._run_batches(sess, ActivationStatistics(), batches, num_batches, feed_dict)
+
+  def reference_filename(self, dataset_name, classifier_name):
+    return os.path.join(self.cache_dir, '%s_%s_stats.npz' % (dataset_name, classifier_name))
+
+  def reference_statistics(self, sess, dataset_name, classifier_name, batches=None, **kwargs):
+    """Activation statistics of the real images, loaded from cache if present.
+
+    Args:
+      sess: a `tf.Session`.
+      dataset_name: name of the real images dataset, part of the cache key.
+      classifier_name: name of the classifier and its output, part of the
+        cache key.
+      batches: an iterable of real image batches, used on a cache miss.
+      kwargs: other `activation_statistics` arguments, used on a cache miss.
+
+    Returns:
+      an `ActivationStatistics`.
+    """
+    filename = None
+    if self.cache_dir is not None:
+      filename = self.reference_filename(dataset_name, classifier_name)
+      if tf.gfile.Exists(filename):
+        log.info('Loading reference statistics from %s' % filename)
+        return ActivationStatistics.load(filename)
+    stats = self.activation_statistics(sess, batches, **kwargs)
+    if filename is not None:
+      tf.gfile.MakeDirs(self.cache_dir)
+      stats.save(filename)
+      log.info('Saved reference statistics of %d images to %s' % (stats.count, filename))
+    return stats
+
+  def frechet_distance(self, sess, reference, batches=None, num_batches=None, feed_dict=None):
+    """FID of a stream of images against reference `ActivationStatistics`."""
+    stats = self.activation_statistics(sess, batches, num_batches, feed_dict)
+    return frechet_distance_from_statistics(reference.mean, reference.cov, stats.mean, stats.cov)
+
+  def classifier_score(self, sess, batches=None, num_batches=None, feed_dict=None):
+    """Classifier score of a stream of images, `classifier_fn` gives logits."""
+    return self._run_batches(sess, ClassifierScoreStatistics(), batches, num_batches,
+                             feed_dict).score
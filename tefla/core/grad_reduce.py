@@ -0,0 +1,132 @@
+"""Averaging of the gradients of multiple towers.
+
+Dense gradients are flattened and concatenated, per tower, into buckets of a
+bounded size; each bucket is then reduced across the towers with a single
+`add_n` (or a NCCL all-reduce on GPUs) and split back into the gradients. This
+creates a few large ops instead of several small ops per variable.
+`IndexedSlices` gradients are averaged sparsely, by concatenating their indices
+and values.
+"""
+from __future__ import division, print_function, absolute_import
+
+import tensorflow as tf
+
+from . import logger as log
+
+REDUCTION_METHODS = ('concat', 'add_n', 'nccl')
+
+
+def _is_gpu(device):
+  return device is not None and 'gpu' in device.lower()
+
+
+def _nccl_all_sum():
+  try:
+    from tensorflow.contrib import nccl
+    return nccl.all_sum
+  except ImportError:
+    return None
+
+
+def _average_sparse(grads, num_towers):
+  indices = tf.concat([g.indices for g in grads], 0)
+  values = tf.concat([g.values for g in grads], 0) / num_towers
+  return tf.IndexedSlices(values, indices, grads[0].dense_shape)
+
+
+def _average_concat(grads):
+  """Former per variable average, expanded, concatenated and reduced."""
+  return tf.reduce_mean(tf.concat([tf.expand_dims(g, 0) for g in grads], 0), 0)
+
+
+def _buckets(grads_and_vars, bucket_size):
+  """Groups the indices of dense gradients with static shapes by dtype into buckets."""
+  buckets = []
+  open_buckets = {}
+  for i, (grad, _) in enumerate(grads_and_vars):
+    dtype = grad.dtype.base_dtype
+    size = grad.get_shape().num_elements() * dtype.size
+    bucket = open_buckets.get(dtype)
+    if bucket is None or (bucket[1] + size > bucket_size and bucket[0]):
+      bucket = [[], 0]
+      buckets.append(bucket[0])
+      open_buckets[dtype] = bucket
+    bucket[0].append(i)
+    bucket[1] += size
+  return buckets
+
+
+def _reduce_bucket(tower_grads, indices, method, reduce_device):
+  """Averages the gradients `indices` of all the towers as a single flat tensor."""
+  num_towers = len(tower_grads)
+  shapes = [tower_grads[0][i][0].get_shape() for i in indices]
+  sizes = [shape.num_elements() for shape in shapes]
+  flats = []
+  for grads_and_vars in tower_grads:
+    grads = [grads_and_vars[i][0] for i in indices]
+    with tf.device(grads[0].device):
+      flats.append(tf.concat([tf.reshape(g, [-1]) for g in grads], 0))
+
+  if reduce_device is None:
+    reduce_device = tower_grads[0][indices[0]][1].device
+  all_sum = _nccl_all_sum() if method == 'nccl' else None
+  if all_sum is not None and all(_is_gpu(flat.device) for flat in flats):
+    sums = all_sum(flats)
+    # the all-reduce is a collective, the ops of all the devices must run
+    with tf.device(flats[0].device), tf.control_dependencies(sums):
+      total = tf.identity(sums[0])
+  else:
+    if method == 'nccl':
+      log.debug('NCCL is not available for devices %s, using add_n' % [f.device for f in flats])
+    with tf.device(reduce_device):
+      total = tf.add_n(flats)
+  with tf.device(reduce_device):
+    mean = total * (1.0 / num_towers)
+    return [tf.reshape(g, shape) for g, shape in zip(tf.split(mean, sizes, 0), shapes)]
+
+
+def average_gradients(tower_grads, method='add_n', bucket_size_mb=32, reduce_device=None):
+  """Averages the gradients of the towers.
+
+  Args:
+    tower_grads: a list, per tower, of the `(gradient, variable)` lists
+      returned by `compute_gradients`, in the same variable order.
+    method: `add_n` for bucketed `add_n` reductions, `nccl` for bucketed NCCL
+      all-reduces, falling back to `add_n` when NCCL or GPUs are not available,
+      or `concat` for the unbucketed per variable mean.
+    bucket_size_mb: maximum size of a bucket in MB.
+    reduce_device: device of the reductions, the device of the variables of
+      each bucket if None.
+
+  Returns:
+    the list of averaged `(gradient, variable)`.
+  """
+  if method not in REDUCTION_METHODS:
+    raise ValueError('Unknown gradient reduction %s, expected one of %s' % (method,
+                                                                           REDUCTION_METHODS))
+  num_towers = len(tower_grads)
+  if num_towers == 1:
+    return list(tower_grads[0])
+  average_grads = list(tower_grads[0])
+  bucketed = []
+  for i, grad_and_vars in enumerate(zip(*tower_grads)):
+    grads = [g for g, _ in grad_and_vars]
+    var = grad_and_vars[0][1]
+    if grads[0] is None:
+      average_grads[i] = (None, var)
+    elif isinstance(grads[0], tf.IndexedSlices):
+      with tf.device(reduce_device or var.device):
+        average_grads[i] = (_average_sparse(grads, num_towers), var)
+    elif method == 'concat' or not grads[0].get_shape().is_fully_defined():
+      with tf.device(reduce_device or var.device):
+        average_grads[i] = (_average_concat(grads), var)
+    else:
+      bucketed.append(i)
+
+  dense = [tower_grads[0][i] for i in bucketed]
+  for bucket in _buckets(dense, bucket_size_mb * 1024 * 1024):
+    indices = [bucketed[j] for j in bucket]
+    averages = _reduce_bucket(tower_grads, indices, method, reduce_device)
+    for i, grad in zip(indices, averages):
+      average_grads[i] = (grad, tower_grads[0][i][1])
+  return average_grads
@@ -3,6 +3,7 @@ from __future__ import division, print_function, absolute_import
 import functools
 
 from .. import convert
+from ..da import data
 from ..da import iterator
 from . import logger
 
@@ -87,11 +88,28 @@ def create_training_iters(cnf,
   return training_iterator, validation_iterator
 
 
-def convert_preprocessor(im_size):
-  return functools.partial(convert.convert, target_size=im_size)
+def convert_preprocessor(im_size, fast_decode=False, cache_dir=None):
+  """Preprocessor cropping and resizing images as `tefla.convert.convert`.
 
-
-def create_prediction_iter(cnf, standardizer, crop_size, preprocessor=None, sync=False):
+  Args:
+      im_size: int, size of the converted images
+      fast_decode: a bool, decode JPEGs at reduced resolution, off by default
+          as it changes the pixels fed to the models
+      cache_dir: optional directory to cache the converted images in
+  """
+  preprocessor = functools.partial(convert.convert, target_size=im_size, fast_decode=fast_decode)
+  if cache_dir is not None:
+    preprocessor = data.CachedPreprocessor(preprocessor, cache_dir)
+  return preprocessor
+
+
+def create_prediction_iter(cnf,
+                           standardizer,
+                           crop_size,
+                           preprocessor=None,
+                           sync=False,
+                           image_size=None,
+                           cache_dir=None):
   """Creates prediction iterator to access and augment the dataset.
 
   Args:
@@ -100,7 +118,13 @@ def create_prediction_iter(cnf, standardizer, crop_size, preprocessor=None, sync
       crop_size: training time crop_size of the data samples
       preprocessor: data processing or cropping function
       sync: a bool, if False, used parallel iterator
+      image_size: optional int, if given and `preprocessor` is None, images
+          are decoded at reduced resolution and resized to this size
+      cache_dir: optional directory to cache the resized images in, used with
+          `image_size`
   """
+  if preprocessor is None and image_size is not None:
+    preprocessor = data.reduced_preprocessor(image_size, cache_dir)
   if sync:
     prediction_iterator_maker = iterator.DAIterator
   else:
@@ -1996,6 +1996,18 @@ def batch_norm_tf(x, name='bn', scale=False, fused=False, is_training=False, dec
         ValueError: if the rank of `inputs` is undefined.
         ValueError: if rank or channels dimension of `inputs` is undefined.
     """
+  if x.dtype.base_dtype == tf.float16 and not fused:
+    # the fused batch norm keeps float32 parameters and statistics for float16
+    # inputs, the non fused batch norm is computed in float32
+    output = tf.layers.batch_normalization(
+        tf.cast(x, tf.float32),
+        name=name,
+        scale=scale,
+        training=is_training,
+        fused=fused,
+        momentum=decay,
+        **kwargs)
+    return tf.cast(output, tf.float16)
   return tf.layers.batch_normalization(
       x, name=name, scale=scale, training=is_training, fused=fused, momentum=decay, **kwargs)
 
@@ -2059,6 +2071,9 @@ def batch_norm_lasagne(x,
         ValueError: if the rank of `x` is undefined.
         ValueError: if rank or channels dimension of `inputs` is undefined.
     """
+  # statistics and parameters are kept in float32 for float16 inputs
+  input_dtype = x.dtype.base_dtype
+  x = tf.cast(x, tf.float32)
   with tf.variable_scope(name, reuse=reuse):
     beta = tf.get_variable(
         name='beta', initializer=tf.constant(0.0, shape=[x.get_shape()[-1]]), trainable=trainable)
@@ -2111,7 +2126,7 @@ def batch_norm_lasagne(x,
           inv *= scale
         return x * inv + (offset - mean * inv if offset is not None else -mean * inv)
 
-    output = _batch_normalization(x, mean, inv_std, beta, gamma)
+    output = tf.cast(_batch_normalization(x, mean, inv_std, beta, gamma), input_dtype)
     return _collect_named_outputs(outputs_collections, name, output)
 
 
@@ -5,6 +5,7 @@
 # -------------------------------------------------------------------#
 from __future__ import division, print_function, absolute_import
 
+import functools
 import os
 import time
 from collections import defaultdict
@@ -28,7 +29,11 @@ class SupervisedLearner(Base, BaseMixin):
 
   Args:
       model: model definition
-      cnf: dict, training configs
+      cnf: dict, training configs; `cnf['input_dtype']` is the dtype of the input
+          placeholders, e.g. 'uint8' to reduce the host to device transfers. An
+          integer dtype needs iterators emitting raw integer batches, without
+          standardizer, and the standardization done in the model; float batches
+          raise a ValueError instead of being truncated.
       training_iterator: iterator to use for training data access, processing and augmentations
       validation_iterator: iterator to use for validation data access, processing and augmentations
       start_epoch: int, training start epoch; for resuming training provide the last
@@ -84,6 +89,7 @@ class SupervisedLearner(Base, BaseMixin):
     training_X, training_y, validation_X, validation_y = \
         data_set.training_X, data_set.training_y, data_set.validation_X, data_set.validation_y
     saver = tf.train.Saver(max_to_keep=None)
+    async_saver = self._async_checkpoint_saver()
     if not os.path.exists(weights_dir):
       tf.gfile.MakeDirs(weights_dir)
     if self.is_summary:
@@ -107,160 +113,150 @@ class SupervisedLearner(Base, BaseMixin):
       log.info("Initial learning rate: %f " % learning_rate_value)
       if self.is_summary:
         train_writer, validation_writer = summary.create_summary_writer(
-            self.cnf.get('summary_dir', '/tmp/tefla-summary'), sess)
+            self.cnf.get('summary_dir', '/tmp/tefla-summary'),
+            sess,
+            flush_secs=self.cnf.get('summary_flush_secs', 120))
 
       seed_delta = 100
       training_history = []
       batch_iter_idx = 1
       n_iters_per_epoch = len(data_set.training_X) // self.training_iterator.batch_size
-      self.lr_policy.n_iters_per_epoch = n_iters_per_epoch
+      self.lr_policy.n_iters_per_epoch = max(n_iters_per_epoch // self.accumulate_steps, 1)
       self.total_network_params()
       self.write_graph(sess.graph_def, weights_dir)
-      for epoch in range(start_epoch, self.num_epochs + 1):
-        np.random.seed(epoch + seed_delta)
-        tf.set_random_seed(epoch + seed_delta)
-        tic = time.time()
-        training_losses = []
-        batch_train_sizes = []
-
-        for batch_num, (Xb, yb) in enumerate(self.training_iterator(training_X, training_y)):
-          if Xb.shape[0] < self.cnf['batch_size_train']:
-            continue
-          feed_dict_train = {
-              self.inputs: Xb,
-              self.labels: self._adjust_ground_truth(yb),
-              self.learning_rate: learning_rate_value
-          }
-
-          log.debug('1. Loading batch %d data done.' % batch_num)
-          if epoch % summary_every == 0 and self.is_summary and training_batch_summary_op \
-                  is not None:
-            log.debug('2. Running training steps with summary...')
-            training_loss_e, summary_str_train, _ = sess.run(
-                [self.training_loss, training_batch_summary_op, self.train_op],
-                feed_dict=feed_dict_train)
+      try:
+        for epoch in range(start_epoch, self.num_epochs + 1):
+          np.random.seed(epoch + seed_delta)
+          tf.set_random_seed(epoch + seed_delta)
+          tic = time.time()
+          training_losses = []
+          batch_train_sizes = []
+
+          batches = ((Xb, yb)
+                     for Xb, yb in self.training_iterator(training_X, training_y)
+                     if Xb.shape[0] >= self.cnf['batch_size_train'])
+          for batch_num, (Xb, feed_dict_train) in enumerate(self._training_feeds(sess, batches)):
+            feed_dict_train[self.learning_rate] = learning_rate_value
+
+            log.debug('1. Loading batch %d data done.' % batch_num)
+            if epoch % summary_every == 0 and self.is_summary and training_batch_summary_op \
+                    is not None:
+              log.debug('2. Running training steps with summary...')
+              step = self._run_training_step(sess, feed_dict_train, training_batch_summary_op)
+              train_writer.add_summary(step['summary'], epoch)
+              log.debug('2. Running training steps with summary done.')
+              log.debug("Epoch %d, Batch %d training loss: %s" % (epoch, batch_num, step['loss']))
+            else:
+              log.debug('2. Running training steps without summary...')
+              step = self._run_training_step(sess, feed_dict_train)
+              log.debug('2. Running training steps without summary done.')
+
+            training_losses.append(step['loss'])
+            batch_train_sizes.append(len(Xb))
+
+            if step['applied']:
+              learning_rate_value = self.lr_policy.batch_update(learning_rate_value, batch_iter_idx)
+              batch_iter_idx += 1
+            log.debug('4. Training batch %d done.' % batch_num)
+
+          epoch_training_loss = np.average(training_losses, weights=batch_train_sizes)
+
+          # Plot training loss every epoch
+          log.debug('5. Writing epoch summary...')
+          if self.is_summary:
+            summary_str_train = sess.run(
+                training_epoch_summary_op,
+                feed_dict={
+                    self.epoch_loss: epoch_training_loss,
+                    self.learning_rate: learning_rate_value
+                })
             train_writer.add_summary(summary_str_train, epoch)
-            train_writer.flush()
-            log.debug('2. Running training steps with summary done.')
-            log.debug("Epoch %d, Batch %d training loss: %s" % (epoch, batch_num, training_loss_e))
-            log.debug("Epoch %d, Batch %d training predictions: %s" % (epoch, batch_num,
-                                                                       training_predictions_e))
-          else:
-            log.debug('2. Running training steps without summary...')
-            training_loss_e, _ = sess.run([self.training_loss, self.train_op],
-                                          feed_dict=feed_dict_train)
-            log.debug('2. Running training steps without summary done.')
-
-          training_losses.append(training_loss_e)
-          batch_train_sizes.append(len(Xb))
-
-          if self.update_ops is not None:
-            log.debug('3. Running update ops...')
-            sess.run(self.update_ops, feed_dict=feed_dict_train)
-            log.debug('3. Running update ops done.')
-
-          learning_rate_value = self.lr_policy.batch_update(learning_rate_value, batch_iter_idx)
-          batch_iter_idx += 1
-          log.debug('4. Training batch %d done.' % batch_num)
-
-        epoch_training_loss = np.average(training_losses, weights=batch_train_sizes)
-
-        # Plot training loss every epoch
-        log.debug('5. Writing epoch summary...')
-        if self.is_summary:
-          summary_str_train = sess.run(
-              training_epoch_summary_op,
-              feed_dict={
-                  self.epoch_loss: epoch_training_loss,
-                  self.learning_rate: learning_rate_value
-              })
-          train_writer.add_summary(summary_str_train, epoch)
-          train_writer.flush()
-        log.debug('5. Writing epoch summary done.')
-
-        # Validation prediction and metrics
-        validation_losses = []
-        batch_validation_metrics = [[] for _, _ in self.validation_metrics_def]
-        epoch_validation_metrics = []
-        batch_validation_sizes = []
-        for batch_num, (validation_Xb, validation_yb) in enumerate(
-            self.validation_iterator(validation_X, validation_y)):
-          if validation_Xb.shape[0] < self.cnf['batch_size_test']:
-            continue
-          feed_dict_validation = {
-              self.validation_inputs: validation_Xb,
-              self.validation_labels: self._adjust_ground_truth(validation_yb)
-          }
-          log.debug('6. Loading batch %d validation data done.' % batch_num)
-
-          if (epoch - 1) % summary_every == 0 and self.is_summary and \
-                  validation_batch_summary_op is not None:
-            log.debug('7. Running validation steps with summary...')
-            _validation_metric, _validation_loss, summary_str_validate = sess.run(
-                [
-                    self.validation_metrics_update_ops, self.validation_loss,
-                    validation_batch_summary_op
-                ],
-                feed_dict=feed_dict_validation)
+          log.debug('5. Writing epoch summary done.')
+
+          # Validation prediction and metrics
+          validation_losses = []
+          batch_validation_metrics = [[] for _, _ in self.validation_metrics_def]
+          epoch_validation_metrics = []
+          batch_validation_sizes = []
+          for batch_num, (validation_Xb, validation_yb) in enumerate(
+              self.validation_iterator(validation_X, validation_y)):
+            if validation_Xb.shape[0] < self.cnf['batch_size_test']:
+              continue
+            self._check_input_batch(self.validation_inputs, validation_Xb)
+            feed_dict_validation = {
+                self.validation_inputs: validation_Xb,
+                self.validation_labels: self._adjust_ground_truth(validation_yb)
+            }
+            log.debug('6. Loading batch %d validation data done.' % batch_num)
+
+            if (epoch - 1) % summary_every == 0 and self.is_summary and \
+                    validation_batch_summary_op is not None:
+              log.debug('7. Running validation steps with summary...')
+              _validation_metric, _validation_loss, summary_str_validate = sess.run(
+                  [
+                      self.validation_metrics_update_ops, self.validation_loss,
+                      validation_batch_summary_op
+                  ],
+                  feed_dict=feed_dict_validation)
+              validation_writer.add_summary(summary_str_validate, epoch)
+              log.debug('7. Running validation steps with summary done.')
+              log.debug(
+                  "Epoch %d, Batch %d validation loss: %s" % (epoch, batch_num, _validation_loss))
+              log.debug("Epoch %d, Batch %d validation predictions: %s" % (epoch, batch_num,
+                                                                           _validation_metric[0]))
+            else:
+              log.debug('7. Running validation steps without summary...')
+              _validation_metric, _validation_loss = sess.run(
+                  [self.validation_metrics_update_ops, self.validation_loss],
+                  feed_dict=feed_dict_validation)
+              log.debug('7. Running validation steps without summary done.')
+            validation_losses.append(_validation_loss)
+            batch_validation_sizes.append(self.cnf.get('batch_size_test', 32))
+
+            log.debug('8. Validation batch %d done' % batch_num)
+
+          epoch_validation_loss = np.average(validation_losses, weights=batch_validation_sizes)
+          epoch_validation_metrics = sess.run(self.validation_metric)
+          # flush out metrics local variables
+          sess.run(tf.variables_initializer(self.metrics_local_vars))
+          # Write validation epoch summary every epoch
+          log.debug('9. Writing epoch validation summary...')
+          if self.is_summary:
+            summary_str_validate = sess.run(
+                validation_epoch_summary_op,
+                feed_dict={
+                    self.epoch_loss: epoch_validation_loss,
+                    self.validation_metric_placeholders: epoch_validation_metrics
+                })
             validation_writer.add_summary(summary_str_validate, epoch)
-            validation_writer.flush()
-            log.debug('7. Running validation steps with summary done.')
-            log.debug(
-                "Epoch %d, Batch %d validation loss: %s" % (epoch, batch_num, _validation_loss))
-            log.debug("Epoch %d, Batch %d validation predictions: %s" % (epoch, batch_num,
-                                                                         _validation_metric[0]))
-          else:
-            log.debug('7. Running validation steps without summary...')
-            _validation_metric, _validation_loss = sess.run(
-                [self.validation_metrics_update_ops, self.validation_loss],
-                feed_dict=feed_dict_validation)
-            log.debug('7. Running validation steps without summary done.')
-          validation_losses.append(_validation_loss)
-          batch_validation_sizes.append(self.cnf.get('batch_size_test', 32))
-
-          log.debug('8. Validation batch %d done' % batch_num)
-
-        epoch_validation_loss = np.average(validation_losses, weights=batch_validation_sizes)
-        epoch_validation_metrics = sess.run(self.validation_metric)
-        # flush out metrics local variables
-        sess.run(tf.variables_initializer(self.metrics_local_vars))
-        # Write validation epoch summary every epoch
-        log.debug('9. Writing epoch validation summary...')
-        if self.is_summary:
-          summary_str_validate = sess.run(
-              validation_epoch_summary_op,
-              feed_dict={
-                  self.epoch_loss: epoch_validation_loss,
-                  self.validation_metric_placeholders: epoch_validation_metrics
-              })
-          validation_writer.add_summary(summary_str_validate, epoch)
-          validation_writer.flush()
-        log.debug('9. Writing epoch validation summary done.')
-
-        custom_metrics_string = [
-            ', %s: %.3f' % ('Validation ' + name, epoch_validation_metrics[i])
-            for i, name in enumerate(self.updated_metrics_name)
-        ]
-        custom_metrics_string = ''.join(custom_metrics_string)
-
-        log.info(
-            "Epoch %d [(%s, %s) images, %6.1fs]: t-loss: %.3f, v-loss: %.3f%s" %
-            (epoch, np.sum(batch_train_sizes), np.sum(batch_validation_sizes), time.time() - tic,
-             epoch_training_loss, epoch_validation_loss, custom_metrics_string))
-
-        if self.swapped_saver is not None:
-          self.swapped_saver.save(sess, "%s/model-epoch-%d.ckpt" % (weights_dir, epoch))
-        else:
-          saver.save(sess, "%s/model-epoch-%d.ckpt" % (weights_dir, epoch))
-
-        epoch_info = dict(
-            epoch=epoch, training_loss=epoch_training_loss, validation_loss=epoch_validation_loss)
-
-        training_history.append(epoch_info)
-
-        log.debug('10. Epoch done. [%d]' % epoch)
-        learning_rate_value = self.lr_policy.epoch_update(learning_rate_value, training_history)
-        log.info("Learning rate: %f " % learning_rate_value)
+          log.debug('9. Writing epoch validation summary done.')
+
+          custom_metrics_string = [
+              ', %s: %.3f' % ('Validation ' + name, epoch_validation_metrics[i])
+              for i, name in enumerate(self.updated_metrics_name)
+          ]
+          custom_metrics_string = ''.join(custom_metrics_string)
+
+          log.info(
+              "Epoch %d [(%s, %s) images, %6.1fs]: t-loss: %.3f, v-loss: %.3f%s" %
+              (epoch, np.sum(batch_train_sizes), np.sum(batch_validation_sizes), time.time() - tic,
+               epoch_training_loss, epoch_validation_loss, custom_metrics_string))
+
+          self._save_checkpoint(sess, saver, async_saver, weights_dir, epoch,
+                                epoch_validation_loss)
+
+          epoch_info = dict(
+              epoch=epoch, training_loss=epoch_training_loss, validation_loss=epoch_validation_loss)
+
+          training_history.append(epoch_info)
+
+          log.debug('10. Epoch done. [%d]' % epoch)
+          learning_rate_value = self.lr_policy.epoch_update(learning_rate_value, training_history)
+          log.info("Learning rate: %f " % learning_rate_value)
+      finally:
+        # flushes the queued checkpoints, also if training failed
+        if async_saver is not None:
+          async_saver.close()
       if self.is_summary:
         train_writer.close()
         validation_writer.close()
@@ -358,8 +354,16 @@ class SupervisedLearner(Base, BaseMixin):
     if self.cnf.get('moving_avg', False):
       log.info('Using Moving Average Optimizer')
       optimizer = MovingAverageOptimizer(optimizer)
+    # uint8 or float16 inputs reduce the host to device transfers, the inputs
+    # are cast to the compute dtype in the towers
+    input_dtype = tf.as_dtype(self.cnf.get('input_dtype', 'float32'))
+    if input_dtype.is_integer:
+      for iterator in (self.training_iterator, self.validation_iterator):
+        if getattr(iterator, 'standardizer', None) is not None:
+          raise ValueError('cnf[\'input_dtype\'] is %s, the iterators must emit raw %s batches '
+                           'without standardizer' % (input_dtype.name, input_dtype.name))
     self.inputs = tf.placeholder(
-        tf.float32, shape=(self.cnf['batch_size_train'],) + self.cnf['input_size'], name="input")
+        input_dtype, shape=(self.cnf['batch_size_train'],) + self.cnf['input_size'], name="input")
     if self.loss_type == 'kappa_log':
       self.labels = tf.placeholder(tf.int64, shape=(self.cnf['batch_size_train'], self.num_classes))
       self.validation_labels = tf.placeholder(
@@ -373,23 +377,29 @@ class SupervisedLearner(Base, BaseMixin):
       self.labels = tf.placeholder(tf.int64, shape=(self.cnf['batch_size_train'],))
       self.validation_labels = tf.placeholder(tf.int64, shape=(self.cnf['batch_size_test'],))
     self.validation_inputs = tf.placeholder(
-        tf.float32,
+        input_dtype,
         shape=(self.cnf['batch_size_test'],) + self.cnf['input_size'],
         name="validation_input")
+    if self.cnf.get('stage_inputs', False):
+      self._stage_inputs()
     self.grads_and_vars, self.training_loss = self._process_towers_grads(
         optimizer, self.model, is_classification=self.classification)
     self.validation_loss, self.validation_predictions, self.validation_metric, \
         self.validation_metrics_update_ops = self._process_towers_loss(
                optimizer, self.model, is_classification=self.classification)
 
+    clip_fn = None
     if self.clip_norm and not self.clip_by_global_norm:
-      self.grads_and_vars = self._clip_grad_norms(self.grads_and_vars, max_norm=self.norm_threshold)
-    apply_gradients_op = optimizer.apply_gradients(self.grads_and_vars)
+      clip_fn = functools.partial(self._clip_grad_norms, max_norm=self.norm_threshold)
+    self.grads_and_vars, apply_gradients_op = self._apply_gradients(optimizer, self.grads_and_vars,
+                                                                    clip_fn)
     if self.cnf.get('moving_avg', False):
       log.info('Using Swapped Saver')
       self.swapped_saver = optimizer.swapping_saver()
+      self.swapped_var_list = optimizer.swapping_var_list()
     else:
       self.swapped_saver = None
+      self.swapped_var_list = None
     if keep_moving_averages:
       variables_averages_op = self._moving_averages_op()
       with tf.control_dependencies([apply_gradients_op, variables_averages_op]):
@@ -105,7 +105,7 @@ class GenerativeLearner(Base):
 
     # pylint: disable=no-value-for-parameter
     if weights_from:
-      self._load_weights(sess, weights_from)
+      self._load_weights(sess, saver, weights_from)
 
     self.total_network_params()
     self.write_graph(sess.graph_def, weights_dir)
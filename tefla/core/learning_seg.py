@@ -1,5 +1,6 @@
 from __future__ import division, print_function, absolute_import
 
+import functools
 import os
 import time
 import traceback
@@ -143,7 +144,7 @@ class SupervisedLearner(Base, BaseMixin):
     training_history = []
     batch_iter_idx = 1
     n_iters_per_epoch = self.data_voc.n_iters_per_epoch
-    self.lr_policy.n_iters_per_epoch = n_iters_per_epoch
+    self.lr_policy.n_iters_per_epoch = max(n_iters_per_epoch // self.accumulate_steps, 1)
     self.total_network_params()
     self.write_graph(sess.graph_def, weights_dir)
     coord = tf.train.Coordinator()
@@ -162,36 +163,30 @@ class SupervisedLearner(Base, BaseMixin):
           log.debug('1. Loading batch %d data done.' % batch_num)
           if epoch % summary_every == 0 and self.is_summary:
             log.debug('2. Running training steps with summary...')
-            training_predictions_e, training_loss_e, summary_str_train, _ = sess.run(
-                [
-                    self.training_predictions, self.training_loss, training_batch_summary_op,
-                    self.train_op
-                ],
-                feed_dict=feed_dict_train)
-            train_writer.add_summary(summary_str_train, epoch)
+            step = self._run_training_step(
+                sess,
+                feed_dict_train,
+                training_batch_summary_op,
+                extra_fetches={'predictions': self.training_predictions})
+            train_writer.add_summary(step['summary'], epoch)
             train_writer.flush()
             log.debug('2. Running training steps with summary done.')
-            log.debug("Epoch %d, Batch %d training loss: %s" % (epoch, batch_num, training_loss_e))
+            log.debug("Epoch %d, Batch %d training loss: %s" % (epoch, batch_num, step['loss']))
             log.debug("Epoch %d, Batch %d training predictions: %s" % (epoch, batch_num,
-                                                                       training_predictions_e))
+                                                                       step['predictions']))
           else:
             log.debug('2. Running training steps without summary...')
-            training_loss_e, _ = sess.run([self.training_loss, self.train_op],
-                                          feed_dict=feed_dict_train)
+            step = self._run_training_step(sess, feed_dict_train)
             log.debug('2. Running training steps without summary done.')
 
-          training_losses.append(training_loss_e)
+          training_losses.append(step['loss'])
           batch_train_sizes.append(self.cnf['batch_size_train'])
           log.info("Batch Num %d [Time: %6.1fs]: t-loss: %.3f" % (batch_num, time.time() - tic,
-                                                                  training_loss_e))
+                                                                  step['loss']))
 
-          if self.update_ops is not None:
-            log.debug('3. Running update ops...')
-            sess.run(self.update_ops, feed_dict=feed_dict_train)
-            log.debug('3. Running update ops done.')
-
-          learning_rate_value = self.lr_policy.batch_update(learning_rate_value, batch_iter_idx)
-          batch_iter_idx += 1
+          if step['applied']:
+            learning_rate_value = self.lr_policy.batch_update(learning_rate_value, batch_iter_idx)
+            batch_iter_idx += 1
           log.info("Learning rate: %f " % learning_rate_value)
           log.debug('4. Training batch %d done.' % batch_num)
 
@@ -288,9 +283,11 @@ class SupervisedLearner(Base, BaseMixin):
     self.grads_and_vars, self.training_loss = self._process_towers_grads(
         optimizer, self.model, is_classification=self.classification, loss_type=self.loss_type)
 
+    clip_fn = None
     if self.clip_norm and not self.clip_by_global_norm:
-      self.grads_and_vars = self._clip_grad_norms(self.grads_and_vars, max_norm=self.norm_threshold)
-    apply_gradients_op = optimizer.apply_gradients(self.grads_and_vars)
+      clip_fn = functools.partial(self._clip_grad_norms, max_norm=self.norm_threshold)
+    self.grads_and_vars, apply_gradients_op = self._apply_gradients(optimizer, self.grads_and_vars,
+                                                                    clip_fn)
     if keep_moving_averages:
       variables_averages_op = self._moving_averages_op()
       with tf.control_dependencies([apply_gradients_op, variables_averages_op]):
@@ -5,6 +5,7 @@
 # -------------------------------------------------------------------#
 from __future__ import division, print_function, absolute_import
 
+import functools
 import os
 import time
 
@@ -186,6 +187,7 @@ class SupervisedLearner(Base, BaseMixin):
                   summary_every,
                   max_to_keep=None):
     saver = tf.train.Saver(max_to_keep=max_to_keep)
+    async_saver = self._async_checkpoint_saver(max_to_keep)
     weights_dir = "weights"
     if not os.path.exists(weights_dir):
       tf.gfile.MakeDirs(weights_dir)
@@ -202,7 +204,7 @@ class SupervisedLearner(Base, BaseMixin):
     if start_epoch > 1:
       weights_from = "weights/model-epoch-%d.ckpt" % (start_epoch - 1)
 
-    sess.run(tf.global_variables_initializer())
+    sess.run([tf.global_variables_initializer(), tf.local_variables_initializer()])
     if weights_from:
       self._load_weights(sess, saver, weights_from)
 
@@ -212,7 +214,8 @@ class SupervisedLearner(Base, BaseMixin):
       summary_dir = self.cnf.get('summary_dir', '/tmp/tefla-summary')
       if not os.path.exists(summary_dir):
         tf.gfile.MakeDirs(summary_dir)
-      train_writer, validation_writer = summary.create_summary_writer(summary_dir, sess)
+      train_writer, validation_writer = summary.create_summary_writer(
+          summary_dir, sess, flush_secs=self.cnf.get('summary_flush_secs', 120))
 
     seed_delta = 100
     training_history = []
@@ -221,148 +224,142 @@ class SupervisedLearner(Base, BaseMixin):
     diff_probs = self._get_diff_prob(current_probs)
     batch_iter_idx = 1
     n_iters_per_epoch = dataset.n_iters_per_epoch
-    self.lr_policy.n_iters_per_epoch = n_iters_per_epoch
+    self.lr_policy.n_iters_per_epoch = max(n_iters_per_epoch // self.accumulate_steps, 1)
     self.total_network_params()
     self.write_params()
     self.write_graph(sess.graph_def, weights_dir)
     coord = tf.train.Coordinator()
     tf.train.start_queue_runners(sess=sess, coord=coord)
-    for epoch in range(start_epoch, self.num_epochs + 1):
-      np.random.seed(epoch + seed_delta)
-      tf.set_random_seed(epoch + seed_delta)
-      tic = time.time()
-      training_losses = []
-      batch_train_sizes = []
-
-      for batch_num in range(1, n_iters_per_epoch + 1):
-        feed_dict_train = {
-            self.learning_rate: learning_rate_value,
-            self.target_probs: list(current_probs)
-        }
-
-        log.debug('1. Loading batch %d data done.' % batch_num)
-        if epoch % summary_every == 0 and self.is_summary:
-          log.debug('2. Running training steps with summary...')
-          training_predictions_e, training_loss_e, summary_str_train, _ = sess.run(
-              [
-                  self.training_predictions, self.training_loss, training_batch_summary_op,
-                  self.train_op
-              ],
-              feed_dict=feed_dict_train)
-          train_writer.add_summary(summary_str_train, epoch)
-          train_writer.flush()
-          log.debug('2. Running training steps with summary done.')
-          log.debug("Epoch %d, Batch %d training loss: %s" % (epoch, batch_num, training_loss_e))
-          log.debug("Epoch %d, Batch %d training predictions: %s" % (epoch, batch_num,
-                                                                     training_predictions_e))
-        else:
-          log.debug('2. Running training steps without summary...')
-          training_loss_e, _ = sess.run([self.training_loss, self.train_op],
-                                        feed_dict=feed_dict_train)
-          log.debug('2. Running training steps without summary done.')
-
-        training_losses.append(training_loss_e)
-        batch_train_sizes.append(self.cnf['batch_size_train'])
-
-        if self.update_ops is not None:
-          log.debug('3. Running update ops...')
-          sess.run(self.update_ops, feed_dict=feed_dict_train)
-          log.debug('3. Running update ops done.')
-
-        learning_rate_value = self.lr_policy.batch_update(learning_rate_value, batch_iter_idx)
-        batch_iter_idx += 1
-        log.debug('4. Training batch %d done.' % batch_num)
-
-      current_probs += diff_probs
-      log.debug('The value of current_probs {}'.format(current_probs))
-      epoch_training_loss = np.average(training_losses, weights=batch_train_sizes)
-      log.info("Epoch %d [(%s) images, %6.1fs]: t-loss: %.3f" %
-               (epoch, np.sum(batch_train_sizes), time.time() - tic, epoch_training_loss))
-
-      # Plot training loss every epoch
-      log.debug('5. Writing epoch summary...')
-      if self.is_summary:
-        summary_str_train = sess.run(
-            training_epoch_summary_op,
-            feed_dict={
-                self.epoch_loss: epoch_training_loss,
-                self.learning_rate: learning_rate_value
-            })
-        train_writer.add_summary(summary_str_train, epoch)
-        train_writer.flush()
-      log.debug('5. Writing epoch summary done.')
-
-      # Validation prediction and metrics
-      validation_losses = []
-      batch_validation_metrics = [[] for _, _ in self.validation_metrics_def]
-      epoch_validation_metrics = []
-      epoch_validation_loss = 0
-      batch_validation_sizes = []
-      if dataset_val is not None:
-        for batch_num in range(dataset_val.n_iters_per_epoch):
-          log.debug('6. Loading batch %d validation data done.' % batch_num)
-
-          if (epoch - 1) % summary_every == 0 and self.is_summary:
-            log.debug('7. Running validation steps with summary...')
-            _validation_metric, summary_str_validate = sess.run(
-                [self.validation_metric, validation_batch_summary_op])
-            validation_writer.add_summary(summary_str_validate, epoch)
-            validation_writer.flush()
-            log.debug('7. Running validation steps with summary done.')
-            log.debug("Epoch %d, Batch %d validation loss: %s" % (epoch, batch_num,
-                                                                  _validation_metric[-1]))
-            log.debug("Epoch %d, Batch %d validation predictions: %s" % (epoch, batch_num,
-                                                                         _validation_metric[0]))
+    try:
+      for epoch in range(start_epoch, self.num_epochs + 1):
+        np.random.seed(epoch + seed_delta)
+        tf.set_random_seed(epoch + seed_delta)
+        tic = time.time()
+        training_losses = []
+        batch_train_sizes = []
+
+        for batch_num in range(1, n_iters_per_epoch + 1):
+          feed_dict_train = {
+              self.learning_rate: learning_rate_value,
+              self.target_probs: list(current_probs)
+          }
+
+          log.debug('1. Loading batch %d data done.' % batch_num)
+          if epoch % summary_every == 0 and self.is_summary:
+            log.debug('2. Running training steps with summary...')
+            step = self._run_training_step(
+                sess,
+                feed_dict_train,
+                training_batch_summary_op,
+                extra_fetches={'predictions': self.training_predictions})
+            train_writer.add_summary(step['summary'], epoch)
+            log.debug('2. Running training steps with summary done.')
+            log.debug("Epoch %d, Batch %d training loss: %s" % (epoch, batch_num, step['loss']))
+            log.debug("Epoch %d, Batch %d training predictions: %s" % (epoch, batch_num,
+                                                                       step['predictions']))
           else:
-            log.debug('7. Running validation steps without summary...')
-            _validation_metric = sess.run(self.validation_metric)
-            log.debug('7. Running validation steps without summary done.')
-          validation_losses.append(_validation_metric[-1])
-          batch_validation_sizes.append(self.cnf['batch_size_test'])
-
-          for i, (_, metric_function) in enumerate(self.validation_metrics_def):
-            batch_validation_metrics[i].append(_validation_metric[i])
-          log.debug('8. Validation batch %d done' % batch_num)
-
-        epoch_validation_loss = np.average(validation_losses, weights=batch_validation_sizes)
-        for i, (_, _) in enumerate(self.validation_metrics_def):
-          epoch_validation_metrics.append(
-              np.average(batch_validation_metrics[i], weights=batch_validation_sizes))
-
-        # Write validation epoch summary every epoch
-        log.debug('9. Writing epoch validation summary...')
+            log.debug('2. Running training steps without summary...')
+            step = self._run_training_step(sess, feed_dict_train)
+            log.debug('2. Running training steps without summary done.')
+
+          training_losses.append(step['loss'])
+          batch_train_sizes.append(self.cnf['batch_size_train'])
+
+          if step['applied']:
+            learning_rate_value = self.lr_policy.batch_update(learning_rate_value, batch_iter_idx)
+            batch_iter_idx += 1
+          log.debug('4. Training batch %d done.' % batch_num)
+
+        current_probs += diff_probs
+        log.debug('The value of current_probs {}'.format(current_probs))
+        epoch_training_loss = np.average(training_losses, weights=batch_train_sizes)
+        log.info("Epoch %d [(%s) images, %6.1fs]: t-loss: %.3f" %
+                 (epoch, np.sum(batch_train_sizes), time.time() - tic, epoch_training_loss))
+
+        # Plot training loss every epoch
+        log.debug('5. Writing epoch summary...')
         if self.is_summary:
-          summary_str_validate = sess.run(
-              validation_epoch_summary_op,
+          summary_str_train = sess.run(
+              training_epoch_summary_op,
               feed_dict={
-                  self.epoch_loss: epoch_validation_loss,
-                  self.validation_metric_placeholders: epoch_validation_metrics
+                  self.epoch_loss: epoch_training_loss,
+                  self.learning_rate: learning_rate_value
               })
-          validation_writer.add_summary(summary_str_validate, epoch)
-          validation_writer.flush()
-        log.debug('9. Writing epoch validation summary done.')
+          train_writer.add_summary(summary_str_train, epoch)
+        log.debug('5. Writing epoch summary done.')
+
+        # Validation prediction and metrics
+        validation_losses = []
+        batch_validation_metrics = [[] for _, _ in self.validation_metrics_def]
+        epoch_validation_metrics = []
+        epoch_validation_loss = 0
+        batch_validation_sizes = []
+        if dataset_val is not None:
+          for batch_num in range(dataset_val.n_iters_per_epoch):
+            log.debug('6. Loading batch %d validation data done.' % batch_num)
+
+            if (epoch - 1) % summary_every == 0 and self.is_summary:
+              log.debug('7. Running validation steps with summary...')
+              _validation_metric, summary_str_validate = sess.run(
+                  [self.validation_metric, validation_batch_summary_op])
+              validation_writer.add_summary(summary_str_validate, epoch)
+              log.debug('7. Running validation steps with summary done.')
+              log.debug("Epoch %d, Batch %d validation loss: %s" % (epoch, batch_num,
+                                                                    _validation_metric[-1]))
+              log.debug("Epoch %d, Batch %d validation predictions: %s" % (epoch, batch_num,
+                                                                           _validation_metric[0]))
+            else:
+              log.debug('7. Running validation steps without summary...')
+              _validation_metric = sess.run(self.validation_metric)
+              log.debug('7. Running validation steps without summary done.')
+            validation_losses.append(_validation_metric[-1])
+            batch_validation_sizes.append(self.cnf['batch_size_test'])
+
+            for i, (_, metric_function) in enumerate(self.validation_metrics_def):
+              batch_validation_metrics[i].append(_validation_metric[i])
+            log.debug('8. Validation batch %d done' % batch_num)
+
+          epoch_validation_loss = np.average(validation_losses, weights=batch_validation_sizes)
+          for i, (_, _) in enumerate(self.validation_metrics_def):
+            epoch_validation_metrics.append(
+                np.average(batch_validation_metrics[i], weights=batch_validation_sizes))
+
+          # Write validation epoch summary every epoch
+          log.debug('9. Writing epoch validation summary...')
+          if self.is_summary:
+            summary_str_validate = sess.run(
+                validation_epoch_summary_op,
+                feed_dict={
+                    self.epoch_loss: epoch_validation_loss,
+                    self.validation_metric_placeholders: epoch_validation_metrics
+                })
+            validation_writer.add_summary(summary_str_validate, epoch)
+          log.debug('9. Writing epoch validation summary done.')
 
-        custom_metrics_string = [
-            ', %s: %.3f' % (name, epoch_validation_metrics[i])
-            for i, (name, _) in enumerate(self.validation_metrics_def)
-        ]
-        custom_metrics_string = ''.join(custom_metrics_string)
+          custom_metrics_string = [
+              ', %s: %.3f' % (name, epoch_validation_metrics[i])
+              for i, (name, _) in enumerate(self.validation_metrics_def)
+          ]
+          custom_metrics_string = ''.join(custom_metrics_string)
 
-      log.info("Epoch %d [(%s, %s) images, %6.1fs]: t-loss: %.3f, v-loss: %.3f%s" %
-               (epoch, np.sum(batch_train_sizes), np.sum(batch_validation_sizes), time.time() - tic,
-                epoch_training_loss, epoch_validation_loss, custom_metrics_string))
+        log.info(
+            "Epoch %d [(%s, %s) images, %6.1fs]: t-loss: %.3f, v-loss: %.3f%s" %
+            (epoch, np.sum(batch_train_sizes), np.sum(batch_validation_sizes), time.time() - tic,
+             epoch_training_loss, epoch_validation_loss, custom_metrics_string))
 
-      if self.swapped_saver is not None:
-        self.swapped_saver.save(sess, "%s/model-epoch-%d.ckpt" % (weights_dir, epoch))
-      else:
-        saver.save(sess, "%s/model-epoch-%d.ckpt" % (weights_dir, epoch))
+        self._save_checkpoint(sess, saver, async_saver, weights_dir, epoch,
+                              epoch_validation_loss)
 
-      epoch_info = dict(
-          epoch=epoch, training_loss=epoch_training_loss, validation_loss=epoch_validation_loss)
+        epoch_info = dict(
+            epoch=epoch, training_loss=epoch_training_loss, validation_loss=epoch_validation_loss)
 
-      training_history.append(epoch_info)
-      learning_rate_value = self.lr_policy.epoch_update(learning_rate_value, training_history)
-      log.info("Learning rate: %f " % learning_rate_value)
+        training_history.append(epoch_info)
+        learning_rate_value = self.lr_policy.epoch_update(learning_rate_value, training_history)
+        log.info("Learning rate: %f " % learning_rate_value)
+    finally:
+      # flushes the queued checkpoints, also if training failed
+      if async_saver is not None:
+        async_saver.close()
 
     if self.is_summary:
       train_writer.close()
@@ -514,14 +511,18 @@ class SupervisedLearner(Base, BaseMixin):
                   loss_type=loss_type)
       self.validation_metric.append(self.validation_loss)
 
+    clip_fn = None
     if self.clip_norm and not self.clip_by_global_norm:
-      self.grads_and_vars = self._clip_grad_norms(self.grads_and_vars, max_norm=self.norm_threshold)
-    apply_gradients_op = optimizer.apply_gradients(self.grads_and_vars)
+      clip_fn = functools.partial(self._clip_grad_norms, max_norm=self.norm_threshold)
+    self.grads_and_vars, apply_gradients_op = self._apply_gradients(optimizer, self.grads_and_vars,
+                                                                    clip_fn)
     if self.cnf.get('moving_avg', False):
       log.info('Using Swapped Saver')
       self.swapped_saver = optimizer.swapping_saver()
+      self.swapped_var_list = optimizer.swapping_var_list()
     else:
       self.swapped_saver = None
+      self.swapped_var_list = None
     if keep_moving_averages:
       variables_averages_op = self._moving_averages_op()
       with tf.control_dependencies([apply_gradients_op, variables_averages_op]):
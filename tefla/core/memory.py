@@ -219,7 +219,13 @@ class Memory(object):
 class LSHMemory(Memory):
   """Memory employing locality sensitive hashing.
 
-  Note: Not fully tested.
+  The memory slots are indexed in `num_libraries` hash tables of random
+  hyperplane hashes, each bucket keeping the `num_per_hash_slot` most recently
+  written slots. The tables are maintained on every memory update: the slots
+  written by `make_update_op` are added to the bucket of their new key, and
+  entries of slots whose key moved to another bucket are ignored by the
+  lookups. A lookup reranks the slots of the query buckets by exact
+  similarity, so its cost depends on `choose_k` instead of `memory_size`.
   """
 
   def __init__(self,
@@ -233,7 +239,8 @@ class LSHMemory(Memory):
                var_cache_device='',
                nn_device='',
                num_hashes=None,
-               num_libraries=None):
+               num_libraries=None,
+               num_per_hash_slot=None):
     """LSH Memory module as described in "Learning to remember Rare Events".
 
     Args:
@@ -242,6 +249,10 @@ class LSHMemory(Memory):
         vocab_size: a `int`, vocab size is the number of distinct values that
             could go into the memory key-value storage
         choose_k:a `int`, closet k queries
+        num_hashes: a `int`, number of hash bits of a hash table
+        num_libraries: a `int`, number of hash tables
+        num_per_hash_slot: a `int`, capacity of a bucket, by default enough
+            for the buckets of the query to hold `choose_k` slots
     """
     super(LSHMemory, self).__init__(
         key_dim,
@@ -255,7 +266,8 @@ class LSHMemory(Memory):
         nn_device=nn_device)
 
     self.num_libraries = num_libraries or int(self.choose_k**0.5)
-    self.num_per_hash_slot = max(1, self.choose_k // self.num_libraries)
+    self.num_per_hash_slot = (num_per_hash_slot or
+                              max(1, -(-self.choose_k // self.num_libraries)))
     self.num_hashes = (num_hashes or int(np.log2(self.memory_size / self.num_per_hash_slot)))
     self.num_hashes = min(max(self.num_hashes, 1), 20)
     self.num_hash_slots = 2**self.num_hashes
@@ -268,14 +280,41 @@ class LSHMemory(Memory):
             initializer=tf.truncated_normal_initializer(0, 1)) for i in range(self.num_libraries)
     ]
 
+    # memory slots of each bucket, -1 for empty entries
     self.hash_slots = [
         tf.get_variable(
             'hash_slots%d' % i, [self.num_hash_slots, self.num_per_hash_slot],
             dtype=tf.int32,
             trainable=False,
-            initializer=tf.random_uniform_initializer(maxval=self.memory_size, dtype=tf.int32))
-        for i in range(self.num_libraries)
+            initializer=tf.constant_initializer(-1, tf.int32)) for i in range(self.num_libraries)
     ]
+    # next entry written in each bucket
+    self.hash_slot_ptrs = [
+        tf.get_variable(
+            'hash_slot_ptrs%d' % i, [self.num_hash_slots],
+            dtype=tf.int32,
+            trainable=False,
+            initializer=tf.constant_initializer(0, tf.int32)) for i in range(self.num_libraries)
+    ]
+    # bucket of the key of each memory slot, -1 for unindexed slots
+    self.mem_hashes = [
+        tf.get_variable(
+            'mem_hashes%d' % i, [self.memory_size],
+            dtype=tf.int32,
+            trainable=False,
+            initializer=tf.constant_initializer(-1, tf.int32)) for i in range(self.num_libraries)
+    ]
+
+  def index_variables(self):
+    return self.hash_slots + self.hash_slot_ptrs + self.mem_hashes
+
+  def set(self, k, v, a, r=None):
+    with tf.control_dependencies([super(LSHMemory, self).set(k, v, a, r)]):
+      return self.rebuild_index()
+
+  def clear(self):
+    return tf.group(
+        super(LSHMemory, self).clear(), tf.variables_initializer(self.index_variables()))
 
   def get_hash_slots(self, query):
     """Gets hashed-to buckets for batch of queries.
@@ -299,11 +338,39 @@ class LSHMemory(Memory):
     ]
     return hash_slot_idxs
 
+  def rebuild_index(self):
+    """Rebuilds the hash tables from the keys in memory, e.g. after `set`.
+
+    Returns:
+      the op assigning the hash tables.
+    """
+    hash_slot_idxs = self.get_hash_slots(self.mem_keys.read_value())
+    positions = tf.range(self.memory_size)
+    update_ops = []
+    for i, slot_idxs in enumerate(hash_slot_idxs):
+      _, order = tf.nn.top_k(-slot_idxs, k=self.memory_size)
+      sorted_slot_idxs = tf.gather(slot_idxs, order)
+      first = tf.unsorted_segment_min(positions, sorted_slot_idxs, self.num_hash_slots)
+      rank = positions - tf.gather(first, sorted_slot_idxs)
+      kept = tf.less(rank, self.num_per_hash_slot)
+      entries = tf.stack([tf.boolean_mask(sorted_slot_idxs, kept), tf.boolean_mask(rank, kept)], 1)
+      hash_slots = tf.scatter_nd(entries,
+                                 tf.boolean_mask(order, kept) + 1,
+                                 [self.num_hash_slots, self.num_per_hash_slot]) - 1
+      counts = tf.unsorted_segment_sum(tf.ones_like(slot_idxs), slot_idxs, self.num_hash_slots)
+      update_ops.extend([
+          self.hash_slots[i].assign(hash_slots),
+          self.hash_slot_ptrs[i].assign(tf.minimum(counts, self.num_per_hash_slot) %
+                                        self.num_per_hash_slot),
+          self.mem_hashes[i].assign(slot_idxs)
+      ])
+    return tf.group(*update_ops)
+
   def get_hint_pool_idxs(self, normalized_query):
     """Get small set of idxs to compute nearest neighbor queries on.
 
-    This is an expensive look-up on the whole memory that is used to
-    avoid more expensive operations later on.
+    The slots of the buckets of the query are reranked by similarity, stale
+    entries and duplicates coming last.
 
     Args:
       normalized_query: A Tensor of shape [None, key_dim].
@@ -315,13 +382,41 @@ class LSHMemory(Memory):
     # get hash of query vecs
     hash_slot_idxs = self.get_hash_slots(normalized_query)
 
-    # grab mem idxs in the hash slots
-    hint_pool_idxs = [
-        tf.maximum(tf.minimum(tf.gather(self.hash_slots[i], idxs), self.memory_size - 1), 0)
-        for i, idxs in enumerate(hash_slot_idxs)
-    ]
+    # grab mem idxs in the hash slots, valid if still hashed to the slot
+    hint_pool_idxs = []
+    hint_pool_valid = []
+    for i, idxs in enumerate(hash_slot_idxs):
+      slots = tf.gather(self.hash_slots[i], idxs)
+      safe_slots = tf.maximum(slots, 0)
+      hint_pool_idxs.append(safe_slots)
+      hint_pool_valid.append(
+          tf.logical_and(
+              tf.greater_equal(slots, 0),
+              tf.equal(tf.gather(self.mem_hashes[i], safe_slots), tf.expand_dims(idxs, 1))))
+    hint_pool_idxs = tf.concat(hint_pool_idxs, axis=1)
+    hint_pool_valid = tf.concat(hint_pool_valid, axis=1)
+    pool_size = self.num_libraries * self.num_per_hash_slot
+    batch_offsets = tf.expand_dims(pool_size * tf.range(tf.shape(normalized_query)[0]), 1)
 
-    return tf.concat(hint_pool_idxs, axis=1)
+    with tf.device(self.nn_device):
+      pool_keys = tf.gather(self.mem_keys, hint_pool_idxs, name='hint_pool_keys_gather')
+      similarities = tf.squeeze(
+          tf.matmul(
+              tf.expand_dims(tf.stop_gradient(normalized_query), 1),
+              pool_keys,
+              adjoint_b=True,
+              name='nn_pool_mmul'), [1])
+    # normalized keys have similarities in [-1, 1]
+    similarities = tf.where(hint_pool_valid, similarities, tf.fill(tf.shape(similarities), -2.0))
+    sorted_sims, order = tf.nn.top_k(similarities, k=pool_size, name='nn_pool_sort')
+    sorted_idxs = tf.gather(tf.reshape(hint_pool_idxs, [-1]), order + batch_offsets)
+    # equal slots have equal similarities and are adjacent once sorted
+    duplicates = tf.concat(
+        [tf.zeros_like(sorted_idxs[:, :1], tf.bool),
+         tf.equal(sorted_idxs[:, 1:], sorted_idxs[:, :-1])], 1)
+    sorted_sims = tf.where(duplicates, tf.fill(tf.shape(sorted_sims), -3.0), sorted_sims)
+    _, top_idxs = tf.nn.top_k(sorted_sims, k=min(self.choose_k, pool_size), name='nn_topk')
+    return tf.gather(tf.reshape(sorted_idxs, [-1]), top_idxs + batch_offsets)
 
   def make_update_op(self, upd_idxs, upd_keys, upd_vals, batch_size, use_recent_idx,
                      intended_output):
@@ -330,18 +425,22 @@ class LSHMemory(Memory):
                                                            use_recent_idx, intended_output)
 
     hash_slot_idxs = self.get_hash_slots(upd_keys)
+    # rank of an update among the previous updates of the batch to the same bucket
+    earlier = tf.matrix_band_part(tf.ones([batch_size, batch_size], tf.int32), -1, 0) - tf.eye(
+        batch_size, dtype=tf.int32)
 
     update_ops = []
     with tf.control_dependencies([base_update_op]):
       for i, slot_idxs in enumerate(hash_slot_idxs):
-        entry_idx = tf.random_uniform([batch_size], maxval=self.num_per_hash_slot, dtype=tf.int32)
-        entry_mul = 1 - tf.one_hot(entry_idx, self.num_per_hash_slot, dtype=tf.int32)
-        entry_add = (tf.expand_dims(upd_idxs, 1) * tf.one_hot(
-            entry_idx, self.num_per_hash_slot, dtype=tf.int32))
-
-        mul_op = tf.scatter_mul(self.hash_slots[i], slot_idxs, entry_mul)
-        with tf.control_dependencies([mul_op]):
-          add_op = tf.scatter_add(self.hash_slots[i], slot_idxs, entry_add)
-          update_ops.append(add_op)
+        same_slot = tf.to_int32(tf.equal(tf.expand_dims(slot_idxs, 1), slot_idxs))
+        rank = tf.reduce_sum(same_slot * earlier, 1)
+        entry_idx = (tf.gather(self.hash_slot_ptrs[i], slot_idxs) + rank) % self.num_per_hash_slot
+        with tf.control_dependencies([entry_idx]):
+          update_ops.extend([
+              tf.scatter_nd_update(self.hash_slots[i], tf.stack([slot_idxs, entry_idx], 1),
+                                   upd_idxs),
+              tf.scatter_add(self.hash_slot_ptrs[i], slot_idxs, tf.ones_like(slot_idxs)),
+              tf.scatter_update(self.mem_hashes[i], upd_idxs, slot_idxs)
+          ])
 
     return tf.group(*update_ops)
@@ -7,10 +7,79 @@ import os
 
 # Dependency imports
 
+import numpy as np
 import tensorflow as tf
 
-from tensorboard.backend.event_processing import event_accumulator
-from tensorboard.backend.event_processing import event_multiplexer
+from tensorboard.backend.event_processing import directory_watcher
+from tensorboard.backend.event_processing import event_file_loader
+from tensorboard.backend.event_processing import io_wrapper
+
+
+class ScalarSeries(object):
+  """Steps and values of a scalar metric, in arrays grown by doubling."""
+
+  def __init__(self, capacity=1024):
+    self._steps = np.zeros(capacity, np.int64)
+    self._values = np.zeros(capacity, np.float64)
+    self._size = 0
+
+  def __len__(self):
+    return self._size
+
+  def append(self, step, value):
+    if self._size == len(self._steps):
+      self._steps = np.concatenate([self._steps, np.zeros_like(self._steps)])
+      self._values = np.concatenate([self._values, np.zeros_like(self._values)])
+    self._steps[self._size] = step
+    self._values[self._size] = value
+    self._size += 1
+
+  @property
+  def steps(self):
+    return self._steps[:self._size]
+
+  @property
+  def values(self):
+    return self._values[:self._size]
+
+
+class IncrementalEventReader(object):
+  """Reads the scalar summaries of the events files of a directory incrementally.
+
+  The events files are tailed from the last read record, so a `reload` only
+  parses the events written since the previous one.
+  """
+
+  def __init__(self, directory, tags=None):
+    """Construct IncrementalEventReader.
+
+    Args:
+      directory: str, directory containing events files.
+      tags: list<str>, names of the metrics to read, all if None.
+    """
+    self._directory = directory
+    self._tags = set(tags) if tags else None
+    self._watcher = directory_watcher.DirectoryWatcher(
+        directory, event_file_loader.EventFileLoader, io_wrapper.IsTensorFlowEventsFile)
+    self.series = {}
+
+  def reload(self):
+    """Reads the new events.
+
+    Returns:
+      dict<str tag, ScalarSeries>, the series of all the events read.
+    """
+    if not tf.gfile.IsDirectory(self._directory):
+      return self.series
+    for event in self._watcher.Load():
+      if not event.HasField('summary'):
+        continue
+      for value in event.summary.value:
+        if not value.HasField('simple_value'):
+          continue
+        if self._tags is None or value.tag in self._tags:
+          self.series.setdefault(value.tag, ScalarSeries()).append(event.step, value.simple_value)
+    return self.series
 
 
 class MetricsBasedHook(tf.train.SessionRunHook):
@@ -23,31 +92,45 @@ class MetricsBasedHook(tf.train.SessionRunHook):
   This can be used to something like "Stop after the loss has stopped decreasing
   for 5000 steps.
   """
-  _RUN_NAME = "run%d"
 
-  def __init__(self, events_dir, subdirs=None, tags=None, every_n_steps=1000):
+  def __init__(self, events_dir, subdirs=None, tags=None, every_n_steps=1000,
+               metric_tensors=None):
     """Construct MetricsBasedHook.
 
     Args:
-      events_dir: str, top-level directory containing events files.
+      events_dir: str, top-level directory containing events files, None to
+        only collect `metric_tensors`.
       subdirs: list<str>, subdirectories of events_dir that also contain
         events files. Use "" to specify the top-level directory. Defaults to
         [""].
       tags: list<str>, names of metrics to collect. Default will collect all
         metrics.
       every_n_steps: int, collect metrics every n steps.
+      metric_tensors: dict<str tag, Tensor>, scalar metrics fetched at every
+        step and collected in the "" subdirectory, instead of being read back
+        from the events files.
     """
     self._events_dir = events_dir
     self._subdirs = subdirs or [""]
     self._tags = tags
     self._every_n_steps = every_n_steps
+    self._metric_tensors = metric_tensors or {}
     self._start_step = None
-    self._event_multiplexer = self._init_multiplexer()
-
-  def _init_multiplexer(self):
-    dirs = [os.path.join(self._events_dir, subdir) for subdir in self._subdirs]
-    run_path_map = dict([(self._RUN_NAME % i, d) for i, d in enumerate(dirs)])
-    return event_multiplexer.EventMultiplexer(run_path_map)
+    self._session_series = dict((tag, ScalarSeries()) for tag in self._metric_tensors)
+    self._readers = self._init_readers()
+
+  def _init_readers(self):
+    if self._events_dir is None:
+      return []
+    return [
+        IncrementalEventReader(os.path.join(self._events_dir, subdir), self._tags)
+        for subdir in self._subdirs
+    ]
+
+  def _fetches(self):
+    if self._metric_tensors:
+      return [self._global_step_tensor, self._metric_tensors]
+    return [self._global_step_tensor]
 
   def begin(self):
     self._global_step_tensor = tf.train.get_global_step()
@@ -61,10 +144,13 @@ class MetricsBasedHook(tf.train.SessionRunHook):
 
   def before_run(self, run_context):
     del run_context
-    return tf.train.SessionRunArgs([self._global_step_tensor])
+    return tf.train.SessionRunArgs(self._fetches())
 
   def after_run(self, run_context, run_values):
     global_step = run_values.results[0]
+    if self._metric_tensors:
+      for tag, value in run_values.results[1].items():
+        self._session_series[tag].append(global_step, value)
     if (global_step - self._start_step) % self._every_n_steps != 0:
       return
     metrics = self._collect_metrics()
@@ -75,17 +161,15 @@ class MetricsBasedHook(tf.train.SessionRunHook):
       run_context.request_stop()
 
   def _collect_metrics(self):
-    self._event_multiplexer.Reload()
     subdir_data = {}
-    for i, subdir in enumerate(self._subdirs):
-      subdir_metrics = {}
-
-      accum = self._event_multiplexer.GetAccumulator(self._RUN_NAME % i)
-      for tag in accum.Tags()[event_accumulator.SCALARS]:
-        steps, vals = zip(*[(event.step, event.value) for event in accum.Scalars(tag)])
-        subdir_metrics[tag] = (steps, vals)
-
-      subdir_data[subdir] = subdir_metrics
+    for subdir, reader in zip(self._subdirs, self._readers):
+      subdir_data[subdir] = dict(
+          (tag, (series.steps, series.values)) for tag, series in reader.reload().items())
+    if self._session_series:
+      subdir_data.setdefault("", {}).update(
+          (tag, (series.steps, series.values))
+          for tag, series in self._session_series.items()
+          if len(series))
     return subdir_data
 
   def _process_metrics(self, global_step, metrics):
@@ -94,10 +178,10 @@ class MetricsBasedHook(tf.train.SessionRunHook):
         Args:
           global_step: int, the current global step value.
           metrics: dict<str subdirectory, dict subdir_metrics>. The collected
-            metrics. subdir_metrics is a dict from tag name to tuple of lists. The
-            lists are a list of global steps and a list of values.
+            metrics. subdir_metrics is a dict from tag name to tuple of arrays. The
+            arrays are the global steps and the values.
             i.e. subdir_metrics:
-              `dict<str tag, tuple<list<int> global steps, list<float> values>>>`
+              `dict<str tag, tuple<ndarray global steps, ndarray values>>>`
 
         Returns:
           should_stop: bool. If True, will request that the session stops.
@@ -114,7 +198,8 @@ class EarlyStoppingHook(MetricsBasedHook):
                num_plateau_steps=1000,
                plateau_delta=0.1,
                plateau_decrease=True,
-               every_n_steps=1000):
+               every_n_steps=1000,
+               metric_tensor=None):
     """Create an EarlyStoppingHook.
 
     This hook will stop training when the metric identified by tag has
@@ -129,12 +214,18 @@ class EarlyStoppingHook(MetricsBasedHook):
       plateau_delta: delta to define a "plateau".
       plateau_decrease: whether to check decrease or increase in the metric.
       every_n_steps: how often to run this hook.
+      metric_tensor: optional scalar `Tensor` of the metric, fetched at every
+        step instead of reading the metric from the events files, in which case
+        events_dir can be None.
 
     Returns:
       An instance of EarlyStoppingHook.
     """
     super(EarlyStoppingHook, self).__init__(
-        events_dir=events_dir, tags=[tag], every_n_steps=every_n_steps)
+        events_dir=events_dir if metric_tensor is None else None,
+        tags=[tag],
+        every_n_steps=every_n_steps,
+        metric_tensors=None if metric_tensor is None else {tag: metric_tensor})
     self._num_plateau_steps = num_plateau_steps
     self._plateau_delta = plateau_delta
     self._plateau_decrease = plateau_decrease
@@ -147,6 +238,8 @@ class EarlyStoppingHook(MetricsBasedHook):
       return
 
     # Metrics should have just a single subdir and a single tag
+    if self._tags[0] not in list(metrics.values())[0]:
+      return
     steps, vals = list(metrics.values())[0][self._tags[0]]
     return has_metric_plateaued(
         steps,
@@ -192,7 +285,7 @@ class PlateauOpHook(MetricsBasedHook):
   def before_run(self, run_context):
     del run_context
 
-    fetches = [self._global_step_tensor]
+    fetches = self._fetches()
     if self._should_run_op and self.keep_alive:
       fetches.append(self._plateau_op)
       self._should_run_op = False
@@ -215,9 +308,11 @@ class PlateauOpHook(MetricsBasedHook):
       return
 
     # There should be only a single subdir and a single tag
+    if self._tags[0] not in list(metrics.values())[0]:
+      return
     steps, vals = list(metrics.values())[0][self._tags[0]]
 
-    if not steps:
+    if not len(steps):
       return
 
     last_step = steps[-1]
@@ -241,8 +336,8 @@ def has_metric_plateaued(steps, values, num_steps=100, delta=0.1, decrease=True)
   `decrease`) by `delta` for at least `num_steps`.
 
   Args:
-    steps: list<int> list of global steps for values.
-    values: list<float> list of metric values.
+    steps: list or array of the increasing global steps of the values.
+    values: list or array of metric values.
     num_steps: int, number of steps the metric has to have been plateaued for.
     delta: float, how much the metric should have changed by over num_steps.
     decrease: bool, whether to check if the metric has decreased by delta or
@@ -255,21 +350,16 @@ def has_metric_plateaued(steps, values, num_steps=100, delta=0.1, decrease=True)
   if len(steps) < 2:
     return False
 
-  steps_at_least_num_steps_ago = [s for s in steps if s <= (steps[-1] - num_steps)]
-  if not steps_at_least_num_steps_ago:
+  num_steps_ago = np.searchsorted(steps, steps[-1] - num_steps, side='right')
+  if not num_steps_ago:
     # Not enough steps yet
     return False
-  delta_step_idx = len(steps_at_least_num_steps_ago) - 1
+  delta_step_idx = num_steps_ago - 1
 
   start_val = values[delta_step_idx]
-  values_to_check = values[delta_step_idx:]
-  observed_deltas = []
-  for val in values_to_check:
-    if decrease:
-      observed_delta = start_val - val
-    else:
-      observed_delta = val - start_val
-    observed_deltas.append(observed_delta)
-
-  within_range = [obs < delta for obs in observed_deltas]
-  return all(within_range)
+  values_to_check = np.asarray(values[delta_step_idx:])
+  if decrease:
+    observed_deltas = start_val - values_to_check
+  else:
+    observed_deltas = values_to_check - start_val
+  return bool(np.all(observed_deltas < delta))
@@ -0,0 +1,189 @@
+"""Mixed precision training: float16 compute with float32 master weights.
+
+The layers of a model built under `mixed_precision_model` compute in float16:
+the trainable variables are stored in float32 and cast to float16 where they
+are used, so the optimizer updates the float32 master weights. The parameters
+of the batch norms are kept in float32. `LossScaleOptimizer` scales the loss
+up before computing the gradients, so that small float16 gradients do not
+underflow, and scales the gradients back down before applying them.
+"""
+from __future__ import division, print_function, absolute_import
+
+import functools
+
+import tensorflow as tf
+
+from . import logger as log
+
+# trainable variables used in float32 by the layers
+FLOAT32_VARIABLES = ('beta', 'gamma', 'moving_mean', 'moving_variance', 'moving_inv_std')
+
+
+def float32_variable_getter(compute_dtype=tf.float16, float32_variables=FLOAT32_VARIABLES):
+  """Returns a custom getter storing the trainable variables in float32.
+
+  The float32 variables are returned cast to `compute_dtype`, except the
+  variables whose base name is in `float32_variables`.
+
+  Args:
+    compute_dtype: dtype of the computations.
+    float32_variables: base names of the variables returned in float32.
+
+  Returns:
+    a custom getter for `tf.variable_scope`.
+  """
+
+  def custom_getter(getter, name, shape=None, dtype=None, *args, **kwargs):
+    trainable = kwargs.get('trainable', True)
+    storage_dtype = tf.float32 if trainable and dtype == compute_dtype else dtype
+    var = getter(name, shape, storage_dtype, *args, **kwargs)
+    if (trainable and var.dtype.base_dtype == tf.float32 and
+        name.split('/')[-1] not in float32_variables):
+      return tf.cast(var, compute_dtype)
+    return var
+
+  return custom_getter
+
+
+def mixed_precision_model(model, compute_dtype=tf.float16):
+  """Wraps a model function to compute in `compute_dtype`.
+
+  The inputs are cast to `compute_dtype` and the model variables are created
+  through `float32_variable_getter`; the floating end points are cast back to
+  float32, for the losses and metrics.
+
+  Args:
+    model: a model function, `model(inputs, **kwargs)` returning the end points.
+    compute_dtype: dtype of the computations.
+
+  Returns:
+    the wrapped model function.
+  """
+
+  @functools.wraps(model)
+  def wrapped_model(inputs, *args, **kwargs):
+    with tf.variable_scope(
+        tf.get_variable_scope(),
+        custom_getter=float32_variable_getter(compute_dtype),
+        auxiliary_name_scope=False):
+      end_points = model(tf.cast(inputs, compute_dtype), *args, **kwargs)
+    return {
+        name: tf.cast(value, tf.float32)
+        if isinstance(value, tf.Tensor) and value.dtype.base_dtype == compute_dtype else value
+        for name, value in end_points.items()
+    }
+
+  return wrapped_model
+
+
+class LossScaleOptimizer(tf.train.Optimizer):
+  """Optimizer wrapper scaling the loss of the gradients computation.
+
+  With a static loss scale the loss is multiplied by the given scale. With a
+  `dynamic` loss scale, the scale is a non-trainable variable: the gradients
+  are applied only if they are all finite, otherwise the update is skipped and
+  the scale is multiplied by `decr_ratio`; after `incr_every_n_steps`
+  consecutive finite steps the scale is multiplied by `incr_ratio`.
+  """
+
+  def __init__(self,
+               opt,
+               loss_scale='dynamic',
+               init_loss_scale=2.0**15,
+               incr_every_n_steps=2000,
+               incr_ratio=2.0,
+               decr_ratio=0.5,
+               max_loss_scale=2.0**24,
+               use_locking=False,
+               name='LossScaleOptimizer'):
+    """Construct a new LossScaleOptimizer.
+
+    Args:
+      opt: the optimizer applying the gradients.
+      loss_scale: `dynamic` or a static loss scale.
+      init_loss_scale: initial dynamic loss scale.
+      incr_every_n_steps: number of consecutive finite steps after which the
+        dynamic loss scale is increased.
+      incr_ratio: increase factor of the dynamic loss scale.
+      decr_ratio: decrease factor of the dynamic loss scale, on overflow.
+      max_loss_scale: maximum dynamic loss scale.
+      use_locking: Bool, unused.
+      name: Optional name prefix for the operations created when applying
+        gradients.
+    """
+    super(LossScaleOptimizer, self).__init__(use_locking, name)
+    self._opt = opt
+    self._dynamic = loss_scale == 'dynamic'
+    self._incr_every_n_steps = incr_every_n_steps
+    self._incr_ratio = incr_ratio
+    self._decr_ratio = decr_ratio
+    self._max_loss_scale = max_loss_scale
+    if self._dynamic:
+      log.info('Using dynamic loss scaling, initial scale %g' % init_loss_scale)
+      self._loss_scale = tf.Variable(float(init_loss_scale), trainable=False, name='loss_scale')
+      self._good_steps = tf.Variable(0, trainable=False, name='loss_scale_good_steps')
+    else:
+      log.info('Using static loss scale %g' % loss_scale)
+      self._loss_scale = tf.constant(float(loss_scale), name='loss_scale')
+
+  @property
+  def loss_scale(self):
+    """The current loss scale, a float32 scalar."""
+    return tf.convert_to_tensor(self._loss_scale)
+
+  def scale_loss(self, loss):
+    return loss * tf.cast(self.loss_scale, loss.dtype.base_dtype)
+
+  def unscale_gradients(self, grads):
+    """Divides the gradients by the loss scale, `None` gradients are kept."""
+    inv_scale = 1.0 / self.loss_scale
+    unscaled = []
+    for grad in grads:
+      if grad is None:
+        unscaled.append(None)
+      elif isinstance(grad, tf.IndexedSlices):
+        unscaled.append(
+            tf.IndexedSlices(grad.values * tf.cast(inv_scale, grad.dtype), grad.indices,
+                             grad.dense_shape))
+      else:
+        unscaled.append(grad * tf.cast(inv_scale, grad.dtype))
+    return unscaled
+
+  def compute_gradients(self, loss, var_list=None, **kwargs):
+    grads_and_vars = self._opt.compute_gradients(self.scale_loss(loss), var_list, **kwargs)
+    grads = self.unscale_gradients([g for g, _ in grads_and_vars])
+    return list(zip(grads, [v for _, v in grads_and_vars]))
+
+  def get_slot(self, *args, **kwargs):
+    return self._opt.get_slot(*args, **kwargs)
+
+  def get_slot_names(self, *args, **kwargs):
+    return self._opt.get_slot_names(*args, **kwargs)
+
+  def apply_gradients(self, grads_and_vars, global_step=None, name=None):
+    if not self._dynamic:
+      return self._opt.apply_gradients(grads_and_vars, global_step=global_step, name=name)
+    grads_and_vars = list(grads_and_vars)
+    with tf.name_scope(name, self._name) as name:
+      is_finite = tf.reduce_all([
+          tf.reduce_all(tf.is_finite(g.values if isinstance(g, tf.IndexedSlices) else g))
+          for g, _ in grads_and_vars
+          if g is not None
+      ])
+      apply_op = tf.cond(is_finite,
+                         lambda: self._opt.apply_gradients(grads_and_vars, global_step=global_step),
+                         tf.no_op)
+      with tf.control_dependencies([apply_op]):
+        update_op = self._update_loss_scale(is_finite)
+      return tf.group(apply_op, update_op, name=name)
+
+  def _update_loss_scale(self, is_finite):
+    good_steps = tf.where(is_finite, self._good_steps + 1, 0)
+    increase = tf.logical_and(is_finite, good_steps >= self._incr_every_n_steps)
+    loss_scale = tf.where(
+        increase, tf.minimum(self._loss_scale * self._incr_ratio, self._max_loss_scale),
+        tf.where(is_finite, self._loss_scale, tf.maximum(self._loss_scale * self._decr_ratio,
+                                                         1.0)))
+    return tf.group(
+        tf.assign(self._loss_scale, loss_scale),
+        tf.assign(self._good_steps, tf.where(increase, 0, good_steps)))
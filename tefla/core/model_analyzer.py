@@ -11,11 +11,26 @@ To analyze the model variables in a graph:
 
   variables = tf.model_variables()
   tefla.core.model_analyzer.analyze_vars(variables, print_info=False)
+
+To estimate the FLOPs per layer and the peak activation memory of a training
+step at a given batch size, from the static shapes of the graph:
+
+  train_op = ...
+  total_flops, layer_flops = tefla.core.model_analyzer.analyze_flops(
+      tf.get_default_graph(), batch_size=32, fetches=[train_op])
+  peak_bytes, peak_op = tefla.core.model_analyzer.analyze_memory(
+      tf.get_default_graph(), batch_size=32, fetches=[train_op])
 """
 from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+import re
+
+import numpy as np
+import tensorflow as tf
+
 
 def tensor_description(var):
   """Returns a compact and informative string about a tensor.
@@ -94,3 +109,269 @@ def analyze_vars(variables, print_info=False):
     print('Total size of variables: %d' % total_size)
     print('Total bytes of variables: %d' % total_bytes)
   return total_size, total_bytes
+
+
+# Ops whose output is a view of their first input, no buffer is allocated.
+_ALIAS_OPS = frozenset(
+    ['Identity', 'Reshape', 'Squeeze', 'ExpandDims', 'StopGradient', 'Snapshot', 'PreventGradient'])
+# Ops holding parameters or constants, their outputs are not activations.
+_PARAMETER_OPS = frozenset(['VariableV2', 'Variable', 'VarHandleOp', 'Const'])
+# FLOPs per output element of the elementwise ops.
+_ELEMENTWISE_FLOPS = dict(
+    [(op_type, 1) for op_type in [
+        'Add', 'AddV2', 'AddN', 'Sub', 'Mul', 'RealDiv', 'Div', 'Maximum', 'Minimum', 'Neg',
+        'Square', 'SquaredDifference', 'Sqrt', 'Rsqrt', 'Exp', 'Log', 'Pow', 'Reciprocal', 'Abs',
+        'Relu', 'Relu6', 'Elu', 'Selu', 'Softplus', 'Sigmoid', 'Tanh', 'BiasAdd', 'Select',
+        'ReluGrad', 'Relu6Grad', 'EluGrad', 'SigmoidGrad', 'TanhGrad', 'RsqrtGrad', 'SqrtGrad'
+    ]] + [('Softmax', 5), ('LogSoftmax', 5), ('FusedBatchNorm', 5), ('FusedBatchNormV2', 5),
+          ('FusedBatchNormGrad', 8), ('FusedBatchNormGradV2', 8)])
+# Ops reducing their first input, one FLOP per input element.
+_REDUCTION_OPS = frozenset(['Sum', 'Mean', 'Max', 'Min', 'Prod', 'BiasAddGrad', 'ArgMax', 'ArgMin'])
+_GRADIENTS_SCOPE = re.compile(r'^gradients(_\d+)?/')
+
+_flops_rules = {}
+
+
+def _flops_rule(*op_types):
+  """Registers the decorated function as the FLOPs rule of `op_types`.
+
+  A rule is called as `rule(op, batch_size)` and returns the FLOPs of the op
+  or None if the static shapes are not known.
+  """
+
+  def register(rule):
+    for op_type in op_types:
+      _flops_rules[op_type] = rule
+    return rule
+
+  return register
+
+
+def _shape(tensor, batch_size):
+  """Static shape of `tensor` as a list, with an unknown first dimension set to
+  `batch_size`; None if the rank or another dimension is unknown."""
+  shape = tensor.get_shape()
+  if shape.ndims is None:
+    return None
+  dims = shape.as_list()
+  if dims and dims[0] is None:
+    dims[0] = batch_size
+  if any(dim is None for dim in dims):
+    return None
+  return dims
+
+
+def _num_elements(tensor, batch_size):
+  shape = _shape(tensor, batch_size)
+  return None if shape is None else int(np.prod(shape))
+
+
+@_flops_rule('MatMul')
+def _matmul_flops(op, batch_size):
+  a_shape = _shape(op.inputs[0], batch_size)
+  num_outputs = _num_elements(op.outputs[0], batch_size)
+  if a_shape is None or num_outputs is None:
+    return None
+  k = a_shape[0] if op.get_attr('transpose_a') else a_shape[1]
+  return 2 * num_outputs * k
+
+
+@_flops_rule('BatchMatMul')
+def _batch_matmul_flops(op, batch_size):
+  a_shape = _shape(op.inputs[0], batch_size)
+  num_outputs = _num_elements(op.outputs[0], batch_size)
+  if a_shape is None or num_outputs is None:
+    return None
+  k = a_shape[-2] if op.get_attr('adj_x') else a_shape[-1]
+  return 2 * num_outputs * k
+
+
+def _conv_flops(num_outputs, filter_shape, depthwise):
+  if num_outputs is None or filter_shape is None:
+    return None
+  # a depthwise output channel sees one input channel
+  kernel_size = np.prod(filter_shape[:2]) * (1 if depthwise else filter_shape[2])
+  return 2 * num_outputs * int(kernel_size)
+
+
+@_flops_rule('Conv2D', 'DepthwiseConv2dNative')
+def _conv2d_flops(op, batch_size):
+  return _conv_flops(
+      _num_elements(op.outputs[0], batch_size), _shape(op.inputs[1], batch_size),
+      op.type == 'DepthwiseConv2dNative')
+
+
+@_flops_rule('Conv2DBackpropInput', 'DepthwiseConv2dNativeBackpropInput')
+def _conv2d_backprop_input_flops(op, batch_size):
+  return _conv_flops(
+      _num_elements(op.inputs[2], batch_size), _shape(op.inputs[1], batch_size),
+      op.type == 'DepthwiseConv2dNativeBackpropInput')
+
+
+@_flops_rule('Conv2DBackpropFilter', 'DepthwiseConv2dNativeBackpropFilter')
+def _conv2d_backprop_filter_flops(op, batch_size):
+  return _conv_flops(
+      _num_elements(op.inputs[2], batch_size), _shape(op.outputs[0], batch_size),
+      op.type == 'DepthwiseConv2dNativeBackpropFilter')
+
+
+@_flops_rule('MaxPool', 'AvgPool', 'MaxPoolGrad', 'AvgPoolGrad')
+def _pool_flops(op, batch_size):
+  # the gradients are last input of the pooling gradients
+  tensor = op.outputs[0] if op.type in ('MaxPool', 'AvgPool') else op.inputs[-1]
+  num_outputs = _num_elements(tensor, batch_size)
+  if num_outputs is None:
+    return None
+  return num_outputs * int(np.prod(op.get_attr('ksize')))
+
+
+def op_flops(op, batch_size=1):
+  """Estimates the FLOPs of an op from the static shapes of its tensors.
+
+  A multiply-add counts as 2 FLOPs. Convolutions, matmuls, poolings and their
+  gradients, elementwise ops and reductions are counted; other ops count 0.
+
+  Args:
+    op: an Operation.
+    batch_size: size of the unknown first dimension of the tensors.
+
+  Returns:
+    the FLOPs of the op, None if they depend on unknown shapes.
+  """
+  if op.type in _flops_rules:
+    return _flops_rules[op.type](op, batch_size)
+  if op.type in _ELEMENTWISE_FLOPS:
+    num_outputs = _num_elements(op.outputs[0], batch_size)
+    return None if num_outputs is None else _ELEMENTWISE_FLOPS[op.type] * num_outputs
+  if op.type in _REDUCTION_OPS:
+    return _num_elements(op.inputs[0], batch_size)
+  return 0
+
+
+def _fetched_ops(graph, fetches):
+  """Ops of `graph` needed to compute `fetches`, all the ops if None, in the
+  graph creation order, which is a topological order."""
+  ops = graph.get_operations()
+  if fetches is None:
+    return ops
+  needed = set()
+  stack = [fetch if isinstance(fetch, tf.Operation) else fetch.op for fetch in fetches]
+  while stack:
+    op = stack.pop()
+    if op in needed:
+      continue
+    needed.add(op)
+    stack.extend(inp.op for inp in op.inputs)
+    stack.extend(op.control_inputs)
+  return [op for op in ops if op in needed]
+
+
+def layer_name(op_name, layer_depth=1):
+  """Name of the layer of an op, its first `layer_depth` name scopes; the ops
+  computing gradients are attributed to the layer they differentiate."""
+  op_name = _GRADIENTS_SCOPE.sub('', op_name)
+  return '/'.join(op_name.split('/')[:layer_depth])
+
+
+def analyze_flops(graph, batch_size=1, fetches=None, layer_depth=1, print_info=False):
+  """Estimates the FLOPs per layer and in total, without running the graph.
+
+  Args:
+    graph: the graph containing the operations.
+    batch_size: size of the unknown first dimension of the tensors.
+    fetches: optional list of tensors or ops, only the ops they depend on are
+      counted, e.g. the train op of a training graph or the predictions of an
+      inference graph.
+    layer_depth: number of name scopes of the layer names.
+    print_info: Optional, if true print the FLOPs of the layers.
+
+  Returns:
+    (total FLOPs, an OrderedDict mapping layer names to a
+    (forward FLOPs, backward FLOPs) pair)
+  """
+  layers = collections.OrderedDict()
+  unknown = []
+  for op in _fetched_ops(graph, fetches):
+    flops = op_flops(op, batch_size)
+    if flops is None:
+      unknown.append(op.name)
+      continue
+    if not flops:
+      continue
+    name = layer_name(op.name, layer_depth)
+    forward, backward = layers.get(name, (0, 0))
+    if _GRADIENTS_SCOPE.match(op.name):
+      backward += flops
+    else:
+      forward += flops
+    layers[name] = (forward, backward)
+  total_flops = sum(forward + backward for forward, backward in layers.values())
+  if print_info:
+    print('---------')
+    print('FLOPs at batch size %d: layer [forward, backward]' % batch_size)
+    print('---------')
+    for name, (forward, backward) in layers.items():
+      print(name, '[%d, %d]' % (forward, backward))
+    print('Total FLOPs: %d' % total_flops)
+    if unknown:
+      print('Ops with unknown shapes, not counted: %d' % len(unknown))
+  return total_flops, layers
+
+
+def analyze_memory(graph, batch_size=1, fetches=None, print_info=False):
+  """Estimates the peak memory of the live activations, without running the
+  graph.
+
+  The ops are executed in the graph creation order: the outputs of an op are
+  allocated when it runs and freed after their last consumer ran, the
+  fetched tensors are kept until the end. Parameters and constants are not
+  activations, and reshapes and identities are views of their input.
+
+  Args:
+    graph: the graph containing the operations.
+    batch_size: size of the unknown first dimension of the tensors.
+    fetches: optional list of tensors or ops, only the ops they depend on are
+      executed, e.g. the train op of a training graph or the predictions of an
+      inference graph.
+    print_info: Optional, if true print the peak memory.
+
+  Returns:
+    (peak bytes of the live activations, name of the op running at the peak)
+  """
+  ops = _fetched_ops(graph, fetches)
+  buffers = {}
+  consumers = collections.Counter()
+  for op in ops:
+    for output in op.outputs:
+      if op.type in _PARAMETER_OPS or output.dtype != output.dtype.base_dtype:
+        buffers[output] = None
+      elif op.type in _ALIAS_OPS and op.inputs:
+        buffers[output] = buffers.get(op.inputs[0])
+      else:
+        buffers[output] = output
+    for inp in op.inputs:
+      if buffers.get(inp) is not None:
+        consumers[buffers[inp]] += 1
+  fetched = set(buffers.get(fetch) for fetch in fetches or [] if isinstance(fetch, tf.Tensor))
+
+  live_bytes = 0
+  peak_bytes = 0
+  peak_op = None
+  for op in ops:
+    allocated = [output for output in op.outputs if buffers[output] is output]
+    for output in allocated:
+      live_bytes += (_num_elements(output, batch_size) or 0) * output.dtype.size
+    if live_bytes > peak_bytes:
+      peak_bytes, peak_op = live_bytes, op.name
+    released = [inp for inp in op.inputs if buffers.get(inp) is not None]
+    for inp in released:
+      consumers[buffers[inp]] -= 1
+    for buf in set(buffers[inp] for inp in released) | set(allocated):
+      if consumers[buf] == 0 and buf not in fetched:
+        live_bytes -= (_num_elements(buf, batch_size) or 0) * buf.dtype.size
+        # never released twice
+        consumers[buf] = -1
+  if print_info:
+    print('Peak activation memory at batch size %d: %d bytes (%.1f MB), at %s' %
+          (batch_size, peak_bytes, peak_bytes / 2.0**20, peak_op))
+  return peak_bytes, peak_op
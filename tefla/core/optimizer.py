@@ -239,7 +239,8 @@ class DPGradientDescentOptimizer(tf.train.GradientDescentOptimizer):
                sigma=None,
                use_locking=False,
                name="DPGradientDescent",
-               batches_per_lot=1):
+               batches_per_lot=1,
+               num_microbatches=None):
     """Construct a differentially private gradient descent optimizer. The
     optimizer uses fixed privacy budget for each batch of training.
 
@@ -252,9 +253,15 @@ class DPGradientDescentOptimizer(tf.train.GradientDescentOptimizer):
       use_locking: use locking.
       name: name for the object.
       batches_per_lot: Number of batches in a lot.
+      num_microbatches: if not None, the batch is split in this number of
+        micro-batches and the mean gradient of each micro-batch, instead of
+        the gradient of each example, is clipped before the noise is added.
+        This trades privacy granularity for throughput; the batch size must
+        be a multiple of num_microbatches.
     """
 
     super(DPGradientDescentOptimizer, self).__init__(learning_rate, use_locking, name)
+    self._num_microbatches = num_microbatches
 
     # Also, if needed, define the gradient accumulators
     self._batches_per_lot = batches_per_lot
@@ -291,6 +298,16 @@ class DPGradientDescentOptimizer(tf.train.GradientDescentOptimizer):
 
     xs = [tf.convert_to_tensor(x) for x in var_list]
     px_grads = PerExampleGradients(loss, xs)
+    # the privacy spending is accounted for the examples of the lot, also when
+    # the gradients are clipped per micro-batch
+    num_examples = self._batches_per_lot * tf.slice(tf.shape(px_grads[0]), [0], [1])
+    if self._num_microbatches is not None:
+      px_grads = [
+          tf.reduce_mean(
+              tf.reshape(px_grad,
+                         tf.concat([[self._num_microbatches, -1],
+                                    tf.shape(px_grad)[1:]], 0)), 1) for px_grad in px_grads
+      ]
     sanitized_grads = []
     for px_grad, v in zip(px_grads, var_list):
       tensor_name = GetTensorOpName(v)
@@ -300,7 +317,7 @@ class DPGradientDescentOptimizer(tf.train.GradientDescentOptimizer):
           sigma=self._sigma,
           tensor_name=tensor_name,
           add_noise=add_noise,
-          num_examples=self._batches_per_lot * tf.slice(tf.shape(px_grad), [0], [1]))
+          num_examples=num_examples)
       sanitized_grads.append(sanitized_grad)
 
     return sanitized_grads
@@ -471,6 +488,50 @@ class PXGRegistry(object):
 pxg_registry = PXGRegistry()
 
 
+def _sum_to_param_shape(grads, x):
+  """Sums the per-example `grads` over the axes broadcast against `x`.
+
+  Args:
+    grads: a Tensor [batch_size, ...] of gradients on the output of an op
+      broadcasting the parameter `x` against the examples.
+    x: the parameter, whose static shape must be fully defined.
+
+  Returns:
+    a Tensor [batch_size] + x.shape of per-example gradients.
+  """
+  x_shape = x.get_shape().as_list()
+  rank = grads.get_shape().ndims
+  assert rank > len(x_shape), "The parameter must not have a batch axis."
+  leading_axes = list(range(1, rank - len(x_shape)))
+  if leading_axes:
+    grads = tf.reduce_sum(grads, leading_axes)
+  grads_shape = grads.get_shape().as_list()
+  broadcast_axes = [
+      i + 1 for i, dim in enumerate(x_shape) if dim == 1 and grads_shape[i + 1] != 1
+  ]
+  if broadcast_axes:
+    grads = tf.reduce_sum(grads, broadcast_axes, keep_dims=True)
+  return tf.reshape(grads, [-1] + x_shape)
+
+
+def _image_patches(op, images, kernel_size):
+  """Extracts the [batch_size, num_patches, kernel_rows * kernel_cols * channels]
+  input patches of a convolution `op` on the NHWC `images`; the strides and
+  dilations of a NCHW `op` are permuted to NHWC."""
+  strides = list(op.get_attr("strides"))
+  rates = list(op.get_attr("dilations"))
+  if op.get_attr("data_format") == b"NCHW":
+    strides = [strides[i] for i in (0, 2, 3, 1)]
+    rates = [rates[i] for i in (0, 2, 3, 1)]
+  patches = tf.extract_image_patches(
+      images,
+      ksizes=[1, kernel_size[0], kernel_size[1], 1],
+      strides=strides,
+      rates=rates,
+      padding=op.get_attr("padding"))
+  return tf.reshape(patches, [tf.shape(images)[0], -1, patches.get_shape()[-1].value])
+
+
 class MatMulPXG(object):
   """Per-example gradient rule for MatMul op."""
 
@@ -521,6 +582,9 @@ pxg_registry.Register("MatMul", MatMulPXG)
 class Conv2DPXG(object):
   """Per-example gradient rule of Conv2d op.
 
+  The gradients of all the examples are computed at once, as a batched matmul
+  of the input patches of each example with its output gradients.
+
   Same interface as MatMulPXG.
   """
 
@@ -531,6 +595,35 @@ class Conv2DPXG(object):
     self.colocate_gradients_with_ops = colocate_gradients_with_ops
     self.gate_gradients = gate_gradients
 
+  def __call__(self, w, z_grads):
+    idx = list(self.op.inputs).index(w)
+    # Make sure that `op` was actually applied to `w`
+    assert idx != -1
+    assert len(z_grads) == len(self.op.outputs)
+    assert idx == 1  # We expect convolution weights to be arg 1
+
+    images, filters = self.op.inputs
+    z_grads, = z_grads
+    if self.op.get_attr("data_format") == b"NCHW":
+      images = tf.transpose(images, [0, 2, 3, 1])
+      z_grads = tf.transpose(z_grads, [0, 2, 3, 1])
+    filter_shape = filters.get_shape().as_list()
+    patches = _image_patches(self.op, images, filter_shape[:2])
+    z_grads = tf.reshape(z_grads, [tf.shape(z_grads)[0], -1, filter_shape[3]])
+    px_grads = tf.matmul(patches, z_grads, transpose_a=True)
+    return tf.reshape(px_grads, [-1] + filter_shape)
+
+
+pxg_registry.Register("Conv2D", Conv2DPXG)
+
+
+class Conv2DLoopPXG(Conv2DPXG):
+  """Per-example gradient rule of Conv2d op, with one convolution per example.
+
+  Former rule of Conv2D ops, kept as a reference; register it with
+  `pxg_registry.Register("Conv2D", Conv2DLoopPXG)` to use it.
+  """
+
   def _PxConv2DBuilder(self, input_, w, strides, padding):
     """conv2d run separately per example, to help compute per-example
     gradients.
@@ -576,10 +669,6 @@ class Conv2DPXG(object):
     # Make sure that `op` was actually applied to `w`
     assert idx != -1
     assert len(z_grads) == len(self.op.outputs)
-    # The following assert may be removed when we are ready to use this
-    # for general purpose code.
-    # This assert is only expected to hold in the contex of our preliminary
-    # MNIST experiments.
     assert idx == 1  # We expect convolution weights to be arg 1
 
     images, filters = self.op.inputs
@@ -601,7 +690,42 @@ class Conv2DPXG(object):
     return tf.stack(gradients_list)
 
 
-pxg_registry.Register("Conv2D", Conv2DPXG)
+class DepthwiseConv2dNativePXG(object):
+  """Per-example gradient rule of DepthwiseConv2dNative op, used by the depthwise
+  and separable convolutions.
+
+  Same interface as MatMulPXG.
+  """
+
+  def __init__(self, op, colocate_gradients_with_ops=False, gate_gradients=False):
+
+    assert op.node_def.op == "DepthwiseConv2dNative"
+    self.op = op
+    self.colocate_gradients_with_ops = colocate_gradients_with_ops
+    self.gate_gradients = gate_gradients
+
+  def __call__(self, w, z_grads):
+    idx = list(self.op.inputs).index(w)
+    assert idx != -1
+    assert len(z_grads) == len(self.op.outputs)
+    assert idx == 1  # We expect depthwise weights to be arg 1
+    assert self.op.get_attr("data_format") == b"NHWC"
+
+    images, filters = self.op.inputs
+    z_grads, = z_grads
+    rows, cols, channels, multiplier = filters.get_shape().as_list()
+    batch_size = tf.shape(images)[0]
+    patches = tf.reshape(
+        _image_patches(self.op, images, [rows, cols]), [batch_size, -1, rows * cols, channels])
+    z_grads = tf.reshape(z_grads, [batch_size, -1, channels, multiplier])
+    # [batch_size, channels, rows * cols, multiplier]
+    px_grads = tf.matmul(
+        tf.transpose(patches, [0, 3, 2, 1]), tf.transpose(z_grads, [0, 2, 1, 3]))
+    px_grads = tf.transpose(px_grads, [0, 2, 1, 3])
+    return tf.reshape(px_grads, [-1, rows, cols, channels, multiplier])
+
+
+pxg_registry.Register("DepthwiseConv2dNative", DepthwiseConv2dNativePXG)
 
 
 class AddPXG(object):
@@ -622,21 +746,70 @@ class AddPXG(object):
     # Make sure that `op` was actually applied to `x`
     assert idx != -1
     assert len(z_grads) == len(self.op.outputs)
-    # The following assert may be removed when we are ready to use this
-    # for general purpose code.
-    # This assert is only expected to hold in the contex of our preliminary
-    # MNIST experiments.
-    assert idx == 1  # We expect biases to be arg 1
     # We don't expect anyone to per-example differentiate with respect
     # to anything other than the biases.
-    x, _ = self.op.inputs
     z_grads, = z_grads
-    return z_grads
+    return _sum_to_param_shape(z_grads, x)
 
 
 pxg_registry.Register("Add", AddPXG)
 
 
+class BiasAddPXG(object):
+  """Per-example gradient rule for BiasAdd op.
+
+  Same interface as MatMulPXG.
+  """
+
+  def __init__(self, op, colocate_gradients_with_ops=False, gate_gradients=False):
+
+    assert op.node_def.op == "BiasAdd"
+    self.op = op
+    self.colocate_gradients_with_ops = colocate_gradients_with_ops
+    self.gate_gradients = gate_gradients
+
+  def __call__(self, x, z_grads):
+    idx = list(self.op.inputs).index(x)
+    assert idx != -1
+    assert len(z_grads) == len(self.op.outputs)
+    assert idx == 1  # We expect biases to be arg 1
+    z_grads, = z_grads
+    rank = z_grads.get_shape().ndims
+    if self.op.get_attr("data_format") == b"NCHW":
+      axes = list(range(2, rank))
+    else:
+      axes = list(range(1, rank - 1))
+    return tf.reduce_sum(z_grads, axes) if axes else z_grads
+
+
+pxg_registry.Register("BiasAdd", BiasAddPXG)
+
+
+class MulPXG(object):
+  """Per-example gradient rule for Mul op, of parameters broadcast against the
+  examples, e.g. scales or PReLU slopes.
+
+  Same interface as MatMulPXG.
+  """
+
+  def __init__(self, op, colocate_gradients_with_ops=False, gate_gradients=False):
+
+    assert op.node_def.op == "Mul"
+    self.op = op
+    self.colocate_gradients_with_ops = colocate_gradients_with_ops
+    self.gate_gradients = gate_gradients
+
+  def __call__(self, x, z_grads):
+    idx = list(self.op.inputs).index(x)
+    assert idx != -1
+    assert len(z_grads) == len(self.op.outputs)
+    z_grads, = z_grads
+    return _sum_to_param_shape(z_grads * self.op.inputs[1 - idx], x)
+
+
+pxg_registry.Register("Mul", MulPXG)
+
+
 def PerExampleGradients(ys,
                         xs,
                         grad_ys=None,
@@ -650,6 +823,11 @@ def PerExampleGradients(ys,
   cost in `ys` is additive across examples. e.g., no batch
   normalization. Individual rules for each op specify their own
   assumptions about how examples are put into tensors.
+
+  Rules are registered for the MatMul, Conv2D, DepthwiseConv2dNative, Add,
+  BiasAdd and Mul ops, i.e. the fully connected, convolution, depthwise and
+  separable convolution layers, biases and broadcast scales; they compute the
+  gradients of all the examples at once.
   """
 
   # Find the interface between the xs and the cost
@@ -679,18 +857,72 @@ def PerExampleGradients(ys,
     ops = []
     for z in zs:
       ops = ListUnion(ops, [z.op])
-    if len(ops) != 1:
-      raise NotImplementedError("Currently we only support the case "
-                                "where each x is consumed by exactly "
-                                "one op. but %s is consumed by %d ops." % (x.name, len(ops)))
-    op = ops[0]
-    pxg_rule = pxg_registry(op, colocate_gradients_with_ops, gate_gradients)
-    x_grad = pxg_rule(x, [grad_dict[z] for z in zs])
-    out.append(x_grad)
+    # the per-example gradients through each consumer op are summed, e.g. for
+    # shared weights
+    x_grads = []
+    for op in ops:
+      pxg_rule = pxg_registry(op, colocate_gradients_with_ops, gate_gradients)
+      x_grads.append(pxg_rule(x, [grad_dict[z] for z in op.outputs]))
+    out.append(tf.add_n(x_grads) if len(x_grads) > 1 else x_grads[0])
 
   return out
 
 
+class AmortizedAccountant(object):
+  """Privacy accountant with the amortized privacy spending of each batch.
+
+  The (eps, delta) of a batch are amortized by the sampling ratio of the batch,
+  using the privacy amplification via sampling bound, and summed over the
+  batches.
+  """
+
+  def __init__(self, total_examples):
+    """Construct an AmortizedAccountant.
+
+    Args:
+      total_examples: total number of examples of the dataset.
+    """
+
+    assert total_examples > 0
+    self._total_examples = total_examples
+    self._eps_so_far = tf.Variable(tf.zeros([1]), trainable=False, name="eps_so_far")
+    self._delta_so_far = tf.Variable(tf.zeros([1]), trainable=False, name="delta_so_far")
+
+  def accumulate_privacy_spending(self, eps_delta, unused_sigma, num_examples):
+    """Accumulate the privacy spending of a batch.
+
+    Args:
+      eps_delta: the (eps, delta) pair spent by the batch.
+      unused_sigma: the noise sigma, unused.
+      num_examples: the number of examples of the batch.
+
+    Returns:
+      the operation to accumulate the privacy spending.
+    """
+
+    eps, delta = eps_delta
+    with tf.control_dependencies(
+        [tf.Assert(tf.greater(delta, 0), ["delta needs to be greater than 0"])]):
+      amortize_ratio = tf.cast(num_examples, tf.float32) / self._total_examples
+      # privacy amplification via sampling, Lemma 2.2 of
+      #   http://arxiv.org/pdf/1405.7085v2.pdf
+      amortize_eps = tf.reshape(tf.log(1.0 + amortize_ratio * (tf.exp(eps) - 1.0)), [1])
+      amortize_delta = tf.reshape(amortize_ratio * delta, [1])
+      return tf.group(
+          tf.assign_add(self._eps_so_far, amortize_eps),
+          tf.assign_add(self._delta_so_far, amortize_delta))
+
+  def get_privacy_spent(self, sess):
+    """Returns the (eps, delta) spent so far.
+
+    Args:
+      sess: the session to run the accumulators in.
+    """
+
+    eps, delta = sess.run([self._eps_so_far, self._delta_so_far])
+    return float(eps[0]), float(delta[0])
+
+
 class AmortizedGaussianSanitizer(object):
   """Sanitizer with Gaussian noise and amoritzed privacy spending accounting.
 
@@ -1144,6 +1376,20 @@ class MovingAverageOptimizer(optimizer.Optimizer):
       RuntimeError: If apply_gradients or minimize has not been called before.
     """
 
+    # Build the swapping saver.
+    return saver.Saver(self.swapping_var_list(var_list), name=name, **kwargs)
+
+  def swapping_var_list(self, var_list=None):
+    """Returns the `dict` name -> variable saved by `swapping_saver`.
+
+    Args:
+      var_list: List of variables to save, as per `Saver()`.
+                If set to None, will save all the variables that have been
+                created before this call.
+
+    Raises:
+      RuntimeError: If apply_gradients or minimize has not been called before.
+    """
     if self._variable_map is None:
       raise RuntimeError('Must call apply_gradients or minimize before '
                          'creating the swapping_saver')
@@ -1159,8 +1405,7 @@ class MovingAverageOptimizer(optimizer.Optimizer):
         swapped_var_list[k] = v_swap
       else:
         swapped_var_list[k] = v
-    # Build the swapping saver.
-    return saver.Saver(swapped_var_list, name=name, **kwargs)
+    return swapped_var_list
 
 
 class NadamOptimizer(tf.train.AdamOptimizer):
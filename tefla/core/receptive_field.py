@@ -5,6 +5,7 @@ from __future__ import division
 from __future__ import print_function
 
 import math
+import hashlib
 import collections
 import numpy as np
 import tensorflow as tf
@@ -311,65 +312,94 @@ def _compute_output_resolution(input_spatial_resolution, kernel_size, stride, to
   return int(math.ceil((input_spatial_resolution + total_padding - kernel_size + 1) / stride))
 
 
-def _get_computed_nodes(name_to_node, current, node_info, input_node_name='', input_node_size=None):
-  """Traverses the graph recursively to compute its topological order.
+def _node_inputs(node_def):
+  """Returns the names of the input nodes of `node_def`, without the control
+  dependencies."""
+  # The character '^' denotes a control dependency, so this input node can be
+  # safely ignored.
+  return [each.split(':')[0] for each in node_def.input if not each.startswith('^')]
 
-  Optionally, the function may also compute the input and output feature map
-  resolutions at each node. In this case, input_node_name and input_node_size
-  must be set. Note that if a node's op type is unknown, the input and output
-  resolutions are ignored and set to None.
+
+def _topological_order(graph_def, name_to_node):
+  """Sorts the nodes of the graph in topological order.
+
+  The graph is traversed depth first with an explicit stack, each node is
+  visited once so that the traversal is linear in the size of the graph and
+  does not depend on the recursion limit. Back edges, e.g. of while loops, are
+  ignored.
+
+  Args:
+    graph_def: GraphDef object.
+    name_to_node: Dict keyed by node name, each entry containing the node's
+      NodeDef.
+
+  Returns:
+    List of the node names, every node after its inputs.
+  """
+  order = []
+  visited = set()
+  for root in graph_def.node:
+    if root.name in visited:
+      continue
+    visited.add(root.name)
+    stack = [(root.name, iter(_node_inputs(root)))]
+    while stack:
+      current, inputs = stack[-1]
+      for each in inputs:
+        if each not in visited:
+          visited.add(each)
+          stack.append((each, iter(_node_inputs(name_to_node[each]))))
+          break
+      else:
+        stack.pop()
+        order.append(current)
+  return order
+
+
+def _compute_node_info(name_to_node, current, node_info, input_node_name='', input_node_size=None):
+  """Computes the topological order and resolutions of a node.
+
+  The input and output resolutions are computed only if input_node_name and
+  input_node_size are set. Note that if a node's op type is unknown, the input
+  and output resolutions are ignored and set to None.
 
   Args:
     name_to_node: Dict keyed by node name, each entry containing the node's
       NodeDef.
     current: Current node name.
-    node_info: Map of nodes we've already traversed, containing their _node_info
-      information.
+    node_info: Map of the nodes already computed, containing their _node_info
+      information; the inputs of current must be computed.
     input_node_name: Name of node with fixed input resolution (optional).
     input_node_size: Fixed input resolution to use (optional).
+
   Returns:
-    order: Order in topological sort for 'current'.
-    input_size: Tensor spatial resolution at input of current node.
-    output_size: Tensor spatial resolution at output of current node.
+    _node_info of current, also added to node_info.
   """
-  if current in node_info:
-    return (node_info[current].order, node_info[current].input_size, node_info[current].output_size)
-
   node_def = name_to_node[current]
 
   if current == input_node_name:
-    order = 0
-    input_size = None
-    output_size = input_node_size
-    node_info[current] = _node_info(order, node_def, input_size, output_size)
-    return (order, input_size, output_size)
+    node_info[current] = _node_info(0, node_def, None, input_node_size)
+    return node_info[current]
 
   input_size = None
   output_size = None
 
   order = 0
   number_inputs = 0
-  for each in node_def.input:
-    # Parses name of input node.
-    if each.startswith('^'):
-      # The character '^' denotes a control dependency, so this input node can
-      # be safely ignored.
+  for each in _node_inputs(node_def):
+    if each not in node_info:
+      # back edge
       continue
-    each = each.split(':')[0]
-    # Recursively computes ordering.
-    (parent_order, _, parent_output_size) = _get_computed_nodes(name_to_node, each, node_info,
-                                                                input_node_name, input_node_size)
-    order = max(order, parent_order + 1)
+    parent_info = node_info[each]
+    order = max(order, parent_info.order + 1)
     if number_inputs == 0:
       # For all the types of nodes we consider, the first input corresponds to
       # the feature map.
-      input_size = parent_output_size
+      input_size = parent_info.output_size
     number_inputs += 1
 
   # Figure out output size for this layer.
-  if input_size is None:
-    output_size = None
-  else:
+  if input_size is not None:
     (kernel_size_x, kernel_size_y, stride_x, stride_y, _, _, total_padding_x,
      total_padding_y) = (get_layer_params(node_def, name_to_node, input_size, force=True))
     output_size = [None] * 2
@@ -379,8 +409,68 @@ def _get_computed_nodes(name_to_node, current, node_info, input_node_name='', in
                                                 total_padding_y)
 
   node_info[current] = _node_info(order, node_def, input_size, output_size)
+  return node_info[current]
+
+
+def _graph_def_fingerprint(graph_def):
+  """Returns a fingerprint of the content of `graph_def`."""
+  return hashlib.sha1(graph_def.SerializeToString(deterministic=True)).hexdigest()
+
+
+class _LRUCache(object):
+  """Least recently used cache of the graph traversals."""
+
+  def __init__(self, capacity):
+    self.capacity = capacity
+    self._entries = collections.OrderedDict()
+
+  def get(self, key, compute):
+    """Returns the entry of `key`, computed by `compute()` on a miss."""
+    if key in self._entries:
+      value = self._entries.pop(key)
+    else:
+      value = compute()
+      if len(self._entries) >= self.capacity:
+        self._entries.popitem(last=False)
+    self._entries[key] = value
+    return value
+
+  def clear(self):
+    self._entries.clear()
 
-  return order, input_size, output_size
+
+# Per graph fingerprint: name_to_node and topological order.
+_GRAPH_CACHE = _LRUCache(8)
+# Per graph fingerprint, input node name and input resolution: node_info and
+# node names in reverse topological order.
+_COMPUTE_ORDER_CACHE = _LRUCache(32)
+
+
+def clear_cache():
+  """Clears the cached graph traversals."""
+  _GRAPH_CACHE.clear()
+  _COMPUTE_ORDER_CACHE.clear()
+
+
+def _get_compute_order(graph_def, input_node_name='', input_node_size=None):
+  """Cached version of get_compute_order, also returning the node names in
+  reverse topological order."""
+  fingerprint = _graph_def_fingerprint(graph_def)
+
+  def parse_graph():
+    name_to_node = parse_graph_nodes(graph_def)
+    return name_to_node, _topological_order(graph_def, name_to_node)
+
+  def compute_order():
+    name_to_node, topological_order = _GRAPH_CACHE.get(fingerprint, parse_graph)
+    node_info = collections.defaultdict(_node_info)
+    for each in topological_order:
+      _compute_node_info(name_to_node, each, node_info, input_node_name, input_node_size)
+    reverse_order = sorted(topological_order, key=lambda name: -node_info[name].order)
+    return node_info, name_to_node, reverse_order
+
+  input_size_key = None if input_node_size is None else tuple(input_node_size)
+  return _COMPUTE_ORDER_CACHE.get((fingerprint, input_node_name, input_size_key), compute_order)
 
 
 def get_compute_order(graph_def, input_node_name='', input_node_size=None):
@@ -391,6 +481,9 @@ def get_compute_order(graph_def, input_node_name='', input_node_size=None):
   must be set. Note that if a node's op type is unknown, the input and output
   resolutions are ignored and set to None.
 
+  The graph is traversed once per graph content, the results are cached by
+  fingerprint of the GraphDef and the returned objects must not be modified.
+
   Args:
     graph_def: GraphDef object.
     input_node_name: Name of node with fixed input resolution (optional). This
@@ -410,10 +503,7 @@ def get_compute_order(graph_def, input_node_name='', input_node_size=None):
     name_to_node: Dict keyed by node name, each entry containing the node's
       NodeDef.
   """
-  name_to_node = parse_graph_nodes(graph_def)
-  node_info = collections.defaultdict(_node_info)
-  for each in graph_def.node:
-    _get_computed_nodes(name_to_node, each.name, node_info, input_node_name, input_node_size)
+  node_info, name_to_node, _ = _get_compute_order(graph_def, input_node_name, input_node_size)
   return node_info, name_to_node
 
 
@@ -597,12 +687,9 @@ def compute_receptive_field_from_graph_def(graph_def,
   stop_propagation = stop_propagation or []
 
   # Computes order of computation for a given graph.
-  node_info, name_to_node = get_compute_order(
+  node_info, name_to_node, reverse_order = _get_compute_order(
       graph_def=graph_def, input_node_name=input_node, input_node_size=input_resolution)
 
-  # Sort in reverse topological order.
-  ordered_node_info = sorted(node_info.items(), key=lambda x: -x[1].order)
-
   # Dictionaries to keep track of receptive field, effective stride and
   # effective padding of different nodes.
   rf_sizes_x = {}
@@ -630,7 +717,8 @@ def compute_receptive_field_from_graph_def(graph_def,
   # alignment checks are skipped, and the effective padding is None.
   undefined_padding = False
 
-  for _, (o, node, _, _) in ordered_node_info:
+  for name in reverse_order:
+    o, node, _, _ = node_info[name]
     if node:
       logging.info("%10d %-100s %-20s" % (o, node.name[:90], node.op))
     else:
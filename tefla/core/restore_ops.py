@@ -0,0 +1,116 @@
+"""Partial restore of model variables from a checkpoint.
+
+Variables of the current graph are matched to checkpoint tensors by name and
+shape once, and all matched tensors are then restored by a single `Saver`, i.e.
+a single batched read of the checkpoint.
+"""
+from __future__ import division, print_function, absolute_import
+
+import collections
+import re
+import time
+
+import tensorflow as tf
+
+from . import logger as log
+
+SKIP_NOT_IN_CHECKPOINT = 'not in checkpoint'
+SKIP_SHAPE_MISMATCH = 'shape mismatch'
+SKIP_NOT_IN_MODEL = 'not in model'
+SKIP_DUPLICATE = 'checkpoint tensor already restored'
+
+RestorePlan = collections.namedtuple('RestorePlan', ['var_list', 'skipped'])
+"""Result of `plan_restore`.
+
+Attributes:
+  var_list: `dict` checkpoint tensor name -> variable, to be restored.
+  skipped: list of `(name, reason)` of the variables and checkpoint tensors that
+    are not restored.
+"""
+
+
+def _compile_rules(rules):
+  return [(re.compile(pattern), replacement) for pattern, replacement in rules or []]
+
+
+def checkpoint_name(var_name, rules=None):
+  """Returns the checkpoint tensor name of a variable name.
+
+  Args:
+    var_name: variable op name, e.g. `conv1/weights`.
+    rules: list of `(pattern, replacement)` regex rules, applied in order with
+      `re.sub`; e.g. `[('^student/', 'teacher/')]` restores the variables of
+      scope `student` from the checkpoint of a model built under `teacher`.
+  """
+  for pattern, replacement in _compile_rules(rules):
+    var_name = pattern.sub(replacement, var_name)
+  return var_name
+
+
+def plan_restore(checkpoint, var_list=None, rules=None):
+  """Matches the variables of the graph to the tensors of a checkpoint.
+
+  Args:
+    checkpoint: checkpoint path.
+    var_list: variables to restore, all the global variables if None.
+    rules: optional name remapping rules, see `checkpoint_name`.
+
+  Returns:
+    a `RestorePlan`. When the rules map several variables to the same
+    checkpoint tensor, the first one is restored and the others are skipped.
+  """
+  reader = tf.train.NewCheckpointReader(checkpoint)
+  ckpt_shapes = reader.get_variable_to_shape_map()
+  if var_list is None:
+    var_list = tf.global_variables()
+  rules = _compile_rules(rules)
+  restore_vars = {}
+  skipped = []
+  used_names = set()
+  for var in var_list:
+    var_name = var.op.name
+    name = var_name
+    for pattern, replacement in rules:
+      name = pattern.sub(replacement, name)
+    used_names.add(name)
+    if name not in ckpt_shapes:
+      skipped.append((var_name, SKIP_NOT_IN_CHECKPOINT))
+    elif not var.get_shape().is_compatible_with(ckpt_shapes[name]):
+      skipped.append((var_name, '%s: model %s, checkpoint %s' %
+                      (SKIP_SHAPE_MISMATCH, var.get_shape(), ckpt_shapes[name])))
+    elif name in restore_vars:
+      skipped.append((var_name, '%s: %s to %s' % (SKIP_DUPLICATE, name,
+                                                   restore_vars[name].op.name)))
+    else:
+      restore_vars[name] = var
+  for name in sorted(set(ckpt_shapes) - used_names):
+    skipped.append((name, SKIP_NOT_IN_MODEL))
+  return RestorePlan(restore_vars, skipped)
+
+
+def restore_partial(sess, checkpoint, var_list=None, rules=None):
+  """Restores the variables that match a checkpoint, in a single restore.
+
+  Variables missing from the checkpoint or with a different shape keep their
+  current values.
+
+  Args:
+    sess: a `tf.Session`.
+    checkpoint: checkpoint path.
+    var_list: variables to restore, all the global variables if None.
+    rules: optional name remapping rules, see `checkpoint_name`.
+
+  Returns:
+    the `RestorePlan` that was restored.
+  """
+  start_time = time.time()
+  plan = plan_restore(checkpoint, var_list, rules)
+  plan_time = time.time() - start_time
+  for name, reason in plan.skipped:
+    log.info('Skipped: %s (%s)' % (name, reason))
+  if plan.var_list:
+    tf.train.Saver(plan.var_list).restore(sess, checkpoint)
+  log.info('Restored %d variables from %s in %.2fs (%.2fs matching), skipped %d' %
+           (len(plan.var_list), checkpoint, time.time() - start_time, plan_time,
+            len(plan.skipped)))
+  return plan
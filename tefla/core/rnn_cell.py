@@ -161,7 +161,13 @@ class LSTMCell(core_rnn_cell.RNNCell):
       i, j, f, o = tf.split(concat, 4, axis=1)
 
       # apply batch normalization to inner state and gates
-      if self.layer_norm is not None:
+      if self.layer_norm is layer_norm:
+        i, j, f, o = tf.split(
+            gate_layer_norm(
+                concat, 4, self.reuse, trainable=self.trainable, **self.layer_norm_args),
+            4,
+            axis=1)
+      elif self.layer_norm is not None:
         i = self.layer_norm(i, self.reuse, trainable=self.trainable, **self.layer_norm_args)
         j = self.layer_norm(j, self.reuse, trainable=self.trainable, **self.layer_norm_args)
         f = self.layer_norm(f, self.reuse, trainable=self.trainable, **self.layer_norm_args)
@@ -1407,11 +1413,15 @@ def layer_norm(x,
     beta, gamma = None, None
     if center:
       beta = tf.get_variable(
-          name='beta', initializer=tf.constant(0.0, shape=[x.get_shape()[-1:]]), trainable=trainable)
+          name='beta',
+          shape=x.get_shape()[-1:],
+          initializer=tf.zeros_initializer(),
+          trainable=trainable)
     if scale:
       gamma = tf.get_variable(
           name='gamma',
-          initializer=tf.constant(1.0, shape=[x.get_shape()[-1:]]),
+          shape=x.get_shape()[-1:],
+          initializer=tf.ones_initializer(),
           trainable=trainable)
 
     mean, variance = tf.nn.moments(x, axis, keep_dims=True)
@@ -1420,6 +1430,54 @@ def layer_norm(x,
     return _collect_named_outputs(outputs_collections, name, output)
 
 
+def gate_layer_norm(x,
+                    num_gates,
+                    reuse,
+                    center=True,
+                    scale=True,
+                    trainable=True,
+                    epsilon=1e-12,
+                    name='gate_ln',
+                    outputs_collections=None):
+  """Layer normalization of each of the gates of a fused gates `Tensor`.
+
+  The gates are normalized separately, with one moments computation and one
+  normalization for all of them, each gate having its own `beta` and `gamma`.
+  The variables use initializers instead of constant initial values, so that
+  they can be created within the loop of `tf.nn.dynamic_rnn`.
+
+  Args:
+      x: a 2-D `Tensor` [batch_size, num_gates * num_units] of concatenated gates.
+      num_gates: `int`, number of gates.
+      reuse: whether or not the layer and its variables should be reused. To be
+          able to reuse the layer scope must be given.
+      center: If True, subtract `beta`. If False, `beta` is ignored.
+      scale: If True, multiply by `gamma`. If False, `gamma` is not used.
+      trainable: If `True` also add variables to the graph collection
+          `GraphKeys.TRAINABLE_VARIABLES` (see `tf.Variable`).
+      epsilon: small float added to variance to avoid dividing by zero.
+      name: Optional scope/name for `variable_scope`.
+      outputs_collections: collections to add the outputs.
+
+  Returns:
+      A `Tensor` of the shape of `x`, the normalized gates.
+  """
+  with tf.variable_scope(name, reuse=reuse):
+    x = tf.convert_to_tensor(x)
+    size = x.get_shape()[-1].value
+    gates = tf.reshape(x, [-1, num_gates, size // num_gates])
+    mean, variance = tf.nn.moments(gates, [2], keep_dims=True)
+    output = tf.reshape((gates - mean) * tf.rsqrt(variance + epsilon), tf.shape(x))
+    if scale:
+      output *= tf.get_variable(
+          name='gamma', shape=[size], initializer=tf.ones_initializer(), trainable=trainable)
+    if center:
+      output += tf.get_variable(
+          name='beta', shape=[size], initializer=tf.zeros_initializer(), trainable=trainable)
+    output.set_shape(x.get_shape())
+    return _collect_named_outputs(outputs_collections, name, output)
+
+
 def _attention(query,
                attn_states,
                is_training,
@@ -1480,8 +1538,14 @@ def _rnn_wrapper(inputs,
                  return_state=False,
                  initial_state=None,
                  dynamic=False,
+                 unroll=True,
                  scope="rnn_wrapper"):
-  """RNN cell Wrapper."""
+  """RNN cell Wrapper.
+
+  With `unroll`, the cell is statically unrolled over the timesteps, otherwise
+  the recurrence runs in a single `tf.while_loop` through `tf.nn.dynamic_rnn`,
+  so the graph size does not depend on the number of timesteps.
+  """
   sequence_length = None
   if dynamic:
     sequence_length = helper.retrieve_seq_length(
@@ -1501,6 +1565,24 @@ def _rnn_wrapper(inputs,
         raise Exception("Invalid dropout type (must be a 2-D tuple of " "float)")
       cell = DropoutWrapper(cell, is_training, input_keep_prob, output_keep_prob)
 
+    if not unroll:
+      if type(inputs) in [list, np.array]:
+        inputs = tf.stack(inputs, axis=1)
+      outputs, state = tf.nn.dynamic_rnn(
+          cell,
+          inputs,
+          sequence_length=sequence_length,
+          initial_state=initial_state,
+          dtype=tf.float32,
+          scope=name)
+      if return_seq:
+        o = outputs
+      elif dynamic:
+        o = helper.advanced_indexing(outputs, sequence_length)
+      else:
+        o = outputs[:, -1]
+      return (o, state) if return_state else o
+
     outputs = inputs
     if type(outputs) not in [list, np.array]:
       ndim = len(input_shape)
@@ -1543,7 +1625,10 @@ def lstm(inputs,
          return_state=False,
          initial_state=None,
          dynamic=True,
+         unroll=True,
          trainable=True,
+         layer_norm=None,
+         layer_norm_args=None,
          scope='lstm'):
   """LSTM. Long Short Term Memory Recurrent Layer.
 
@@ -1572,7 +1657,14 @@ def lstm(inputs,
           So a sequence padded with 0 at the end must be provided. When
           computation is performed, it will stop when it meets a step with
           a value of 0.
+      unroll: `bool`. If True, the cell is statically unrolled over the
+          timesteps and `return_seq` returns a list of 2-D Tensors, else the
+          recurrence runs in a single loop, whose graph size does not depend
+          on the number of timesteps.
       trainable: `bool`. If True, weights will be trainable.
+      layer_norm: optional normalization function of the gates and of the cell
+          state, `layer_norm` normalizes the gates with `gate_layer_norm`.
+      layer_norm_args: optional dict, layer_norm arguments
       scope: `str`. Define this layer scope (optional). A scope can be
           used to share variables between layers. Note that scope will
           override name.
@@ -1589,7 +1681,9 @@ def lstm(inputs,
       forget_bias=forget_bias,
       use_bias=use_bias,
       w_init=w_init,
-      trainable=trainable)
+      trainable=trainable,
+      layer_norm=layer_norm,
+      layer_norm_args=layer_norm_args)
   x = _rnn_wrapper(
       inputs,
       cell,
@@ -1600,6 +1694,7 @@ def lstm(inputs,
       return_state=return_state,
       initial_state=initial_state,
       dynamic=dynamic,
+      unroll=unroll,
       scope=scope)
 
   return x
@@ -1618,6 +1713,7 @@ def gru(inputs,
         return_state=False,
         initial_state=None,
         dynamic=True,
+        unroll=True,
         trainable=True,
         scope='gru'):
   """GRU. Gated Recurrent Layer.
@@ -1646,6 +1742,10 @@ def gru(inputs,
           So a sequence padded with 0 at the end must be provided. When
           computation is performed, it will stop when it meets a step with
           a value of 0.
+      unroll: `bool`. If True, the cell is statically unrolled over the
+          timesteps and `return_seq` returns a list of 2-D Tensors, else the
+          recurrence runs in a single loop, whose graph size does not depend
+          on the number of timesteps.
       trainable: `bool`. If True, weights will be trainable.
       scope: `str`. Define this layer scope (optional). A scope can be
           used to share variables between layers. Note that scope will
@@ -1673,6 +1773,7 @@ def gru(inputs,
       return_state=return_state,
       initial_state=initial_state,
       dynamic=dynamic,
+      unroll=unroll,
       scope=scope)
 
   return x
@@ -54,12 +54,14 @@ def summary_activation(tensor, name=None, collections=None):
     tf.summary.scalar(name + '/rms', rms(tensor), collections=collections)
 
 
-def create_summary_writer(summary_dir, sess):
+def create_summary_writer(summary_dir, sess, flush_secs=120):
   """creates the summar writter for training and validation.
 
   Args:
       summary_dir: the directory to write summary
       sess: the session to sun the ops
+      flush_secs: interval in seconds of the background flushes of pending
+          summaries to disk
 
   Returns:
       training and vaidation summary writter
@@ -70,8 +72,9 @@ def create_summary_writer(summary_dir, sess):
     os.mkdir(summary_dir + '/train')
   if not os.path.exists(summary_dir + '/test'):
     os.mkdir(summary_dir + '/test')
-  train_writer = tf.summary.FileWriter(summary_dir + '/train', graph=sess.graph)
-  val_writer = tf.summary.FileWriter(summary_dir + '/test', graph=sess.graph)
+  train_writer = tf.summary.FileWriter(
+      summary_dir + '/train', graph=sess.graph, flush_secs=flush_secs)
+  val_writer = tf.summary.FileWriter(summary_dir + '/test', graph=sess.graph, flush_secs=flush_secs)
   return train_writer, val_writer
 
 
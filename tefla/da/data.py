@@ -10,6 +10,10 @@ Enhanced by Mrinal Haloi
 """
 from __future__ import division, print_function
 
+import functools
+import hashlib
+import os
+
 from six import string_types
 from PIL import Image
 from PIL import ImageEnhance
@@ -38,7 +42,8 @@ def fast_warp(img, tf, output_shape, mode='constant', mode_cval=0, order=0):
   Args:
       img: `ndarray`, input image
       tf: For 2-D images, you can directly pass a transformation object
-          e.g. skimage.transform.SimilarityTransform, or its inverse.
+          e.g. skimage.transform.SimilarityTransform, or its inverse, or a
+          (3, 3) transformation matrix.
       output_shape: tuple, (rows, cols)
       mode: mode for transformation
           available modes: {`constant`, `edge`, `symmetric`, `reflect`, `wrap`}
@@ -55,7 +60,7 @@ def fast_warp(img, tf, output_shape, mode='constant', mode_cval=0, order=0):
   Returns:
       warped, double `ndarray`
   """
-  m = tf.params
+  m = tf.params if hasattr(tf, 'params') else tf
   t_img = np.zeros((img.shape[0],) + output_shape, img.dtype)
   for i in range(t_img.shape[0]):
     t_img[i] = _warp_fast(
@@ -233,6 +238,38 @@ def build_augmentation_transform(
   return tform_augment
 
 
+def _draw_perturbation(zoom_range, rotation_range, shear_range, translation_range, do_flip,
+                       allow_stretch, rng):
+  """Draws the perturbation params of one image, returns a tuple (zoom_x,
+  zoom_y, rotation, shear, shift_x, shift_y, flip)."""
+  shift_x = rng.uniform(*translation_range)
+  shift_y = rng.uniform(*translation_range)
+  rotation = rng.uniform(*rotation_range)
+  shear = rng.uniform(*shear_range)
+
+  if do_flip:
+    flip = (rng.randint(2) > 0)  # flip half of the time
+  else:
+    flip = False
+
+  # random zoom
+  log_zoom_range = [np.log(z) for z in zoom_range]
+  if isinstance(allow_stretch, float):
+    log_stretch_range = [-np.log(allow_stretch), np.log(allow_stretch)]
+    zoom = np.exp(rng.uniform(*log_zoom_range))
+    stretch = np.exp(rng.uniform(*log_stretch_range))
+    zoom_x = zoom * stretch
+    zoom_y = zoom / stretch
+  elif allow_stretch is True:  # avoid bugs, f.e. when it is an integer
+    zoom_x = np.exp(rng.uniform(*log_zoom_range))
+    zoom_y = np.exp(rng.uniform(*log_zoom_range))
+  else:
+    zoom_x = zoom_y = np.exp(rng.uniform(*log_zoom_range))
+  # the range should be multiplicatively symmetric, so [1/1.1, 1.1] instead
+  # of [0.9, 1.1] makes more sense.
+  return zoom_x, zoom_y, rotation, shear, shift_x, shift_y, flip
+
+
 def random_perturbation_transform(zoom_range,
                                   rotation_range,
                                   shear_range,
@@ -260,35 +297,154 @@ def random_perturbation_transform(zoom_range,
   Returns:
       augment transform instance
   """
-  shift_x = rng.uniform(*translation_range)
-  shift_y = rng.uniform(*translation_range)
-  translation = (shift_x, shift_y)
+  zoom_x, zoom_y, rotation, shear, shift_x, shift_y, flip = _draw_perturbation(
+      zoom_range, rotation_range, shear_range, translation_range, do_flip, allow_stretch, rng)
+  return build_augmentation_transform((zoom_x, zoom_y), rotation, shear, (shift_x, shift_y), flip)
+
+
+def random_perturbation_params(n,
+                               zoom_range,
+                               rotation_range,
+                               shear_range,
+                               translation_range,
+                               do_flip=True,
+                               allow_stretch=False,
+                               rng=np.random):
+  """Random perturbation params for a batch of images.
+
+  The params are drawn in the same order and with the same RNG calls as
+  `random_perturbation_transform`, image after image, so that for the same
+  seed the transforms are identical to the ones of the legacy sampler, and
+  drawing `n` images at once or one at a time gives identical params.
 
-  rotation = rng.uniform(*rotation_range)
-  shear = rng.uniform(*shear_range)
+  Args:
+      n: int, number of images
+      zoom_range: a tuple(min_zoom, max_zoom)
+      rotation_range: a tuple(min_angle, max_angle)
+      shear_range: a tuple(min_shear, max_shear)
+      translation_range: a tuple(min_shift, max_shift)
+      do_flip: bool, flip half of the images
+      allow_stretch: bool or float, stretch the images
+      rng: an instance for random number generation
 
-  if do_flip:
-    flip = (rng.randint(2) > 0)  # flip half of the time
-  else:
-    flip = False
+  Returns:
+      a dict of `(n,)` arrays: zoom_x, zoom_y, rotation, shear, shift_x,
+          shift_y and flip
+  """
+  draws = [
+      _draw_perturbation(zoom_range, rotation_range, shear_range, translation_range, do_flip,
+                         allow_stretch, rng) for _ in range(n)
+  ]
+  names = ('zoom_x', 'zoom_y', 'rotation', 'shear', 'shift_x', 'shift_y', 'flip')
+  values = zip(*draws) if draws else [()] * len(names)
+  params = {name: np.array(v, dtype=np.float64) for name, v in zip(names, values)}
+  params['flip'] = params['flip'].astype(bool)
+  return params
 
-  # random zoom
-  log_zoom_range = [np.log(z) for z in zoom_range]
-  if isinstance(allow_stretch, float):
-    log_stretch_range = [-np.log(allow_stretch), np.log(allow_stretch)]
-    zoom = np.exp(rng.uniform(*log_zoom_range))
-    stretch = np.exp(rng.uniform(*log_stretch_range))
-    zoom_x = zoom * stretch
-    zoom_y = zoom / stretch
-  elif allow_stretch is True:  # avoid bugs, f.e. when it is an integer
-    zoom_x = np.exp(rng.uniform(*log_zoom_range))
-    zoom_y = np.exp(rng.uniform(*log_zoom_range))
-  else:
-    zoom_x = zoom_y = np.exp(rng.uniform(*log_zoom_range))
-  # the range should be multiplicatively symmetric, so [1/1.1, 1.1] instead
-  # of [0.9, 1.1] makes more sense.
 
-  return build_augmentation_transform((zoom_x, zoom_y), rotation, shear, translation, flip)
+def build_augmentation_matrices(zoom_x, zoom_y, rotation, shear, shift_x, shift_y, flip):
+  """Augmentation transform matrices.
+
+  Vectorized `build_augmentation_transform`, returns the same matrices as the
+  `params` of the skimage transforms it builds.
+
+  Args:
+      zoom_x, zoom_y: `(n,)` arrays, zoom factors
+      rotation: `(n,)` array, rotation angles in degrees
+      shear: `(n,)` array, shear angles in degrees
+      shift_x, shift_y: `(n,)` arrays, translations
+      flip: `(n,)` bool array, flip the images
+
+  Returns:
+      a `(n, 3, 3)` array of transform matrices
+  """
+  flip = np.asarray(flip, dtype=bool)
+  rotation = np.deg2rad(np.where(flip, np.add(rotation, 180), rotation))
+  shear = np.deg2rad(np.where(flip, np.add(shear, 180), shear))
+  sx = 1. / np.asarray(zoom_x, dtype=np.float64)
+  sy = 1. / np.asarray(zoom_y, dtype=np.float64)
+  m = np.zeros((len(flip), 3, 3))
+  m[:, 0, 0] = sx * np.cos(rotation)
+  m[:, 0, 1] = -sy * np.sin(rotation + shear)
+  m[:, 0, 2] = shift_x
+  m[:, 1, 0] = sx * np.sin(rotation)
+  m[:, 1, 1] = sy * np.cos(rotation + shear)
+  m[:, 1, 2] = shift_y
+  m[:, 2, 2] = 1.
+  return m
+
+
+def build_perturbation_matrices(augment, image_shape, target_shape):
+  """Full perturbation matrices of a batch of images.
+
+  Equivalent to composing the centering, center, augment and uncenter
+  transforms as `perturb` does, `tform_centering + (tform_uncenter +
+  tform_augment + tform_center)`, without building skimage objects: as the
+  other transforms are translations, only the translation part changes.
+
+  Args:
+      augment: `(n, 3, 3)` array of augmentation matrices
+      image_shape: tuple(rows, cols), input images shape
+      target_shape: tuple(rows, cols), output images shape
+
+  Returns:
+      a `(n, 3, 3)` array of transform matrices, to be used with `fast_warp`
+  """
+  rows, cols = image_shape
+  trows, tcols = target_shape
+  centering = np.array([(cols - tcols) / 2.0, (rows - trows) / 2.0])
+  center = np.array([cols / 2.0 - 0.5, rows / 2.0 - 0.5])
+  m = augment.copy()
+  m[:, :2, 2] += np.einsum('nij,j->ni', augment[:, :2, :2], centering - center) + center
+  return m
+
+
+def random_perturbation_matrices(n, image_shape, target_shape, augmentation_params,
+                                 rng=np.random):
+  """Random perturbation matrices for a batch of `n` images of the same shape.
+
+  Args:
+      n: int, number of images
+      image_shape: tuple(rows, cols), input images shape
+      target_shape: tuple(rows, cols), output images shape
+      augmentation_params: a dict, see `random_perturbation_params`
+      rng: an instance for random number generation
+
+  Returns:
+      a `(n, 3, 3)` array of transform matrices
+  """
+  params = random_perturbation_params(n, rng=rng, **augmentation_params)
+  return build_perturbation_matrices(
+      build_augmentation_matrices(**params), image_shape, target_shape)
+
+
+def perturb_batch(imgs,
+                  augmentation_params,
+                  target_shape,
+                  rng=np.random,
+                  mode='constant',
+                  mode_cval=0):
+  """Perturb a batch of images of the same shape.
+
+  Args:
+      imgs: a `ndarray` of shape (n, channels, rows, cols)
+      augmentation_params: a dict, with augmentation name as keys and values as params
+      target_shape: a tuple(rows, cols), output image shape
+      rng: an instance for random number generation
+      mode: mode for transformation
+          available modes: {`constant`, `edge`, `symmetric`, `reflect`, `wrap`}
+      mode_cval: float, Used in conjunction with mode `constant`,
+          the value outside the image boundaries
+
+  Returns:
+      a `ndarray` of transformed images
+  """
+  matrices = random_perturbation_matrices(
+      len(imgs), imgs.shape[2:], target_shape, augmentation_params, rng=rng)
+  return np.array([
+      fast_warp(img, m, output_shape=target_shape, mode=mode, mode_cval=mode_cval)
+      for img, m in zip(imgs, matrices)
+  ])
 
 
 def definite_crop(img, bbox):
@@ -324,18 +480,8 @@ def perturb(img, augmentation_params, target_shape, rng=np.random, mode='constan
   Returns:
       a `ndarray` of transformed image
   """
-  shape = img.shape[1:]
-  tform_centering = build_centering_transform(shape, target_shape)
-  tform_center, tform_uncenter = build_center_uncenter_transforms(shape)
-  tform_augment = random_perturbation_transform(rng=rng, **augmentation_params)
-  # shift to center, augment, shift back (for the rotation/shearing)
-  tform_augment = tform_uncenter + tform_augment + tform_center
-  return fast_warp(
-      img,
-      tform_centering + tform_augment,
-      output_shape=target_shape,
-      mode=mode,
-      mode_cval=mode_cval)
+  m = random_perturbation_matrices(1, img.shape[1:], target_shape, augmentation_params, rng=rng)
+  return fast_warp(img, m[0], output_shape=target_shape, mode=mode, mode_cval=mode_cval)
 
 
 def perturb_rescaled(img,
@@ -510,43 +656,158 @@ def load_augment(fname,
   return img.transpose(1, 2, 0)
 
 
-def image_no_preprocessing(fname):
+def image_no_preprocessing(fname, target_size=None):
   """Open Image.
 
   Args:
       fname: Image filename
+      target_size: optional int, if given the image is decoded at reduced
+          resolution and resized to (target_size, target_size), see
+          `image_reduced`
 
   Returns:
       PIL formatted image
   """
+  if target_size is not None:
+    return image_reduced(fname, target_size)
   return Image.open(fname)
 
 
-def load_images(imgs, preprocessor=image_no_preprocessing):
+def open_rgb(fname, target_size=None):
+  """Open an image as RGB.
+
+  If `target_size` is given, JPEGs are decoded with reduced-size DCT scaling
+  (PIL draft mode), at the smallest of the 1/1, 1/2, 1/4, 1/8 scales keeping
+  both sides >= `target_size`, which skips most of the decoding work for large
+  images.
+
+  Args:
+      fname: Image filename
+      target_size: optional int, minimum size of the decoded image sides
+
+  Returns:
+      PIL formatted RGB image
+  """
+  img = Image.open(fname)
+  if target_size is not None and img.format == 'JPEG':
+    img.draft('RGB', (target_size, target_size))
+  return img.convert('RGB')
+
+
+def image_reduced(fname, target_size, resample=Image.BILINEAR):
+  """Open an image decoded at reduced resolution and resized to a square.
+
+  Args:
+      fname: Image filename
+      target_size: int, size of the output image
+      resample: PIL resampling filter of the resize
+
+  Returns:
+      PIL formatted RGB image of size (target_size, target_size)
+  """
+  img = open_rgb(fname, target_size)
+  if img.size != (target_size, target_size):
+    img = img.resize((target_size, target_size), resample)
+  return img
+
+
+def reduced_preprocessor(target_size, cache_dir=None):
+  """Preprocessor decoding images at reduced resolution, see `image_reduced`.
+
+  Args:
+      target_size: int, size of the output images
+      cache_dir: optional directory to cache the resized images in
+
+  Returns:
+      a picklable preprocessor function
+  """
+  preprocessor = functools.partial(image_reduced, target_size=target_size)
+  if cache_dir is not None:
+    preprocessor = CachedPreprocessor(preprocessor, cache_dir)
+  return preprocessor
+
+
+class CachedPreprocessor(object):
+  """Caches the output of an image preprocessor on disk.
+
+  Outputs are stored as uint8 `.npy` arrays, keyed by the source file path,
+  size and modification time and by `key`. Writes go through a temporary file
+  so that concurrent workers never read a partial entry.
+
+  Args:
+      preprocessor: a function fname -> PIL image or `ndarray`
+      cache_dir: cache directory
+      key: a string identifying the preprocessing, defaults to a description
+          of `preprocessor`
+  """
+
+  def __init__(self, preprocessor, cache_dir, key=None):
+    self.preprocessor = preprocessor
+    self.cache_dir = cache_dir
+    if key is None:
+      func = getattr(preprocessor, 'func', preprocessor)
+      keywords = getattr(preprocessor, 'keywords', None) or {}
+      key = '%s%r%r' % (getattr(func, '__name__', repr(func)), getattr(preprocessor, 'args', ()),
+                        sorted(keywords.items()))
+    self.key = key
+    if not os.path.exists(cache_dir):
+      try:
+        os.makedirs(cache_dir)
+      except OSError:
+        pass
+
+  def cache_file(self, fname):
+    stat = os.stat(fname)
+    digest = hashlib.sha1(
+        ('%s|%d|%d|%s' % (os.path.abspath(fname), stat.st_size, int(stat.st_mtime),
+                          self.key)).encode('utf-8')).hexdigest()
+    return os.path.join(self.cache_dir, digest + '.npy')
+
+  def __call__(self, fname):
+    cache_file = self.cache_file(fname)
+    try:
+      return np.load(cache_file)
+    except (IOError, OSError, ValueError):
+      pass
+    img = np.asarray(self.preprocessor(fname), dtype=np.uint8)
+    tmp_file = '%s.tmp-%d.npy' % (cache_file[:-4], os.getpid())
+    np.save(tmp_file, img)
+    os.rename(tmp_file, cache_file)
+    return img
+
+
+def load_images(imgs, preprocessor=image_no_preprocessing, target_size=None):
   """Load batch of images.
 
   Args:
       imgs: a list of image filenames
       preprocessor: image processing function
+      target_size: optional int, see `load_image`
 
   Returns:
       a `ndarray` with a batch of images
   """
-  return np.array([load_image(f, preprocessor) for f in imgs])
+  return np.array([load_image(f, preprocessor, target_size) for f in imgs])
 
 
-def load_image(img, preprocessor=image_no_preprocessing):
+def load_image(img, preprocessor=image_no_preprocessing, target_size=None):
   """Load image.
 
   Args:
       img: a image filename
       preprocessor: image processing function
+      target_size: optional int, with the default preprocessor, decode the
+          image at reduced resolution and resize it to
+          (target_size, target_size)
 
   Returns:
       a processed image
   """
   if isinstance(img, string_types):
-    p_img = preprocessor(img)
+    if target_size is not None and preprocessor is image_no_preprocessing:
+      p_img = image_reduced(img, target_size)
+    else:
+      p_img = preprocessor(img)
     return np.array(p_img, dtype=np.float32).transpose(2, 1, 0)
   elif isinstance(img, np.ndarray):
     return preprocessor(img)
@@ -13,3 +13,4 @@ from . import textdataset
 from . import texttfrecords
 from . import tokenizer
 from . import vocabulary
+from . import compact_vocabulary
@@ -0,0 +1,324 @@
+"""Compact, memory-mapped vocabulary storage.
+
+A compact vocabulary file holds the UTF-8 bytes of all words concatenated in
+id order, an offsets array and an open-addressing hash index, so that it can be
+memory-mapped (and shared by all the processes on a machine through the page
+cache) instead of being parsed into Python dicts and lists. Lookups of a batch
+of words are done with a handful of vectorized numpy operations.
+
+File layout (little endian)::
+
+  magic (8 bytes) | num_words (u8) | blob_size (u8) | table_size (u8) | pad (u8)
+  offsets: uint64[num_words + 1]
+  table: int64[table_size], word id or -1
+  blob: uint8[blob_size]
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import struct
+
+import numpy as np
+import six
+
+try:
+  from collections.abc import Mapping
+except ImportError:
+  from collections import Mapping
+
+MAGIC = b'TFLCVOC1'
+_HEADER = struct.Struct('<8sQQQQ')
+_FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+_FNV_PRIME = np.uint64(0x100000001b3)
+
+
+def _to_bytes_matrix(words):
+  """Encodes words to a zero padded uint8 matrix and their byte lengths."""
+  encoded = np.array([w.encode('utf-8') if isinstance(w, six.text_type) else w for w in words],
+                     dtype=np.bytes_)
+  width = max(encoded.dtype.itemsize, 1)
+  matrix = np.frombuffer(encoded.astype('S%d' % width).tobytes(), dtype=np.uint8)
+  return matrix.reshape(len(encoded), width), np.char.str_len(encoded).astype(np.int64)
+
+
+def _fnv1a(matrix, lengths):
+  """Vectorized 64-bit FNV-1a hash of the rows of a padded byte matrix."""
+  hashes = np.full(matrix.shape[0], _FNV_OFFSET, dtype=np.uint64)
+  for j in range(matrix.shape[1]):
+    active = lengths > j
+    h = hashes[active] ^ matrix[active, j].astype(np.uint64)
+    hashes[active] = h * _FNV_PRIME
+  return hashes
+
+
+def _rows_equal(matrix, lengths, blob, offsets, ids):
+  """Compares rows of a padded byte matrix against the words `ids` of `blob`."""
+  starts = offsets[ids].astype(np.int64)
+  equal = (offsets[ids + 1].astype(np.int64) - starts) == lengths
+  if len(blob) and np.any(equal):
+    cols = np.arange(matrix.shape[1])
+    positions = np.minimum(starts[:, None] + cols, len(blob) - 1)
+    valid = cols < lengths[:, None]
+    same = (blob[positions] == matrix) | ~valid
+    equal &= same.all(axis=1)
+  return equal
+
+
+def _table_lookup(table, blob, offsets, matrix, lengths, hashes):
+  """Probes the hash table, returns word ids or -1 for missing words."""
+  mask = np.uint64(len(table) - 1)
+  ids = np.full(len(hashes), -1, dtype=np.int64)
+  pending = np.arange(len(hashes))
+  probe = 0
+  while len(pending):
+    slots = ((hashes[pending] + np.uint64(probe)) & mask).astype(np.int64)
+    candidates = table[slots]
+    occupied = candidates >= 0
+    found = np.zeros(len(pending), dtype=bool)
+    found[occupied] = _rows_equal(matrix[pending[occupied]], lengths[pending[occupied]], blob,
+                                  offsets, candidates[occupied])
+    ids[pending[found]] = candidates[found]
+    pending = pending[occupied & ~found]
+    probe += 1
+  return ids
+
+
+def write_compact_vocab(words, path, load_factor=0.5):
+  """Writes words to a compact vocabulary file, word ids follow their order.
+
+  As for a python dict, a duplicated word maps to its last id.
+
+  Args:
+    words: an iterable of `str`.
+    path: output file path, on a local filesystem.
+    load_factor: maximum fill ratio of the hash index.
+
+  Returns:
+    the number of words written.
+  """
+  blob = bytearray()
+  offsets = [0]
+  for word in words:
+    blob += word.encode('utf-8') if isinstance(word, six.text_type) else word
+    offsets.append(len(blob))
+  num_words = len(offsets) - 1
+  offsets = np.asarray(offsets, dtype=np.uint64)
+  blob = np.frombuffer(bytes(blob), dtype=np.uint8)
+  table_size = 1
+  while table_size * load_factor < max(num_words, 1):
+    table_size *= 2
+  table = np.full(table_size, -1, dtype=np.int64)
+
+  mask = np.uint64(table_size - 1)
+  chunk = 1 << 16
+  # Highest ids are inserted first so that duplicated words keep the last id: equal words share
+  # the probe sequence, the first one to land claims the slot and the others are dropped.
+  for start in reversed(range(0, num_words, chunk)):
+    ids = np.arange(start, min(start + chunk, num_words), dtype=np.int64)[::-1]
+    lengths = (offsets[ids + 1] - offsets[ids]).astype(np.int64)
+    cols = np.arange(max(int(lengths.max()), 1))
+    valid = cols < lengths[:, None]
+    positions = np.where(valid, offsets[ids].astype(np.int64)[:, None] + cols, 0)
+    matrix = np.where(valid, blob[positions] if len(blob) else 0, 0).astype(np.uint8)
+    hashes = _fnv1a(matrix, lengths)
+    probes = np.zeros(len(ids), dtype=np.uint64)
+    pending = np.arange(len(ids))
+    while len(pending):
+      slots = ((hashes[pending] + probes[pending]) & mask).astype(np.int64)
+      current = table[slots]
+      occupied = current >= 0
+      duplicate = np.zeros(len(pending), dtype=bool)
+      duplicate[occupied] = _rows_equal(matrix[pending[occupied]], lengths[pending[occupied]],
+                                        blob, offsets, current[occupied])
+      free = ~occupied
+      _, first = np.unique(slots[free], return_index=True)
+      winners = np.flatnonzero(free)[first]
+      table[slots[winners]] = ids[pending[winners]]
+      placed = np.zeros(len(pending), dtype=bool)
+      placed[winners] = True
+      advance = occupied & ~duplicate
+      probes[pending[advance]] += np.uint64(1)
+      # Losers of a slot race retry the same slot, they may be duplicates of the winner.
+      pending = pending[advance | (free & ~placed)]
+  with open(path, 'wb') as f:
+    f.write(_HEADER.pack(MAGIC, num_words, len(blob), table_size, 0))
+    f.write(offsets.tobytes())
+    f.write(table.tobytes())
+    f.write(blob.tobytes())
+  return num_words
+
+
+def is_compact_vocab(path):
+  """Returns True if `path` is a local compact vocabulary file."""
+  try:
+    with open(path, 'rb') as f:
+      return f.read(len(MAGIC)) == MAGIC
+  except (IOError, OSError):
+    return False
+
+
+class CompactVocabulary(object):
+  """Memory-mapped vocabulary with batch encode/decode.
+
+  Args:
+      path: path of a file written by `write_compact_vocab`.
+  """
+
+  def __init__(self, path):
+    with open(path, 'rb') as f:
+      magic, num_words, blob_size, table_size, _ = _HEADER.unpack(f.read(_HEADER.size))
+    if magic != MAGIC:
+      raise ValueError('%s is not a compact vocabulary file' % path)
+    self.path = path
+    offset = _HEADER.size
+    self._offsets = np.memmap(path, np.uint64, 'r', offset, (num_words + 1,))
+    offset += self._offsets.nbytes
+    self._table = np.memmap(path, np.int64, 'r', offset, (table_size,))
+    offset += self._table.nbytes
+    self._blob = (np.memmap(path, np.uint8, 'r', offset, (blob_size,))
+                  if blob_size else np.zeros(0, dtype=np.uint8))
+    self._num_words = num_words
+
+  def __len__(self):
+    return self._num_words
+
+  @property
+  def blob(self):
+    return self._blob
+
+  @property
+  def offsets(self):
+    return self._offsets
+
+  def encode_many(self, words, default=-1):
+    """Returns the int64 ids of a list of words.
+
+    Args:
+      words: a list of `str`.
+      default: id of the words not in the vocabulary, if None a KeyError is
+        raised for them instead.
+    """
+    if not len(words):
+      return np.zeros(0, dtype=np.int64)
+    matrix, lengths = _to_bytes_matrix(words)
+    ids = _table_lookup(self._table, self._blob, self._offsets, matrix, lengths,
+                        _fnv1a(matrix, lengths))
+    missing = ids < 0
+    if np.any(missing):
+      if default is None:
+        raise KeyError(words[int(np.flatnonzero(missing)[0])])
+      ids[missing] = default
+    return ids
+
+  def _gather(self, ids, sep=b''):
+    """Concatenates the bytes of `ids`, each followed by `sep`."""
+    ids = np.asarray(ids, dtype=np.int64)
+    starts = self._offsets[ids].astype(np.int64)
+    lengths = self._offsets[ids + 1].astype(np.int64) - starts
+    sizes = lengths + len(sep)
+    total = int(sizes.sum())
+    ends = np.cumsum(sizes)
+    row_starts = ends - sizes
+    within = np.arange(total) - np.repeat(row_starts, sizes)
+    is_word = within < np.repeat(lengths, sizes)
+    out = np.empty(total, dtype=np.uint8)
+    out[is_word] = self._blob[(np.repeat(starts, sizes) + within)[is_word]]
+    if sep:
+      out[~is_word] = np.tile(np.frombuffer(sep, dtype=np.uint8), len(ids))
+    return out.tobytes(), row_starts, lengths
+
+  def decode_many(self, ids, unknown=None):
+    """Returns the words of a sequence of ids.
+
+    Args:
+      ids: a sequence of int ids.
+      unknown: optional callable mapping an out of range id to a word, an
+        IndexError is raised for them if None.
+    """
+    ids = np.asarray(ids, dtype=np.int64).ravel()
+    invalid = (ids < 0) | (ids >= self._num_words)
+    if np.any(invalid) and unknown is None:
+      raise IndexError('word id %d out of range' % ids[invalid][0])
+    data, starts, lengths = self._gather(ids[~invalid])
+    words = [data[s:s + l].decode('utf-8') for s, l in zip(starts.tolist(), lengths.tolist())]
+    if not np.any(invalid):
+      return words
+    it = iter(words)
+    return [unknown(int(i)) if bad else next(it) for i, bad in zip(ids, invalid)]
+
+  def join(self, ids, sep=' '):
+    """Decodes in-range ids to a single `sep` separated string."""
+    if not len(ids):
+      return ''
+    data, _, _ = self._gather(ids, sep.encode('utf-8'))
+    return data[:-len(sep.encode('utf-8')) or None].decode('utf-8')
+
+  def word(self, word_id):
+    return self.decode_many([word_id])[0]
+
+  def chars(self):
+    """The set of characters used by the vocabulary."""
+    return set(self._blob.tobytes().decode('utf-8'))
+
+  @property
+  def token_to_id(self):
+    """A read-only `dict`-like view word -> id."""
+    return _TokenToId(self)
+
+  @property
+  def id_to_token(self):
+    """A read-only `dict`-like view id -> word, also indexable like a list."""
+    return _IdToToken(self)
+
+
+class _TokenToId(Mapping):
+
+  def __init__(self, vocab):
+    self._vocab = vocab
+
+  def __getitem__(self, word):
+    return int(self._vocab.encode_many([word], default=None)[0])
+
+  def __iter__(self):
+    for word in self._vocab.id_to_token.values():
+      yield word
+
+  def __len__(self):
+    return len(self._vocab)
+
+
+class _IdToToken(Mapping):
+
+  def __init__(self, vocab):
+    self._vocab = vocab
+
+  def __getitem__(self, word_id):
+    if not isinstance(word_id, six.integer_types + (np.integer,)):
+      raise KeyError(word_id)
+    if word_id < 0:
+      word_id += len(self._vocab)
+    if not 0 <= word_id < len(self._vocab):
+      raise IndexError(word_id)
+    return self._vocab.word(word_id)
+
+  def get(self, word_id, default=None):
+    try:
+      return self[word_id]
+    except (KeyError, IndexError):
+      return default
+
+  def __contains__(self, word_id):
+    return self.get(word_id) is not None
+
+  def __iter__(self):
+    return iter(six.moves.xrange(len(self._vocab)))
+
+  def __len__(self):
+    return len(self._vocab)
+
+  def values(self):
+    chunk = 1 << 16
+    for start in six.moves.xrange(0, len(self._vocab), chunk):
+      for word in self._vocab.decode_many(np.arange(start, min(start + chunk, len(self._vocab)))):
+        yield word
@@ -2,6 +2,8 @@ import random
 import numpy as np
 import tensorflow as tf
 
+from .compact_vocabulary import CompactVocabulary, is_compact_vocab
+
 
 class Vocabulary(object):
   """Class that holds a vocabulary for the dataset."""
@@ -18,6 +20,17 @@ class Vocabulary(object):
     self._unk = -1
     self._bos = -1
     self._eos = -1
+    self._compact = None
+
+    if is_compact_vocab(filename):
+      # Memory-mapped backend, the '!!!MAXTERMID' line must be left out when writing it.
+      self._compact = CompactVocabulary(filename)
+      self._id_to_word = self._compact.id_to_token
+      self._word_to_id = self._compact.token_to_id
+      self._bos, self._eos, self._unk = [
+          int(i) for i in self._compact.encode_many(['<S>', '</S>', '<UNK>'])
+      ]
+      return
 
     with tf.gfile.Open(filename) as f:
       idx = 0
@@ -64,12 +77,24 @@ class Vocabulary(object):
 
   def decode(self, cur_ids):
     """Convert a list of ids to a sentence, with space inserted."""
-    return ' '.join([self.id_to_word(cur_id) for cur_id in cur_ids])
+    return ' '.join(self.decode_many(cur_ids))
 
   def encode(self, sentence):
     """Convert a sentence to a list of ids, with special tokens added."""
-    word_ids = [self.word_to_id(cur_word) for cur_word in sentence.split()]
-    return np.array([self.bos] + word_ids + [self.eos], dtype=np.int32)
+    word_ids = self.encode_many(sentence.split())
+    return np.concatenate([[self.bos], word_ids, [self.eos]]).astype(np.int32)
+
+  def encode_many(self, words):
+    """Convert a list of words to an array of ids, `unk` for unknown words."""
+    if self._compact is not None:
+      return self._compact.encode_many(words, default=self.unk).astype(np.int32)
+    return np.array([self.word_to_id(cur_word) for cur_word in words], dtype=np.int32)
+
+  def decode_many(self, cur_ids):
+    """Convert a list of ids to a list of words."""
+    if self._compact is not None:
+      return self._compact.decode_many(cur_ids, unknown=lambda _: 'ERROR')
+    return [self.id_to_word(cur_id) for cur_id in cur_ids]
 
 
 class CharsVocabulary(Vocabulary):
@@ -78,10 +103,12 @@ class CharsVocabulary(Vocabulary):
   def __init__(self, filename, max_word_length):
     super(CharsVocabulary, self).__init__(filename)
     self._max_word_length = max_word_length
-    chars_set = set()
-
-    for word in self._id_to_word:
-      chars_set |= set(word)
+    if self._compact is not None:
+      chars_set = self._compact.chars()
+    else:
+      chars_set = set()
+      for word in self._id_to_word:
+        chars_set |= set(word)
 
     free_ids = []
     for i in range(256):
@@ -101,18 +128,20 @@ class CharsVocabulary(Vocabulary):
     chars_set |= {self.bos_char, self.eos_char, self.bow_char, self.eow_char, self.pad_char}
 
     self._char_set = chars_set
-    num_words = len(self._id_to_word)
-
-    self._word_char_ids = np.zeros([num_words, max_word_length], dtype=np.int32)
 
     self.bos_chars = self._convert_word_to_char_ids(self.bos_char)
     self.eos_chars = self._convert_word_to_char_ids(self.eos_char)
 
-    for i, word in enumerate(self._id_to_word):
-      self._word_char_ids[i] = self._convert_word_to_char_ids(word)
+    # With the compact backend char ids are computed on demand, a word's char ids only depend on
+    # its characters.
+    self._word_char_ids = None
+    if self._compact is None:
+      self._word_char_ids = self._convert_words_to_char_ids(self._id_to_word)
 
   @property
   def word_char_ids(self):
+    if self._word_char_ids is None:
+      self._word_char_ids = self._convert_words_to_char_ids(list(self._id_to_word.values()))
     return self._word_char_ids
 
   @property
@@ -130,14 +159,35 @@ class CharsVocabulary(Vocabulary):
       code[j] = ord(cur_word[j])
     return code
 
+  def _convert_words_to_char_ids(self, words):
+    """Vectorized `_convert_word_to_char_ids` for a list of words."""
+    code = np.full([len(words), self.max_word_length], ord(self.pad_char), dtype=np.int32)
+    if not len(words):
+      return code
+    words = np.array(words, dtype='U%d' % max(self.max_word_length - 2, 1))
+    if self.max_word_length <= 2:
+      words[:] = ''
+    lengths = np.char.str_len(words)
+    chars = words.view(np.uint32).reshape(len(words), -1).astype(np.int32)
+    cols = np.arange(chars.shape[1])
+    rows = np.arange(len(words))
+    code[:, 0] = ord(self.bow_char)
+    code[:, 1:1 + chars.shape[1]] = np.where(cols < lengths[:, None], chars,
+                                             code[:, 1:1 + chars.shape[1]])
+    code[rows, lengths + 1] = ord(self.eow_char)
+    return code
+
   def word_to_char_ids(self, word):
-    if word in self._word_to_id:
+    if self._word_char_ids is not None and word in self._word_to_id:
       return self._word_char_ids[self._word_to_id[word]]
     else:
       return self._convert_word_to_char_ids(word)
 
   def encode_chars(self, sentence):
-    chars_ids = [self.word_to_char_ids(cur_word) for cur_word in sentence.split()]
+    if self._word_char_ids is None:
+      chars_ids = [self._convert_words_to_char_ids(sentence.split())]
+    else:
+      chars_ids = [self.word_to_char_ids(cur_word) for cur_word in sentence.split()]
     return np.vstack([self.bos_chars] + chars_ids + [self.eos_chars])
 
 
@@ -23,8 +23,10 @@ import re
 
 import six
 import abc
+import numpy as np
 from six.moves import xrange
 from .tokenizer import InvertibleTokenizer
+from .compact_vocabulary import CompactVocabulary, is_compact_vocab
 
 import tensorflow as tf
 
@@ -192,7 +194,10 @@ class TokenTextEncoder(BaseTextEncoder):
     super(TokenTextEncoder, self).__init__(num_reserved_ids=num_reserved_ids)
     self._reverse = reverse
     self._replace_oov = replace_oov
-    if vocab_filename:
+    self._compact = None
+    if vocab_filename and is_compact_vocab(vocab_filename):
+      self._init_vocab_from_compact(vocab_filename)
+    elif vocab_filename:
       self._init_vocab_from_file(vocab_filename)
     else:
       assert vocab_list is not None
@@ -201,15 +206,43 @@ class TokenTextEncoder(BaseTextEncoder):
   def encode(self, sentence):
     """Converts a space-separated string of tokens to a list of ids."""
     tokens = sentence.strip().split()
+    if self._compact is not None:
+      return self.encode_many(tokens).tolist()
     if self._replace_oov is not None:
       tokens = [t if t in self._token_to_id else self._replace_oov for t in tokens]
     ret = [self._token_to_id[tok] for tok in tokens]
     return ret[::-1] if self._reverse else ret
 
   def decode(self, ids):
+    if self._compact is not None:
+      return " ".join(self.decode_many(ids))
     seq = reversed(ids) if self._reverse else ids
     return " ".join([self._safe_id_to_token(i) for i in seq])
 
+  def encode_many(self, tokens):
+    """Converts a list of tokens to an int64 array of ids, in a single lookup.
+
+    Raises:
+      KeyError: for out-of-vocabulary tokens if `replace_oov` is None.
+    """
+    if self._compact is not None:
+      default = None
+      if self._replace_oov is not None:
+        default = self._compact.encode_many([self._replace_oov], default=None)[0]
+      ret = self._compact.encode_many(tokens, default=default)
+    else:
+      if self._replace_oov is not None:
+        tokens = [t if t in self._token_to_id else self._replace_oov for t in tokens]
+      ret = np.array([self._token_to_id[tok] for tok in tokens], dtype=np.int64)
+    return ret[::-1] if self._reverse else ret
+
+  def decode_many(self, ids):
+    """Converts a sequence of ids to a list of tokens."""
+    ids = list(ids)[::-1] if self._reverse else ids
+    if self._compact is not None:
+      return self._compact.decode_many(ids, unknown=lambda i: "ID_%d" % i)
+    return [self._safe_id_to_token(i) for i in ids]
+
   @property
   def vocab_size(self):
     return len(self._id_to_token)
@@ -232,6 +265,16 @@ class TokenTextEncoder(BaseTextEncoder):
 
     self._init_vocab(token_gen(), add_reserved_tokens=False)
 
+  def _init_vocab_from_compact(self, filename):
+    """Memory-maps a vocab written by `compact_vocabulary.write_compact_vocab`.
+
+    Args:
+      filename: The compact vocabulary file.
+    """
+    self._compact = CompactVocabulary(filename)
+    self._id_to_token = self._compact.id_to_token
+    self._token_to_id = self._compact.token_to_id
+
   def _init_vocab_from_list(self, vocab_list):
     """Initialize tokens from a list of tokens.
 
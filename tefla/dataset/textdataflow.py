@@ -2,10 +2,23 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import os
+import struct
+import time
+
 import numpy as np
 import tensorflow as tf
 from six.moves import xrange
 
+LENGTH_INDEX_SUFFIX = ".lenidx.npz"
+
+
+def length_index_path(data_file):
+  """Path of the length index of a shard, a hidden file next to it so that
+  shard file patterns never match it."""
+  dirname, basename = os.path.split(data_file)
+  return os.path.join(dirname, "." + basename + LENGTH_INDEX_SUFFIX)
+
 
 class TextDataflow(object):
   """Dataflow handling class.
@@ -35,6 +48,7 @@ class TextDataflow(object):
     self.decoder = decoder
     self.shuffle = shuffle
     self.capacity = capacity
+    self.num_epochs = num_epochs
     self.num_threads = num_threads
     self.max_length = max_length
     self.min_bucket_length = min_bucket_length
@@ -87,6 +101,121 @@ class TextDataflow(object):
       batched_examples = dataset_r.make_one_shot_iterator().get_next()
       return batched_examples
 
+  def get_token_batch(self,
+                      max_tokens,
+                      preprocessing_fn=None,
+                      mode='training',
+                      drop_long_sequences=False,
+                      seed=None):
+    """Input pipeline with offline length index and token-budget batching.
+
+    Unlike `get_batch`, example lengths are never computed in the graph. A
+    per-record length index is built once per shard (see `load_length_index`),
+    batches are planned in numpy so that `batch_size * longest_example` stays
+    under `max_tokens` without crossing length buckets, and shuffling is done
+    at the batch level. Running statistics are kept in `self.batching_stats`.
+
+    The data is read `num_epochs` times; if `num_epochs` is None, forever in
+    training mode and once otherwise.
+
+    Args:
+      max_tokens: int, maximum number of padded tokens in a batch.
+      preprocessing_fn: must be None, the batches are planned from the lengths
+        of the raw records, which a preprocessing could change; use
+        `get_batch` to preprocess the examples.
+      mode: 'training', 'eval' or 'both'.
+      drop_long_sequences: bool, if True, examples longer than `max_length`
+        (`max_tokens` if `max_length` is None) are dropped.
+      seed: optional int, seed used for the batch level shuffling.
+
+    Returns:
+      dict <feature name, batched and padded Tensor>
+
+    Raises:
+      ValueError: if `preprocessing_fn` is given.
+    """
+    if preprocessing_fn is not None:
+      raise ValueError('preprocessing_fn is not supported with token-budget batching, the '
+                       'batches are planned from the lengths of the raw records')
+    training = mode == 'training'
+    num_epochs = self.num_epochs
+    if num_epochs is None and not training:
+      num_epochs = 1
+    shuffle = self.shuffle and training
+    data_files = self.dataset.get_data_files(self.dataset.get_data_filepatterns(mode=mode))
+    indices = [load_length_index(data_file, self.decoder.feature_names) for data_file in data_files]
+    max_length = (self.max_length or max_tokens) * self.length_multiplier
+    boundaries = self._bucket_boundaries(max_length, self.min_bucket_length,
+                                         self.length_bucket_step)
+    boundaries = [boundary * self.length_multiplier for boundary in boundaries]
+    self.batching_stats = BatchingStats()
+    rng = np.random.RandomState(seed)
+
+    def batch_generator():
+      files = [tf.gfile.GFile(data_file, 'rb') for data_file in data_files]
+      try:
+        epoch = 0
+        while num_epochs is None or epoch < num_epochs:
+          epoch += 1
+          plan = []
+          for shard_id, index in enumerate(indices):
+            batches = plan_token_batches(
+                index['lengths'],
+                max_tokens,
+                boundaries=boundaries,
+                max_length=max_length if drop_long_sequences else None,
+                shard_multiplier=self.shard_multiplier,
+                rng=rng if shuffle else None)
+            plan.extend((shard_id, batch) for batch in batches)
+          if shuffle:
+            rng.shuffle(plan)
+          for shard_id, batch in plan:
+            index = indices[shard_id]
+            self.batching_stats.update(index['lengths'][batch])
+            yield np.array(
+                read_records(files[shard_id], index['offsets'][batch], index['sizes'][batch]),
+                dtype=object)
+      finally:
+        for f in files:
+          f.close()
+
+    with tf.name_scope("input_pipeline"):
+      dataset_r = tf.data.Dataset.from_generator(batch_generator, tf.string,
+                                                 tf.TensorShape([None]))
+      dataset_r = dataset_r.map(self.decoder.decode_batch, num_parallel_calls=self.num_threads)
+      dataset_r = dataset_r.prefetch(2)
+      return dataset_r.make_one_shot_iterator().get_next()
+
+  def token_batching_report(self, max_tokens, mode='training', boundaries=None):
+    """Plans token-budget batches offline and reports their padding.
+
+    Useful to tune `min_bucket_length`/`length_bucket_step` (or explicit
+    `boundaries`) without building a graph.
+
+    Args:
+      max_tokens: int, maximum number of padded tokens in a batch.
+      mode: 'training', 'eval' or 'both'.
+      boundaries: optional list of bucket boundaries, defaults to the ones
+        derived from the dataflow settings.
+
+    Returns:
+      a dict, see `batch_padding_stats`.
+    """
+    data_files = self.dataset.get_data_files(self.dataset.get_data_filepatterns(mode=mode))
+    lengths, batches, offset = [], [], 0
+    max_length = (self.max_length or max_tokens) * self.length_multiplier
+    if boundaries is None:
+      boundaries = self._bucket_boundaries(max_length, self.min_bucket_length,
+                                           self.length_bucket_step)
+      boundaries = [boundary * self.length_multiplier for boundary in boundaries]
+    for data_file in data_files:
+      index = load_length_index(data_file, self.decoder.feature_names)
+      batches.extend(batch + offset for batch in plan_token_batches(
+          index['lengths'], max_tokens, boundaries, shard_multiplier=self.shard_multiplier))
+      lengths.append(index['lengths'])
+      offset += len(index['lengths'])
+    return batch_padding_stats(np.concatenate(lengths), batches, boundaries)
+
   def _example_length(self, example):
     length = 0
     # Length of the example is the maximum length of the feature lengths
@@ -238,3 +367,250 @@ class TextDataflow(object):
         "shuffle_queue_size": None,
         "window_size": constant_batch_size_in_sequences,
     }
+
+
+def example_length(serialized_example, feature_keys=None):
+  """Length of a serialized tf.Example, the max number of values of its features.
+
+  Args:
+    serialized_example: a serialized tf.Example string.
+    feature_keys: optional iterable of feature names to consider, all
+      features are used if None.
+
+  Returns:
+    an int, the example length.
+  """
+  example = tf.train.Example.FromString(serialized_example)
+  length = 0
+  for name, feature in example.features.feature.items():
+    if feature_keys is not None and name not in feature_keys:
+      continue
+    kind = feature.WhichOneof('kind')
+    if kind is not None:
+      length = max(length, len(getattr(feature, kind).value))
+  return length
+
+
+def build_length_index(data_file, feature_keys=None):
+  """Scans a TFRecord shard and indexes record offsets, sizes and lengths.
+
+  Args:
+    data_file: path of an uncompressed TFRecord file.
+    feature_keys: optional iterable of feature names used to compute the
+      example lengths.
+
+  Returns:
+    a dict of int64 `offsets`, int64 `sizes` and int32 `lengths` arrays, one
+      entry per record.
+
+  Raises:
+    ValueError: if the file is truncated.
+  """
+  offsets, sizes, lengths = [], [], []
+  offset = 0
+  with tf.gfile.GFile(data_file, 'rb') as f:
+    while True:
+      header = f.read(12)
+      if not header:
+        break
+      size = struct.unpack('<Q', header[:8])[0] if len(header) == 12 else -1
+      record = f.read(size) if size >= 0 else b''
+      if size < 0 or len(record) != size or len(f.read(4)) != 4:
+        raise ValueError('Truncated record at offset %d in %s' % (offset, data_file))
+      offsets.append(offset + 12)
+      sizes.append(size)
+      lengths.append(example_length(record, feature_keys))
+      offset += size + 16
+  return {
+      'offsets': np.asarray(offsets, dtype=np.int64),
+      'sizes': np.asarray(sizes, dtype=np.int64),
+      'lengths': np.asarray(lengths, dtype=np.int32),
+  }
+
+
+def load_length_index(data_file, feature_keys=None, rebuild=False):
+  """Loads the length index of a shard, building and saving it if needed.
+
+  The index is stored next to the shard (see `length_index_path`) with the
+  size and modification time of the shard and the feature keys it was built
+  for, it is rebuilt when any of them changed.
+
+  Args:
+    data_file: path of an uncompressed TFRecord file.
+    feature_keys: optional iterable of feature names used to compute the
+      example lengths.
+    rebuild: bool, force rebuilding the index.
+
+  Returns:
+    a dict, see `build_length_index`.
+  """
+  index_file = length_index_path(data_file)
+  stat = tf.gfile.Stat(data_file)
+  key = np.array([stat.length, stat.mtime_nsec], dtype=np.int64)
+  keys = np.array(sorted(feature_keys) if feature_keys is not None else [], dtype=np.str_)
+  if not rebuild and tf.gfile.Exists(index_file):
+    with tf.gfile.GFile(index_file, 'rb') as f:
+      index = np.load(f)
+      if ('key' in index and np.array_equal(index['key'], key) and
+          np.array_equal(index['feature_keys'], keys)):
+        return {name: index[name] for name in ('offsets', 'sizes', 'lengths')}
+  tf.logging.info('Building length index for %s', data_file)
+  index = build_length_index(data_file, feature_keys)
+  with tf.gfile.GFile(index_file, 'wb') as f:
+    np.savez(f, key=key, feature_keys=keys, **index)
+  return index
+
+
+def read_records(f, offsets, sizes):
+  """Reads records at the given offsets from an open TFRecord file.
+
+  Records are read in file order to keep seeks sequential; the returned list
+  follows the order of `offsets`.
+  """
+  records = [None] * len(offsets)
+  for i in np.argsort(offsets, kind='mergesort'):
+    f.seek(offsets[i])
+    records[i] = f.read(sizes[i])
+  return records
+
+
+def plan_token_batches(lengths,
+                       max_tokens,
+                       boundaries=None,
+                       max_length=None,
+                       shard_multiplier=1,
+                       rng=None):
+  """Packs examples into batches under a padded token budget.
+
+  Examples are sorted by length (ties in random order if `rng` is given) and
+  greedily packed so that `len(batch) * max(lengths[batch]) <= max_tokens`.
+  Batches never span two length buckets. An example longer than `max_tokens`
+  gets a batch of its own.
+
+  Args:
+    lengths: 1-D int array, length of every example.
+    max_tokens: int, maximum number of padded tokens in a batch.
+    boundaries: optional list<int>, length bucket boundaries.
+    max_length: optional int, examples longer than this are dropped.
+    shard_multiplier: int, batch sizes are rounded down to a multiple of this
+      whenever the batch holds at least `shard_multiplier` examples.
+    rng: optional `np.random.RandomState` used to shuffle equal lengths.
+
+  Returns:
+    a list of int64 arrays of example indices, one per batch.
+  """
+  lengths = np.asarray(lengths)
+  idx = np.arange(len(lengths), dtype=np.int64)
+  if max_length is not None:
+    idx = idx[lengths <= max_length]
+  if rng is not None:
+    idx = rng.permutation(idx)
+  idx = idx[np.argsort(lengths[idx], kind='mergesort')]
+  sorted_lengths = np.maximum(lengths[idx], 1)
+  if boundaries:
+    bucket_ids = np.searchsorted(boundaries, sorted_lengths, side='right')
+    splits = np.flatnonzero(np.diff(bucket_ids)) + 1
+  else:
+    splits = np.array([], dtype=np.int64)
+  starts = np.concatenate([[0], splits])
+  ends = np.concatenate([splits, [len(idx)]])
+  batches = []
+  for start, end in zip(starts, ends):
+    i = start
+    while i < end:
+      # (j - i) * sorted_lengths[j - 1] is increasing in j, binary search the largest j.
+      lo, hi = i + 1, end
+      while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if (mid - i) * sorted_lengths[mid - 1] <= max_tokens:
+          lo = mid
+        else:
+          hi = mid - 1
+      size = lo - i
+      if size >= shard_multiplier:
+        size -= size % shard_multiplier
+      batches.append(idx[i:i + size])
+      i += size
+  return batches
+
+
+def batch_padding_stats(lengths, batches, boundaries=None):
+  """Padding statistics of a batch plan.
+
+  Args:
+    lengths: 1-D int array, length of every example.
+    batches: list of index arrays, as returned by `plan_token_batches`.
+    boundaries: optional list<int>, if given a per-bucket padding ratio is
+      reported too.
+
+  Returns:
+    a dict with `num_batches`, `num_examples`, `tokens`, `padded_tokens`,
+      `padding_ratio` (fraction of padded tokens that are padding) and, if
+      `boundaries` is given, `bucket_padding_ratio`.
+  """
+  lengths = np.asarray(lengths, dtype=np.int64)
+  sizes = np.array([len(batch) for batch in batches], dtype=np.int64)
+  if batches:
+    flat = np.concatenate(batches)
+    batch_ids = np.repeat(np.arange(len(batches)), sizes)
+    tokens = np.bincount(batch_ids, weights=lengths[flat], minlength=len(batches))
+    longest = np.zeros(len(batches), dtype=np.int64)
+    np.maximum.at(longest, batch_ids, lengths[flat])
+  else:
+    tokens = longest = np.zeros(0)
+  padded = sizes * longest
+  stats = {
+      'num_batches': len(batches),
+      'num_examples': int(sizes.sum()),
+      'tokens': int(tokens.sum()),
+      'padded_tokens': int(padded.sum()),
+      'padding_ratio': _padding_ratio(tokens.sum(), padded.sum()),
+  }
+  if boundaries is not None:
+    bucket_ids = np.searchsorted(boundaries, longest, side='right')
+    num_buckets = len(boundaries) + 1
+    bucket_tokens = np.bincount(bucket_ids, weights=tokens, minlength=num_buckets)
+    bucket_padded = np.bincount(bucket_ids, weights=padded, minlength=num_buckets)
+    stats['bucket_padding_ratio'] = [
+        _padding_ratio(t, p) for t, p in zip(bucket_tokens, bucket_padded)
+    ]
+  return stats
+
+
+def _padding_ratio(tokens, padded_tokens):
+  return float(1.0 - tokens / padded_tokens) if padded_tokens else 0.0
+
+
+class BatchingStats(object):
+  """Running effective throughput and padding statistics of a batch stream.
+
+  Args:
+      log_every: log a summary every `log_every` batches, 0 to disable.
+  """
+
+  def __init__(self, log_every=1000):
+    self.log_every = log_every
+    self.num_batches = 0
+    self.tokens = 0
+    self.padded_tokens = 0
+    self._start_time = None
+
+  def update(self, batch_lengths):
+    if self._start_time is None:
+      self._start_time = time.time()
+    self.num_batches += 1
+    self.tokens += int(np.sum(batch_lengths))
+    self.padded_tokens += len(batch_lengths) * int(np.max(batch_lengths))
+    if self.log_every and self.num_batches % self.log_every == 0:
+      tf.logging.info('Batching: %(tokens_per_sec).1f tokens/sec, padding ratio %(padding_ratio).3f',
+                      self.summary())
+
+  def summary(self):
+    elapsed = time.time() - self._start_time if self._start_time is not None else 0.0
+    return {
+        'num_batches': self.num_batches,
+        'tokens': self.tokens,
+        'padded_tokens': self.padded_tokens,
+        'padding_ratio': _padding_ratio(self.tokens, self.padded_tokens),
+        'tokens_per_sec': self.tokens / elapsed if elapsed > 0 else 0.0,
+    }
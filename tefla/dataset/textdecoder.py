@@ -124,6 +124,24 @@ class TextDecoder(object):
       outputs.append(handler.tensors_to_item(keys_to_tensors))
     return outputs
 
+  def decode_batch(self, serialized_examples):
+    """Decodes a batch of serialized TF-examples into padded tensors.
+
+    Variable length features are densified, padding with zeros up to the
+    longest example of the batch.
+
+    Args:
+      serialized_examples: a 1-D string tensor of serialized TF-examples.
+
+    Returns:
+      dict <feature name, batched Tensor>
+    """
+    examples = tf.parse_example(serialized_examples, self._feature_keys)
+    for k, v in examples.items():
+      if isinstance(v, tf.SparseTensor):
+        examples[k] = tf.sparse_tensor_to_dense(v)
+    return examples
+
 
 @six.add_metaclass(abc.ABCMeta)
 class ItemHandler():
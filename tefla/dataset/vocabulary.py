@@ -3,9 +3,11 @@ from __future__ import division
 from __future__ import print_function
 
 import collections
+import numpy as np
 import tensorflow as tf
 from tensorflow import gfile
 from ..core import logger
+from .compact_vocabulary import CompactVocabulary, is_compact_vocab
 
 SpecialVocab = collections.namedtuple("SpecialVocab", ["UNK", "SEQUENCE_START", "SEQUENCE_END"])
 
@@ -28,14 +30,26 @@ class Vocabulary(object):
       logger.fatal("Vocab file %s not found." % vocab_file)
     logger.info("Initializing vocabulary from file: %s" % vocab_file)
 
-    with tf.gfile.GFile(vocab_file, mode="r") as f:
-      reverse_vocab = list(f.readlines())
-    reverse_vocab = [line.split()[0] for line in reverse_vocab]
-    assert start_word in reverse_vocab
-    assert end_word in reverse_vocab
-    if unk_word not in reverse_vocab:
-      reverse_vocab.append(unk_word)
-    vocab = dict([(x, y) for (y, x) in enumerate(reverse_vocab)])
+    self.unk_word = unk_word
+    if is_compact_vocab(vocab_file):
+      # Memory-mapped backend, see `compact_vocabulary.write_compact_vocab`.
+      self.compact_vocab = CompactVocabulary(vocab_file)
+      vocab = self.compact_vocab.token_to_id
+      reverse_vocab = self.compact_vocab.id_to_token
+      assert start_word in vocab
+      assert end_word in vocab
+      unk_id = vocab[unk_word] if unk_word in vocab else len(vocab)
+    else:
+      self.compact_vocab = None
+      with tf.gfile.GFile(vocab_file, mode="r") as f:
+        reverse_vocab = list(f.readlines())
+      reverse_vocab = [line.split()[0] for line in reverse_vocab]
+      assert start_word in reverse_vocab
+      assert end_word in reverse_vocab
+      if unk_word not in reverse_vocab:
+        reverse_vocab.append(unk_word)
+      vocab = dict([(x, y) for (y, x) in enumerate(reverse_vocab)])
+      unk_id = vocab[unk_word]
 
     logger.info("Created vocabulary with %d words" % len(vocab))
 
@@ -45,7 +59,7 @@ class Vocabulary(object):
     # Save special word ids.
     self.start_id = vocab[start_word]
     self.end_id = vocab[end_word]
-    self.unk_id = vocab[unk_word]
+    self.unk_id = unk_id
 
   def word_to_id(self, word):
     """Returns the integer word id of a word string.
@@ -71,10 +85,29 @@ class Vocabulary(object):
         a `str`; word string of the word id with respect to the vocabulary
     """
     if word_id >= len(self.reverse_vocab):
-      return self.reverse_vocab[self.unk_id]
+      return self.unk_word
     else:
       return self.reverse_vocab[word_id]
 
+  def encode_many(self, words):
+    """Returns the integer ids of a list of words.
+
+    Args:
+        words: list of `str`, input words
+
+    Returns:
+        a `np.ndarray` of int64 word ids, `unk_id` for unknown words
+    """
+    if self.compact_vocab is not None:
+      return self.compact_vocab.encode_many(words, default=self.unk_id)
+    return np.array([self.word_to_id(word) for word in words], dtype=np.int64)
+
+  def decode_many(self, word_ids):
+    """Returns the list of word strings of a sequence of integer ids."""
+    if self.compact_vocab is not None:
+      return self.compact_vocab.decode_many(word_ids, unknown=lambda _: self.unk_word)
+    return [self.id_to_word(word_id) for word_id in word_ids]
+
 
 class VocabInfo(collections.namedtuple("VocbabInfo", ["path", "vocab_size", "special_vocab"])):
   """Convenience structure for vocabulary information."""
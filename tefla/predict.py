@@ -25,10 +25,14 @@ from tefla.utils import util
 @click.option('--dataset_name', default='dataset', help='Name of the dataset')
 @click.option('--convert', is_flag=True, help='Convert/preprocess files before prediction.')
 @click.option('--image_size', default=256, show_default=True, help='Image size for conversion.')
+@click.option(
+    '--cache_dir', default=None, show_default=True, help='Directory to cache converted images.')
+@click.option(
+    '--fast_decode', is_flag=True, help='Decode JPEGs at reduced resolution for conversion.')
 @click.option('--sync', is_flag=True, help='Do all processing on the calling thread.')
 @click.option('--test_type', default='quasi', help='Specify test type, crop_10 or quasi')
-def predict(model, training_cnf, predict_dir, weights_from, dataset_name, convert, image_size, sync,
-            test_type):
+def predict(model, training_cnf, predict_dir, weights_from, dataset_name, convert, image_size,
+            cache_dir, fast_decode, sync, test_type):
   model_def = util.load_module(model)
   model = model_def.model
   cnf = util.load_module(training_cnf).cnf
@@ -37,7 +41,8 @@ def predict(model, training_cnf, predict_dir, weights_from, dataset_name, conver
 
   standardizer = cnf.get('standardizer', None)
 
-  preprocessor = convert_preprocessor(image_size) if convert else None
+  preprocessor = convert_preprocessor(
+      image_size, fast_decode=fast_decode, cache_dir=cache_dir) if convert else None
   prediction_iterator = create_prediction_iter(cnf, standardizer, model_def.crop_size, preprocessor,
                                                sync)
 
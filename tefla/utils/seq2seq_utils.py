@@ -4,8 +4,14 @@ from __future__ import division
 from __future__ import print_function
 
 import abc
+import collections
+import io
+import os
 import re
+from multiprocessing import cpu_count
+from multiprocessing.pool import Pool
 
+import numpy as np
 import six
 import tensorflow as tf
 from tensorflow.python.layers import base as layers_base
@@ -25,6 +31,9 @@ GO_ID = 1
 EOS_ID = 2
 UNK_ID = 3
 
+# Size in bytes of the corpus chunks processed by the workers.
+_CHUNK_SIZE = 1 << 24
+
 # Regular expressions used to tokenize.
 _WORD_SPLIT = re.compile(b"([.,!?\"':;)(])")
 _DIGIT_RE = re.compile(br"\d")
@@ -488,16 +497,161 @@ def basic_tokenizer(sentence):
   return [w for w in words if w]
 
 
+def _line_chunks(data_path, chunk_size=_CHUNK_SIZE):
+  """Splits a file in byte ranges of about `chunk_size` bytes ending at line
+  boundaries.
+
+  Args:
+    data_path: path to the data file in one-sentence-per-line format.
+    chunk_size: approximate size in bytes of the chunks.
+
+  Returns:
+    a list of (start, end) byte offsets.
+  """
+  file_size = tf.gfile.Stat(data_path).length
+  chunks = []
+  start = 0
+  with tf.gfile.GFile(data_path, mode="rb") as f:
+    while start < file_size:
+      end = start + chunk_size
+      if end < file_size:
+        f.seek(end - 1)
+        # ends the chunk after the next newline, at or after end - 1
+        end = min(end - 1 + len(f.readline()), file_size)
+      else:
+        end = file_size
+      chunks.append((start, end))
+      start = end
+  return chunks
+
+
+def _read_lines(data_path, chunk):
+  start, end = chunk
+  with tf.gfile.GFile(data_path, mode="rb") as f:
+    f.seek(start)
+    data = f.read(end - start)
+  return io.BytesIO(tf.compat.as_bytes(data))
+
+
+def _normalized_tokens(line, tokenizer, normalize_digits):
+  tokens = tokenizer(line) if tokenizer else basic_tokenizer(line)
+  if normalize_digits:
+    return [_DIGIT_RE.sub(b"0", w) for w in tokens]
+  return tokens
+
+
+# Arguments of the chunk functions, set in each worker by _init_worker.
+_worker_args = {}
+
+
+def _init_worker(kwargs):
+  _worker_args.clear()
+  _worker_args.update(kwargs)
+
+
+def _count_chunk(chunk):
+  """Counts the tokens of a chunk of the data file."""
+  args = _worker_args
+  counts = collections.Counter()
+  for line in _read_lines(args["data_path"], chunk):
+    counts.update(_normalized_tokens(line, args["tokenizer"], args["normalize_digits"]))
+  return counts
+
+
+def _token_ids_chunk(chunk):
+  """Converts a chunk of the data file to token-ids.
+
+  Returns:
+    a pair: the token-ids of all the lines of the chunk and the number of
+    token-ids of each line.
+  """
+  args = _worker_args
+  vocab = args["vocab"]
+  ids = []
+  lengths = []
+  for line in _read_lines(args["data_path"], chunk):
+    tokens = _normalized_tokens(line, args["tokenizer"], args["normalize_digits"])
+    ids.extend([vocab.get(w, UNK_ID) for w in tokens])
+    lengths.append(len(tokens))
+  return np.array(ids, dtype=args["dtype"]), np.array(lengths, dtype=np.int64)
+
+
+def _map_chunks(fn, chunks, num_workers, **kwargs):
+  """Maps `fn` over the chunks, in order, with `num_workers` processes.
+
+  The arguments in kwargs are available to `fn` in `_worker_args`. With one
+  worker the chunks are processed in the calling process. At most
+  `2 * num_workers` chunks are read ahead or held as results, so that a slow
+  consumer does not make the pending chunks and results pile up in memory.
+  """
+  num_workers = num_workers or cpu_count()
+  if num_workers == 1:
+    _init_worker(kwargs)
+    for chunk in chunks:
+      yield fn(chunk)
+    return
+  pool = Pool(num_workers, _init_worker, (kwargs,))
+  try:
+    pending = collections.deque()
+    for chunk in chunks:
+      if len(pending) >= 2 * num_workers:
+        yield pending.popleft().get()
+      pending.append(pool.apply_async(fn, (chunk,)))
+    while pending:
+      yield pending.popleft().get()
+  finally:
+    pool.terminate()
+
+
+def count_tokens(data_path,
+                 tokenizer=None,
+                 normalize_digits=True,
+                 num_workers=1,
+                 chunk_size=_CHUNK_SIZE):
+  """Counts the tokens of a data file with several processes.
+
+  The file is read in chunks of about `chunk_size` bytes, so that the memory
+  used does not depend on the size of the corpus, and the counts of the chunks
+  are merged.
+
+  Args:
+    data_path: data file in one-sentence-per-line format.
+    tokenizer: a function to use to tokenize each data sentence;
+      if None, basic_tokenizer will be used. It must be picklable if
+      num_workers is not 1.
+    normalize_digits: Boolean; if true, all digits are replaced by 0s.
+    num_workers: number of processes, all the cpus if None.
+    chunk_size: approximate size in bytes of the chunks.
+
+  Returns:
+    a collections.Counter of the tokens.
+  """
+  counts = collections.Counter()
+  chunks = _line_chunks(data_path, chunk_size)
+  for chunk_counts in _map_chunks(
+      _count_chunk,
+      chunks,
+      num_workers,
+      data_path=data_path,
+      tokenizer=tokenizer,
+      normalize_digits=normalize_digits):
+    counts.update(chunk_counts)
+  return counts
+
+
 def create_vocabulary(vocabulary_path,
                       data_path,
                       max_vocabulary_size,
                       tokenizer=None,
-                      normalize_digits=True):
+                      normalize_digits=True,
+                      num_workers=1):
   """Create vocabulary file (if it does not exist yet) from data file.
 
   Data file is assumed to contain one sentence per line. Each sentence is
   tokenized and digits are normalized (if normalize_digits is set).
-  Vocabulary contains the most-frequent tokens up to max_vocabulary_size.
+  Vocabulary contains the most-frequent tokens up to max_vocabulary_size,
+  tokens of equal frequency are sorted in byte order so that the vocabulary
+  does not depend on the number of workers.
   We write it to vocabulary_path in a one-token-per-line format, so that later
   token in the first line gets id=0, second line gets id=1, and so on.
 
@@ -508,31 +662,19 @@ def create_vocabulary(vocabulary_path,
     tokenizer: a function to use to tokenize each data sentence;
       if None, basic_tokenizer will be used.
     normalize_digits: Boolean; if true, all digits are replaced by 0s.
+    num_workers: number of processes counting the tokens, all the cpus if
+      None.
   """
   if not tf.gfile.Exists(vocabulary_path):
     print("Creating vocabulary %s from data %s" % (vocabulary_path, data_path))
-    vocab = {}
-    with tf.gfile.GFile(data_path, mode="rb") as f:
-      counter = 0
-      for line in f:
-        counter += 1
-        if counter % 100000 == 0:
-          print("  processing line %d" % counter)
-        line = tf.compat.as_bytes(line)
-        tokens = tokenizer(line) if tokenizer else basic_tokenizer(line)
-        for w in tokens:
-          word = _DIGIT_RE.sub(b"0", w) if normalize_digits else w
-          if word in vocab:
-            vocab[word] += 1
-          else:
-            vocab[word] = 1
-      vocab_list = _START_VOCAB + \
-          sorted(vocab, key=vocab.get, reverse=True)
-      if len(vocab_list) > max_vocabulary_size:
-        vocab_list = vocab_list[:max_vocabulary_size]
-      with tf.gfile.GFile(vocabulary_path, mode="wb") as vocab_file:
-        for w in vocab_list:
-          vocab_file.write(w + b"\n")
+    vocab = count_tokens(data_path, tokenizer, normalize_digits, num_workers)
+    vocab_list = _START_VOCAB + \
+        sorted(vocab, key=lambda w: (-vocab[w], w))
+    if len(vocab_list) > max_vocabulary_size:
+      vocab_list = vocab_list[:max_vocabulary_size]
+    with tf.gfile.GFile(vocabulary_path, mode="wb") as vocab_file:
+      for w in vocab_list:
+        vocab_file.write(w + b"\n")
 
 
 def initialize_vocabulary(vocabulary_path):
@@ -624,6 +766,104 @@ def data_to_token_ids(data_path, target_path, vocabulary_path, tokenizer=None,
           tokens_file.write(" ".join([str(tok) for tok in token_ids]) + "\n")
 
 
+def token_ids_dtype(vocabulary_size):
+  """Returns the dtype of the binary token-ids of a vocabulary."""
+  return np.dtype("<u2") if vocabulary_size <= 1 << 16 else np.dtype("<i4")
+
+
+def data_to_token_ids_binary(data_path,
+                             target_path,
+                             vocabulary_path,
+                             tokenizer=None,
+                             normalize_digits=True,
+                             num_workers=1,
+                             chunk_size=_CHUNK_SIZE):
+  """Tokenize data file and turn into binary token-ids with several processes.
+
+  The data file is processed in chunks of about `chunk_size` bytes by the
+  workers, and the token-ids of the chunks are appended in order to
+  target_path, so that the output does not depend on the number of workers
+  and the memory used does not depend on the size of the corpus.
+
+  target_path holds the token-ids of all the sentences, little-endian uint16
+  if the vocabulary has at most 2**16 tokens and int32 otherwise.
+  target_path + ".index" holds little-endian int64: the item size of the
+  token-ids, followed by the offsets of the sentences in the token-ids, the
+  first one 0 and the last one the total number of token-ids. Use
+  `BinaryTokenIds` to read them.
+
+  Args:
+    data_path: path to the data file in one-sentence-per-line format.
+    target_path: path where the file with token-ids will be created.
+    vocabulary_path: path to the vocabulary file.
+    tokenizer: a function to use to tokenize each sentence;
+      if None, basic_tokenizer will be used. It must be picklable if
+      num_workers is not 1.
+    normalize_digits: Boolean; if true, all digits are replaced by 0s.
+    num_workers: number of processes, all the cpus if None.
+    chunk_size: approximate size in bytes of the chunks.
+  """
+  if not tf.gfile.Exists(target_path):
+    print("Tokenizing data in %s" % data_path)
+    vocab, _ = initialize_vocabulary(vocabulary_path)
+    dtype = token_ids_dtype(len(vocab))
+    chunks = _line_chunks(data_path, chunk_size)
+    with tf.gfile.GFile(target_path, mode="wb") as tokens_file:
+      with tf.gfile.GFile(target_path + ".index", mode="wb") as index_file:
+        index_file.write(np.array([dtype.itemsize, 0], dtype="<i8").tobytes())
+        num_tokens = 0
+        for counter, (ids, lengths) in enumerate(
+            _map_chunks(
+                _token_ids_chunk,
+                chunks,
+                num_workers,
+                data_path=data_path,
+                vocab=vocab,
+                dtype=dtype,
+                tokenizer=tokenizer,
+                normalize_digits=normalize_digits)):
+          if (counter + 1) % 10 == 0:
+            print("  tokenizing chunk %d of %d" % (counter + 1, len(chunks)))
+          tokens_file.write(ids.tobytes())
+          index_file.write((num_tokens + np.cumsum(lengths)).astype("<i8").tobytes())
+          num_tokens += len(ids)
+
+
+class BinaryTokenIds(object):
+  """Sentences of the binary token-ids written by `data_to_token_ids_binary`.
+
+  The token-ids and the offsets are memory mapped, so that sentences are read
+  without parsing text or loading the corpus in memory.
+
+  Args:
+    path: path of the token-ids file.
+  """
+
+  def __init__(self, path):
+    index = np.memmap(path + ".index", dtype="<i8", mode="r")
+    self.offsets = index[1:]
+    dtype = {2: np.dtype("<u2"), 4: np.dtype("<i4")}[int(index[0])]
+    if self.offsets[-1]:
+      self.ids = np.memmap(path, dtype=dtype, mode="r")
+    else:
+      self.ids = np.zeros([0], dtype=dtype)
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+  def __getitem__(self, idx):
+    """Returns the token-ids of the sentence idx, a numpy array."""
+    return self.ids[self.offsets[idx]:self.offsets[idx + 1]]
+
+  def __iter__(self):
+    for idx in range(len(self)):
+      yield self[idx]
+
+  def lengths(self):
+    """Returns the number of token-ids of all the sentences."""
+    return np.diff(self.offsets)
+
+
 def prepare_data(data_dir,
                  from_train_path,
                  to_train_path,
@@ -631,7 +871,9 @@ def prepare_data(data_dir,
                  to_dev_path,
                  from_vocabulary_size,
                  to_vocabulary_size,
-                 tokenizer=None):
+                 tokenizer=None,
+                 num_workers=1,
+                 binary=False):
   """Preapre all necessary files that are required for the training.
 
   Args:
@@ -644,6 +886,10 @@ def prepare_data(data_dir,
     to_vocabulary_size: size of the "to language" vocabulary to create and use.
     tokenizer: a function to use to tokenize each data sentence;
       if None, basic_tokenizer will be used.
+    num_workers: number of processes counting and converting the tokens, all
+      the cpus if None.
+    binary: if True, the token-ids are written by `data_to_token_ids_binary`,
+      in files with a ".bin" suffix.
 
   Returns:
     A tuple of 6 elements:
@@ -657,20 +903,34 @@ def prepare_data(data_dir,
   # Create vocabularies of the appropriate sizes.
   to_vocab_path = os.path.join(data_dir, "vocab%d.to" % to_vocabulary_size)
   from_vocab_path = os.path.join(data_dir, "vocab%d.from" % from_vocabulary_size)
-  create_vocabulary(to_vocab_path, to_train_path, to_vocabulary_size, tokenizer)
-  create_vocabulary(from_vocab_path, from_train_path, from_vocabulary_size, tokenizer)
+  create_vocabulary(to_vocab_path, to_train_path, to_vocabulary_size, tokenizer,
+                    num_workers=num_workers)
+  create_vocabulary(from_vocab_path, from_train_path, from_vocabulary_size, tokenizer,
+                    num_workers=num_workers)
+
+  if binary:
+    suffix = ".ids%d.bin"
+
+    def to_token_ids(data_path, target_path, vocabulary_path):
+      data_to_token_ids_binary(data_path, target_path, vocabulary_path, tokenizer,
+                               num_workers=num_workers)
+  else:
+    suffix = ".ids%d"
+
+    def to_token_ids(data_path, target_path, vocabulary_path):
+      data_to_token_ids(data_path, target_path, vocabulary_path, tokenizer)
 
   # Create token ids for the training data.
-  to_train_ids_path = to_train_path + (".ids%d" % to_vocabulary_size)
-  from_train_ids_path = from_train_path + (".ids%d" % from_vocabulary_size)
-  data_to_token_ids(to_train_path, to_train_ids_path, to_vocab_path, tokenizer)
-  data_to_token_ids(from_train_path, from_train_ids_path, from_vocab_path, tokenizer)
+  to_train_ids_path = to_train_path + (suffix % to_vocabulary_size)
+  from_train_ids_path = from_train_path + (suffix % from_vocabulary_size)
+  to_token_ids(to_train_path, to_train_ids_path, to_vocab_path)
+  to_token_ids(from_train_path, from_train_ids_path, from_vocab_path)
 
   # Create token ids for the development data.
-  to_dev_ids_path = to_dev_path + (".ids%d" % to_vocabulary_size)
-  from_dev_ids_path = from_dev_path + (".ids%d" % from_vocabulary_size)
-  data_to_token_ids(to_dev_path, to_dev_ids_path, to_vocab_path, tokenizer)
-  data_to_token_ids(from_dev_path, from_dev_ids_path, from_vocab_path, tokenizer)
+  to_dev_ids_path = to_dev_path + (suffix % to_vocabulary_size)
+  from_dev_ids_path = from_dev_path + (suffix % from_vocabulary_size)
+  to_token_ids(to_dev_path, to_dev_ids_path, to_vocab_path)
+  to_token_ids(from_dev_path, from_dev_ids_path, from_vocab_path)
 
   return (from_train_ids_path, to_train_ids_path, from_dev_ids_path, to_dev_ids_path,
           from_vocab_path, to_vocab_path)
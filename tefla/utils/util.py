@@ -1,4 +1,5 @@
 import importlib
+import itertools
 import logging
 import collections
 import six
@@ -740,6 +741,9 @@ def pad_sequences(sequences, maxlen=None, dtype='int32', padding='post', truncat
   truncated to maxlen. Truncation happens off either the beginning or the end
   (default) of the sequence. Supports pre-padding and post-padding (default).
 
+  The padded array is written directly in `dtype`, with all the sequences
+  copied by a single scatter.
+
   Args:
       sequences: list of lists where each element is a sequence.
       maxlen: a `int`, maximum length.
@@ -751,33 +755,122 @@ def pad_sequences(sequences, maxlen=None, dtype='int32', padding='post', truncat
 
   Returns:
       x: `numpy array` with dimensions (number_of_sequences, maxlen)
+
+  Raises:
+      ValueError: if padding or truncating is not 'pre' or 'post'.
   """
-  lengths = [len(s) for s in sequences]
+  if padding not in ('pre', 'post'):
+    raise ValueError("Padding type '%s' not understood" % padding)
+  if truncating not in ('pre', 'post'):
+    raise ValueError("Truncating type '%s' not understood" % truncating)
+  lengths = np.fromiter((len(s) for s in sequences), dtype=np.int64, count=len(sequences))
 
   nb_samples = len(sequences)
   if maxlen is None:
-    maxlen = np.max(lengths)
-
-  x = (np.ones((nb_samples, maxlen)) * value).astype(dtype)
-  for idx, s in enumerate(sequences):
-    if len(s) == 0:
-      continue  # empty list was found
-    if truncating == 'pre':
-      trunc = s[-maxlen:]
-    elif truncating == 'post':
-      trunc = s[:maxlen]
-    else:
-      raise ValueError("Truncating type '%s' not understood" % padding)
+    maxlen = np.max(lengths) if nb_samples else 0
 
-    if padding == 'post':
-      x[idx, :len(trunc)] = trunc
-    elif padding == 'pre':
-      x[idx, -len(trunc):] = trunc
-    else:
-      raise ValueError("Padding type '%s' not understood" % padding)
+  x = np.full((nb_samples, maxlen), value, dtype=dtype)
+  kept = np.minimum(lengths, maxlen)
+  num_kept = int(np.sum(kept))
+  if num_kept == 0:
+    return x
+  values = _concatenate_sequences(sequences, lengths, x.dtype)
+  # start of each sequence in values, and of its kept part
+  starts = np.cumsum(lengths) - lengths
+  if truncating == 'pre':
+    starts += lengths - kept
+  # position of each kept element in its sequence
+  kept_starts = np.cumsum(kept) - kept
+  positions = np.arange(num_kept) - np.repeat(kept_starts, kept)
+  rows = np.repeat(np.arange(nb_samples), kept)
+  cols = positions
+  if padding == 'pre':
+    cols = cols + np.repeat(maxlen - kept, kept)
+  x[rows, cols] = values[np.repeat(starts, kept) + positions]
   return x
 
 
+def _concatenate_sequences(sequences, lengths, dtype):
+  """Concatenates the elements of the sequences in a 1-D array of `dtype`."""
+  if dtype.kind in 'biuf':
+    try:
+      return np.fromiter(
+          itertools.chain.from_iterable(sequences), dtype=dtype, count=int(np.sum(lengths)))
+    except (TypeError, ValueError):
+      pass
+  arrays = [np.asarray(s, dtype=dtype) for s in sequences]
+  for i, a in enumerate(arrays):
+    if a.ndim != 1:
+      raise ValueError('Sequence at position %d has elements of shape %s, expected scalars' %
+                       (i, a.shape[1:]))
+  return np.concatenate([a.ravel() for a in arrays]) if arrays else np.zeros(0, dtype)
+
+
+def bucket_pad_sequences(sequences,
+                         batch_size,
+                         maxlen=None,
+                         dtype='int32',
+                         padding='post',
+                         truncating='post',
+                         value=0.,
+                         shuffle=False,
+                         seed=None):
+  """Groups sequences of similar lengths in batches padded to their own length.
+
+  The sequences are sorted by length and split in batches of `batch_size`
+  consecutive sequences, each batch is padded to the length of its longest
+  sequence by `pad_sequences`, so that the padded batches waste little memory
+  and compute compared to padding all the sequences to the longest one.
+
+  Args:
+      sequences: list of lists where each element is a sequence.
+      batch_size: a `int`, number of sequences of a batch, the last batch may
+          be smaller.
+      maxlen: a `int`, maximum length, longer sequences are truncated.
+      dtype: type to cast the resulting sequence.
+      padding: 'pre' or 'post', pad either before or after each sequence.
+      truncating: 'pre' or 'post', remove values from sequences larger than
+          maxlen either in the beginning or in the end of the sequence
+      value: `float`, value to pad the sequences to the desired value.
+      shuffle: a `bool`, if true the order of the batches is shuffled.
+      seed: seed of the shuffling.
+
+  Returns:
+      a list of (indices, x) pairs, indices of the sequences of a batch in
+      `sequences` and the padded batch, `numpy array` with dimensions
+      (len(indices), batch maxlen).
+  """
+  lengths = np.fromiter((len(s) for s in sequences), dtype=np.int64, count=len(sequences))
+  order = np.argsort(lengths, kind='mergesort')
+  batches_indices = [order[i:i + batch_size] for i in range(0, len(order), batch_size)]
+  if shuffle:
+    np.random.RandomState(seed).shuffle(batches_indices)
+  batches = []
+  for indices in batches_indices:
+    batch_maxlen = int(lengths[indices[-1]])
+    if maxlen is not None:
+      batch_maxlen = min(batch_maxlen, maxlen)
+    batches.append((indices,
+                    pad_sequences([sequences[i] for i in indices], batch_maxlen, dtype, padding,
+                                  truncating, value)))
+  return batches
+
+
+def padding_overhead(lengths, padded_shapes):
+  """Ratio of the padding elements to the elements of the sequences.
+
+  Args:
+      lengths: lengths of the sequences.
+      padded_shapes: shapes of the padded arrays of the sequences.
+
+  Returns:
+      a `float`, 0 if there is no padding.
+  """
+  num_padded = sum(int(np.prod(shape)) for shape in padded_shapes)
+  num_elements = int(np.sum(lengths))
+  return float(num_padded - num_elements) / max(num_elements, 1)
+
+
 def chars_to_dictionary(string):
   """ Creates a dictionary char:integer for each unique character
     Args:
@@ -791,10 +884,155 @@ def chars_to_dictionary(string):
   return char_idx
 
 
+def string_to_char_ids(string, char_idx=None):
+  """Encodes a string as an array of char ids.
+
+  Args:
+      string: `str`. Input text.
+      char_idx: 'dict'. A dictionary to convert chars to positions. Will be
+         automatically generated if None
+
+  Returns:
+      A tuple: (1-D array of char ids, dictionary), the ids are uint8 if the
+      dictionary has at most 256 chars and int32 otherwise.
+
+  Raises:
+      KeyError: if a char of the string is not in `char_idx`.
+  """
+  if char_idx is None:
+    char_idx = chars_to_dictionary(string)
+  codes = np.frombuffer(six.text_type(string).encode('utf-32-le'), dtype='<u4')
+  chars = sorted(char_idx)
+  char_codes = np.array([ord(c) for c in chars], dtype=np.uint32)
+  ids = np.array([char_idx[c] for c in chars], dtype=np.int32)
+  if not chars:
+    if len(codes):
+      raise KeyError(string[0])
+    return np.zeros([0], dtype=np.uint8), char_idx
+  positions = np.minimum(np.searchsorted(char_codes, codes), len(chars) - 1)
+  unknown = char_codes[positions] != codes
+  if np.any(unknown):
+    raise KeyError(six.unichr(codes[np.argmax(unknown)]))
+  dtype = np.uint8 if len(char_idx) <= 256 else np.int32
+  return ids[positions].astype(dtype), char_idx
+
+
+class SemiRedundantSequences(object):
+  """Semi redundant sequences of chars of a text, and their next char.
+
+  The text is stored once as an array of char ids; the sequences are a
+  window view of it and the one-hot inputs and targets are built on demand,
+  per batch, so that the memory used is proportional to the length of the
+  text.
+
+  Args:
+      char_ids: 1-D array of char ids, e.g. from `string_to_char_ids`.
+      char_idx: 'dict'. The dictionary of the char ids.
+      seq_maxlen: `int`. Maximum length of a sequence.
+      redun_step: `int`. Redundancy step.
+  """
+
+  def __init__(self, char_ids, char_idx, seq_maxlen=25, redun_step=3):
+    self.char_ids = np.asarray(char_ids)
+    self.char_idx = char_idx
+    self.seq_maxlen = seq_maxlen
+    self.redun_step = redun_step
+
+  @property
+  def num_chars(self):
+    return len(self.char_idx)
+
+  def __len__(self):
+    return max(0, -(-(len(self.char_ids) - self.seq_maxlen) // self.redun_step))
+
+  @property
+  def sequences(self):
+    """Read-only [num_sequences, seq_maxlen] view of the char ids of the
+    sequences."""
+    stride = self.char_ids.strides[0]
+    view = np.lib.stride_tricks.as_strided(
+        self.char_ids,
+        shape=(len(self), self.seq_maxlen),
+        strides=(self.redun_step * stride, stride))
+    view.flags.writeable = False
+    return view
+
+  @property
+  def targets(self):
+    """[num_sequences] char ids of the char following each sequence."""
+    return self.char_ids[self.seq_maxlen::self.redun_step][:len(self)]
+
+  def one_hot(self, ids):
+    """Boolean one-hot encoding of an array of char ids."""
+    encoded = np.zeros(ids.shape + (self.num_chars,), dtype=np.bool_)
+    encoded.reshape(-1, self.num_chars)[np.arange(ids.size), ids.ravel()] = True
+    return encoded
+
+  def batch(self, indices, one_hot=True):
+    """Returns the inputs and targets of the sequences at `indices`.
+
+    Args:
+        indices: indices or slice of the sequences.
+        one_hot: `bool`, if true the inputs and targets are one-hot encoded,
+            else they are char ids.
+
+    Returns:
+        A tuple: (inputs, targets), [batch_size, seq_maxlen, num_chars] and
+        [batch_size, num_chars] if one_hot, [batch_size, seq_maxlen] and
+        [batch_size] otherwise.
+    """
+    inputs = self.sequences[indices]
+    targets = self.targets[indices]
+    if one_hot:
+      return self.one_hot(inputs), self.one_hot(targets)
+    return np.array(inputs), targets
+
+  def iterate_batches(self, batch_size, shuffle=False, one_hot=True, seed=None):
+    """Yields the batches of inputs and targets of all the sequences.
+
+    Args:
+        batch_size: `int`, number of sequences of a batch, the last batch may
+            be smaller.
+        shuffle: `bool`, if true the sequences are shuffled.
+        one_hot: `bool`, see `batch`.
+        seed: seed of the shuffling.
+    """
+    num_sequences = len(self)
+    if shuffle:
+      order = np.random.RandomState(seed).permutation(num_sequences)
+    for start in range(0, num_sequences, batch_size):
+      if shuffle:
+        indices = np.sort(order[start:start + batch_size])
+      else:
+        indices = slice(start, start + batch_size)
+      yield self.batch(indices, one_hot)
+
+
+def string_to_char_sequences(string, seq_maxlen=25, redun_step=3, char_idx=None):
+  """Vectorize a string to semi redundant sequences built on demand.
+
+  Args:
+      string: `str`. Lower-case text from input text file.
+      seq_maxlen: `int`. Maximum length of a sequence. Default: 25.
+      redun_step: `int`. Redundancy step. Default: 3.
+      char_idx: 'dict'. A dictionary to convert chars to positions. Will be
+         automatically generated if None
+
+  Returns:
+      A `SemiRedundantSequences`.
+  """
+  char_ids, char_idx = string_to_char_ids(string, char_idx)
+  return SemiRedundantSequences(char_ids, char_idx, seq_maxlen, redun_step)
+
+
 def string_to_semi_redundant_sequences(string, seq_maxlen=25, redun_step=3, char_idx=None):
   """string_to_semi_redundant_sequences. Vectorize a string and returns parsed
   sequences and targets, along with the associated dictionary.
 
+  The inputs are dense one-hot arrays of
+  num_sequences * seq_maxlen * num_chars booleans, for large texts use
+  `string_to_char_sequences` instead.
+
   Args:
       string: `str`. Lower-case text from input text file.
       seq_maxlen: `int`. Maximum length of a sequence. Default: 25.
@@ -808,29 +1046,14 @@ def string_to_semi_redundant_sequences(string, seq_maxlen=25, redun_step=3, char
 
   print("Vectorizing text...")
 
-  if char_idx is None:
-    char_idx = chars_to_dictionary(string)
-
-  len_chars = len(char_idx)
-
-  sequences = []
-  next_chars = []
-  for i in range(0, len(string) - seq_maxlen, redun_step):
-    sequences.append(string[i:i + seq_maxlen])
-    next_chars.append(string[i + seq_maxlen])
-
-  X = np.zeros((len(sequences), seq_maxlen, len_chars), dtype=np.bool)
-  Y = np.zeros((len(sequences), len_chars), dtype=np.bool)
-  for i, seq in enumerate(sequences):
-    for t, char in enumerate(seq):
-      X[i, t, char_idx[char]] = 1
-    Y[i, char_idx[next_chars[i]]] = 1
+  sequences = string_to_char_sequences(string, seq_maxlen, redun_step, char_idx)
+  X, Y = sequences.batch(slice(None))
 
   print("Text total length: {:,}".format(len(string)))
-  print("Distinct chars   : {:,}".format(len_chars))
+  print("Distinct chars   : {:,}".format(sequences.num_chars))
   print("Total sequences  : {:,}".format(len(sequences)))
 
-  return X, Y, char_idx
+  return X, Y, sequences.char_idx
 
 
 def textfile_to_semi_redundant_sequences(path,
@@ -859,6 +1082,30 @@ def textfile_to_semi_redundant_sequences(path,
   return string_to_semi_redundant_sequences(text, seq_maxlen, redun_step, pre_defined_char_idx)
 
 
+def textfile_to_char_sequences(path,
+                               seq_maxlen=25,
+                               redun_step=3,
+                               to_lower_case=False,
+                               pre_defined_char_idx=None):
+  """Vectorize a text file to semi redundant sequences built on demand.
+
+  Args:
+      path: `str`. path of the input text file.
+      seq_maxlen: `int`. Maximum length of a sequence. Default: 25.
+      redun_step: `int`. Redundancy step. Default: 3.
+      to_lower_case: a `bool`, if true, convert to lowercase
+      pre_defined_char_idx: 'dict'. A dictionary to convert chars to positions.
+          Will be automatically generated if None
+
+  Returns:
+      A `SemiRedundantSequences`.
+  """
+  text = open(path).read()
+  if to_lower_case:
+    text = text.lower()
+  return string_to_char_sequences(text, seq_maxlen, redun_step, pre_defined_char_idx)
+
+
 def logits_to_log_prob(logits):
   """Computes log probabilities using numerically stable trick. This uses two
   numerical stability tricks:
@@ -1003,7 +1250,7 @@ def BatchClipByL2norm(t, upper_bound, name=None):
     # Add a small number to avoid divide by 0
     l2norm_inv = tf.rsqrt(tf.reduce_sum(t2 * t2, [1]) + 0.000001)
     scale = tf.minimum(l2norm_inv, upper_bound_inv) * upper_bound
-    clipped_t = tf.matmul(tf.diag(scale), t2)
+    clipped_t = t2 * tf.expand_dims(scale, 1)
     clipped_t = tf.reshape(clipped_t, saved_shape, name=name)
     return clipped_t
 
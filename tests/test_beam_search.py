@@ -28,6 +28,28 @@ class TestGatherTree(tf.test.TestCase):
 
     self.assertNDArrayNear(expected_result, res_, 0.0001)
 
+  def test_gather_tree_matches_py(self):
+    rng = np.random.RandomState(0)
+    for length, beam_width in [(1, 4), (7, 5), (50, 16)]:
+      values = rng.randint(0, 100, (length, beam_width)).astype(np.int32)
+      parents = rng.randint(0, beam_width, (length, beam_width)).astype(np.int32)
+      with tf.Graph().as_default():
+        res = beam_search.gather_tree(tf.constant(values), tf.constant(parents))
+        for op in tf.get_default_graph().get_operations():
+          self.assertNotEqual('PyFunc', op.type)
+        with self.test_session() as sess:
+          self.assertAllEqual(beam_search.gather_tree_py(values, parents), sess.run(res))
+
+  def test_gather_tree_batch(self):
+    rng = np.random.RandomState(1)
+    values = rng.randint(0, 100, (9, 3, 4)).astype(np.int64)
+    parents = rng.randint(0, 4, (9, 3, 4)).astype(np.int32)
+    res = beam_search.gather_tree(tf.constant(values), tf.constant(parents))
+    with self.test_session() as sess:
+      res_ = sess.run(res)
+    for b in range(3):
+      self.assertAllEqual(beam_search.gather_tree_py(values[:, b], parents[:, b]), res_[:, b])
+
 
 class TestLengthNorm(tf.test.TestCase):
   """Tests the length normalization score"""
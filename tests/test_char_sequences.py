@@ -0,0 +1,55 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+from tefla.utils import util
+
+
+def dense_sequences(string, seq_maxlen, redun_step, char_idx):
+  X = np.zeros((len(range(0, len(string) - seq_maxlen, redun_step)), seq_maxlen, len(char_idx)),
+               dtype=np.bool_)
+  Y = np.zeros((X.shape[0], len(char_idx)), dtype=np.bool_)
+  for i, start in enumerate(range(0, len(string) - seq_maxlen, redun_step)):
+    for t, char in enumerate(string[start:start + seq_maxlen]):
+      X[i, t, char_idx[char]] = 1
+    Y[i, char_idx[string[start + seq_maxlen]]] = 1
+  return X, Y
+
+
+class CharSequencesTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(CharSequencesTest, self).setUp()
+    self.text = ''.join(np.random.RandomState(0).choice(list('abcde fgh.\n'), 500))
+
+  def test_dense_sequences(self):
+    for seq_maxlen, redun_step in [(25, 3), (7, 1), (10, 4)]:
+      X, Y, char_idx = util.string_to_semi_redundant_sequences(self.text, seq_maxlen, redun_step)
+      expected_X, expected_Y = dense_sequences(self.text, seq_maxlen, redun_step, char_idx)
+      self.assertAllEqual(expected_X, X)
+      self.assertAllEqual(expected_Y, Y)
+
+  def test_char_sequences(self):
+    sequences = util.string_to_char_sequences(self.text, 10, 4)
+    X, Y, _ = util.string_to_semi_redundant_sequences(self.text, 10, 4)
+    self.assertEqual(np.uint8, sequences.char_ids.dtype)
+    self.assertEqual(len(X), len(sequences))
+    batches = list(sequences.iterate_batches(16, shuffle=True, seed=1))
+    self.assertEqual(len(X), sum(len(inputs) for inputs, _ in batches))
+    inputs, targets = sequences.batch([3, 8])
+    self.assertAllEqual(X[[3, 8]], inputs)
+    self.assertAllEqual(Y[[3, 8]], targets)
+    inputs, targets = sequences.batch(slice(0, 4), one_hot=False)
+    self.assertAllEqual(np.argmax(X[:4], -1), inputs)
+    self.assertAllEqual(np.argmax(Y[:4], -1), targets)
+
+  def test_unknown_char(self):
+    with self.assertRaises(KeyError):
+      util.string_to_char_ids('abz', {'a': 0, 'b': 1})
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,102 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import tempfile
+
+import numpy as np
+import tensorflow as tf
+
+from tefla.core import checkpoint_ops
+
+
+class CheckpointOpsTest(tf.test.TestCase):
+
+  def _save_checkpoints(self, values):
+    weights_dir = tempfile.mkdtemp()
+    with tf.Graph().as_default():
+      w = tf.get_variable('w', shape=[2, 3])
+      h = tf.get_variable('h', shape=[4], dtype=tf.float16)
+      global_step = tf.Variable(0, name='global_step', dtype=tf.int64)
+      saver = tf.train.Saver()
+      with self.test_session() as sess:
+        for epoch, value in enumerate(values, 1):
+          sess.run([
+              w.assign(tf.fill([2, 3], value)),
+              h.assign(tf.fill([4], tf.cast(value, tf.float16))),
+              global_step.assign(epoch)
+          ])
+          saver.save(sess, os.path.join(weights_dir, 'model-epoch-%d.ckpt' % epoch))
+    return weights_dir
+
+  def test_averaging_weights(self):
+    self.assertAllClose([0.25] * 4, checkpoint_ops.averaging_weights(4))
+    self.assertAllClose([0.25, 0.75], checkpoint_ops.averaging_weights(2, 'weighted', [1, 3]))
+    ema = 1.0
+    for value in [2.0, 3.0]:
+      ema = 0.8 * ema + 0.2 * value
+    weights = checkpoint_ops.averaging_weights(3, 'ema', decay=0.8)
+    self.assertAllClose(ema, np.dot(weights, [1.0, 2.0, 3.0]))
+    with self.assertRaises(ValueError):
+      checkpoint_ops.averaging_weights(3, 'weighted', [1, 2])
+
+  def test_average_checkpoints(self):
+    weights_dir = self._save_checkpoints([1.0, 2.0, 3.0, 6.0])
+    checkpoints = checkpoint_ops.epoch_checkpoints(weights_dir, last_k=3)
+    self.assertEqual(['model-epoch-%d.ckpt' % i for i in (2, 3, 4)],
+                     [os.path.basename(c) for c in checkpoints])
+    output_path = os.path.join(weights_dir, 'model-avg.ckpt')
+    self.assertEqual(3, checkpoint_ops.average_checkpoints(checkpoints, output_path,
+                                                           num_threads=2))
+
+    reader = tf.train.NewCheckpointReader(output_path)
+    self.assertAllClose(np.full([2, 3], 11.0 / 3), reader.get_tensor('w'))
+    self.assertEqual(np.float16, reader.get_tensor('h').dtype)
+    self.assertAllClose(np.full([4], 11.0 / 3), reader.get_tensor('h'), atol=1e-2)
+    self.assertEqual(4, reader.get_tensor('global_step'))
+
+  def test_average_checkpoints_in_place(self):
+    weights_dir = self._save_checkpoints([1.0, 3.0])
+    checkpoints = checkpoint_ops.epoch_checkpoints(weights_dir)
+    checkpoint_ops.average_checkpoints(
+        checkpoints, checkpoints[0], mode='weighted', weights=[0.5, 1.5], exclude='h')
+    reader = tf.train.NewCheckpointReader(checkpoints[0])
+    self.assertAllClose(np.full([2, 3], 2.5), reader.get_tensor('w'))
+    self.assertFalse(reader.has_tensor('h'))
+
+  def test_retention_policy(self):
+    records = [('c%d' % i, i, m) for i, m in enumerate([0.5, 0.2, 0.9, 0.4, 0.8, 0.7], 1)]
+    self.assertEqual(set(r[0] for r in records), checkpoint_ops.RetentionPolicy().select(records))
+    policy = checkpoint_ops.RetentionPolicy(keep_last=1, keep_best=2, keep_every=3)
+    self.assertEqual({'c6', 'c2', 'c4', 'c3'}, policy.select(records))
+    policy = checkpoint_ops.RetentionPolicy(keep_best=1, best_mode='max')
+    self.assertEqual({'c3'}, policy.select(records))
+
+  def test_async_checkpoint_saver(self):
+    weights_dir = tempfile.mkdtemp()
+    with tf.Graph().as_default():
+      w = tf.get_variable('w', shape=[3], initializer=tf.zeros_initializer())
+      async_saver = checkpoint_ops.AsyncCheckpointSaver(
+          retention=checkpoint_ops.RetentionPolicy(keep_last=1, keep_best=1))
+      written = []
+      with self.test_session() as sess:
+        sess.run(tf.global_variables_initializer())
+        for epoch, metric in enumerate([0.3, 0.1, 0.5], 1):
+          sess.run(w.assign(tf.fill([3], float(epoch))))
+          save_path = os.path.join(weights_dir, 'model-epoch-%d.ckpt' % epoch)
+          async_saver.save(
+              sess, save_path, epoch=epoch, metric=metric, callback=lambda: written.append(1))
+        async_saver.close()
+
+    self.assertEqual(3, len(written))
+    self.assertEqual(['model-epoch-%d.ckpt' % i for i in (2, 3)],
+                     [os.path.basename(c) for c in checkpoint_ops.epoch_checkpoints(weights_dir)])
+    reader = tf.train.NewCheckpointReader(os.path.join(weights_dir, 'model-epoch-2.ckpt'))
+    self.assertAllClose([2.0] * 3, reader.get_tensor('w'))
+    self.assertEqual(
+        os.path.join(weights_dir, 'model-epoch-3.ckpt'), tf.train.latest_checkpoint(weights_dir))
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+from __future__ import unicode_literals
+
+import os
+import tempfile
+
+import numpy as np
+import tensorflow as tf
+
+from tefla.dataset import compact_vocabulary
+from tefla.dataset import text_data
+from tefla.dataset import text_encoder
+from tefla.dataset import vocabulary
+
+
+class CompactVocabularyTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(CompactVocabularyTest, self).setUp()
+    self.words = ["<S>", "</S>", "<UNK>", "hello", "world", "ünïcode", "", "hello", "a"]
+    self.tmp_dir = tempfile.mkdtemp()
+    self.vocab_file = os.path.join(self.tmp_dir, "vocab.cv")
+    compact_vocabulary.write_compact_vocab(self.words, self.vocab_file)
+
+  def test_encode_decode_many(self):
+    vocab = compact_vocabulary.CompactVocabulary(self.vocab_file)
+    self.assertTrue(compact_vocabulary.is_compact_vocab(self.vocab_file))
+    self.assertEqual(len(vocab), len(self.words))
+    ids = vocab.encode_many(["world", "hello", "ünïcode", "", "missing"])
+    # duplicated words map to their last id
+    self.assertAllEqual([4, 7, 5, 6, -1], ids)
+    self.assertEqual(["world", "hello", "ünïcode", ""], vocab.decode_many(ids[:4]))
+    self.assertEqual(["a", "ID_99"], vocab.decode_many([8, 99], unknown=lambda i: "ID_%d" % i))
+    self.assertEqual("hello world", vocab.join([3, 4]))
+    with self.assertRaises(KeyError):
+      vocab.encode_many(["missing"], default=None)
+    self.assertEqual(7, vocab.token_to_id["hello"])
+    self.assertNotIn("missing", vocab.token_to_id)
+    self.assertEqual("world", vocab.id_to_token[4])
+
+  def test_large_vocab(self):
+    words = ["w%d" % i for i in range(100000)]
+    vocab_file = os.path.join(self.tmp_dir, "large.cv")
+    compact_vocabulary.write_compact_vocab(words, vocab_file)
+    vocab = compact_vocabulary.CompactVocabulary(vocab_file)
+    query = np.random.RandomState(0).randint(0, len(words), 5000)
+    self.assertAllEqual(query, vocab.encode_many([words[i] for i in query]))
+    self.assertEqual([words[i] for i in query], vocab.decode_many(query))
+
+  def test_vocabulary_backends(self):
+    text_file = os.path.join(self.tmp_dir, "vocab.txt")
+    words = ["<S>", "</S>", "<UNK>", "hello", "world"]
+    with open(text_file, "w") as f:
+      f.write("\n".join(words) + "\n")
+    compact_file = os.path.join(self.tmp_dir, "vocab2.cv")
+    compact_vocabulary.write_compact_vocab(words, compact_file)
+    sentence = "hello big world"
+
+    plain, compact = vocabulary.Vocabulary(text_file), vocabulary.Vocabulary(compact_file)
+    self.assertAllEqual(plain.encode_many(sentence.split()), compact.encode_many(sentence.split()))
+    self.assertEqual(plain.decode_many([3, 4, 10]), compact.decode_many([3, 4, 10]))
+
+    plain, compact = text_data.CharsVocabulary(text_file, 6), text_data.CharsVocabulary(
+        compact_file, 6)
+    self.assertAllEqual(plain.encode(sentence), compact.encode(sentence))
+    self.assertAllEqual(plain.encode_chars(sentence), compact.encode_chars(sentence))
+    self.assertAllEqual(plain.word_char_ids, compact.word_char_ids)
+
+    plain = text_encoder.TokenTextEncoder(text_file, replace_oov="<UNK>")
+    compact = text_encoder.TokenTextEncoder(compact_file, replace_oov="<UNK>")
+    self.assertEqual(plain.encode(sentence), compact.encode(sentence))
+    self.assertEqual(plain.decode([3, 4, 10]), compact.decode([3, 4, 10]))
+    self.assertEqual(plain.vocab_size, compact.vocab_size)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,99 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import io
+import os
+import tempfile
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+
+from tefla import convert
+
+CROP_SIZE = 16
+
+
+class ConvertImagesTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(ConvertImagesTest, self).setUp()
+    rng = np.random.RandomState(0)
+    self.directory = tempfile.mkdtemp()
+    self.convert_directory = tempfile.mkdtemp()
+    os.makedirs(os.path.join(self.directory, 'sub'))
+    self.filenames = []
+    for i in range(5):
+      fname = os.path.join(self.directory, 'sub' if i % 2 else '', 'img%d.png' % i)
+      Image.fromarray(rng.randint(0, 256, (30, 40, 3)).astype(np.uint8)).save(fname)
+      self.filenames.append(fname)
+    self.filenames.sort()
+    self.expected = [np.asarray(convert.convert(f, CROP_SIZE)) for f in self.filenames]
+
+  def _convert_images(self, **kwargs):
+    return convert.convert_images(
+        self.filenames,
+        self.directory,
+        self.convert_directory,
+        crop_size=CROP_SIZE,
+        num_workers=2,
+        chunksize=2,
+        report_every=0,
+        **kwargs)
+
+  def test_files(self):
+    stats = self._convert_images(extension='png', output_format='files')
+    self.assertEqual((5, 0, 0), (stats.images, stats.skipped, stats.errors))
+    for fname, expected in zip(self.filenames, self.expected):
+      output = convert.get_convert_fname(fname, 'png', self.directory, self.convert_directory)
+      self.assertAllEqual(expected, np.asarray(Image.open(output)))
+    stats = self._convert_images(extension='png', output_format='files')
+    self.assertEqual((0, 5, 0), (stats.images, stats.skipped, stats.errors))
+
+  def test_npy(self):
+    stats = self._convert_images(output_format='npy')
+    self.assertEqual((5, 0, 0), (stats.images, stats.skipped, stats.errors))
+    prefix = os.path.join(self.convert_directory, 'images_%d' % CROP_SIZE)
+    self.assertAllEqual(np.stack(self.expected), np.load(prefix + '.npy'))
+    with open(prefix + '.files.txt') as f:
+      self.assertEqual(self.filenames, [line.rstrip('\n') for line in f])
+    stats = self._convert_images(output_format='npy')
+    self.assertEqual((0, 5, 0), (stats.images, stats.skipped, stats.errors))
+
+  def test_tfrecords(self):
+    labels = {fname: i for i, fname in enumerate(self.filenames)}
+    stats = self._convert_images(output_format='tfrecords', shard_size=3, labels=labels)
+    self.assertEqual((5, 0, 0), (stats.images, stats.skipped, stats.errors))
+    prefix = os.path.join(self.convert_directory, 'images_%d' % CROP_SIZE)
+    records = {}
+    for shard, size in enumerate([3, 2]):
+      shard_records = list(tf.python_io.tf_record_iterator('%s-%05d.tfrecord' % (prefix, shard)))
+      self.assertEqual(size, len(shard_records))
+      for record in shard_records:
+        example = tf.train.Example.FromString(record)
+        feature = example.features.feature
+        name = feature['image/filename'].bytes_list.value[0].decode('utf-8')
+        image = Image.open(io.BytesIO(feature['image/encoded/image'].bytes_list.value[0]))
+        records[name] = (feature['image/class/label'].int64_list.value[0], image.size)
+    self.assertEqual({
+        os.path.basename(fname): (label, (CROP_SIZE, CROP_SIZE))
+        for fname, label in labels.items()
+    }, records)
+    stats = self._convert_images(output_format='tfrecords', shard_size=3, labels=labels)
+    self.assertEqual((0, 5, 0), (stats.images, stats.skipped, stats.errors))
+
+  def test_missing_labels(self):
+    labels = {fname: 1 for fname in self.filenames[1:]}
+    with self.assertRaises(ValueError):
+      self._convert_images(output_format='tfrecords', labels=labels)
+
+  def test_errors(self):
+    with open(self.filenames[0], 'wb') as f:
+      f.write(b'not an image')
+    stats = self._convert_images(extension='png', output_format='files')
+    self.assertEqual((4, 0, 1), (stats.images, stats.skipped, stats.errors))
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,79 @@
+"""Tests for the vectorized augmentation transforms of tefla.da.data"""
+import numpy as np
+import tensorflow as tf
+
+from tefla.da import data
+
+AUG_PARAMS = {
+    'zoom_range': (1 / 1.15, 1.15),
+    'rotation_range': (0, 360),
+    'shear_range': (0, 15),
+    'translation_range': (-15, 15),
+    'do_flip': True,
+    'allow_stretch': 1.2,
+}
+
+
+class PerturbationMatricesTest(tf.test.TestCase):
+
+  def testMatchesSkimageTransforms(self):
+    image_shape, target_shape = (300, 280), (256, 256)
+    params = data.random_perturbation_params(20, rng=np.random.RandomState(3), **AUG_PARAMS)
+    matrices = data.build_perturbation_matrices(
+        data.build_augmentation_matrices(**params), image_shape, target_shape)
+    tform_centering = data.build_centering_transform(image_shape, target_shape)
+    tform_center, tform_uncenter = data.build_center_uncenter_transforms(image_shape)
+    for i in range(20):
+      tform_augment = data.build_augmentation_transform(
+          (params['zoom_x'][i], params['zoom_y'][i]), params['rotation'][i], params['shear'][i],
+          (params['shift_x'][i], params['shift_y'][i]), params['flip'][i])
+      expected = tform_centering + (tform_uncenter + tform_augment + tform_center)
+      self.assertAllClose(expected.params, matrices[i])
+
+  def testBatchEqualsSequentialDraws(self):
+    rng = np.random.RandomState(5)
+    sequential = np.concatenate([
+        data.random_perturbation_matrices(1, (64, 64), (48, 48), AUG_PARAMS, rng=rng)
+        for _ in range(8)
+    ])
+    batch = data.random_perturbation_matrices(
+        8, (64, 64), (48, 48), AUG_PARAMS, rng=np.random.RandomState(5))
+    self.assertAllEqual(sequential, batch)
+
+  def testMatchesLegacySampler(self):
+    image_shape, target_shape = (80, 70), (64, 64)
+    tform_centering = data.build_centering_transform(image_shape, target_shape)
+    tform_center, tform_uncenter = data.build_center_uncenter_transforms(image_shape)
+    for allow_stretch in [False, True, 1.2]:
+      for do_flip in [False, True]:
+        aug_params = dict(AUG_PARAMS, allow_stretch=allow_stretch, do_flip=do_flip)
+        rng = np.random.RandomState(7)
+        expected = []
+        for _ in range(6):
+          tform_augment = data.random_perturbation_transform(rng=rng, **aug_params)
+          expected.append(tform_centering + (tform_uncenter + tform_augment + tform_center))
+        matrices = data.random_perturbation_matrices(
+            6, image_shape, target_shape, aug_params, rng=np.random.RandomState(7))
+        for tform, m in zip(expected, matrices):
+          self.assertAllClose(tform.params, m)
+
+  def testPerturbMatchesLegacyPerturb(self):
+    img = np.random.RandomState(1).rand(3, 80, 70).astype(np.float32)
+    image_shape, target_shape = img.shape[1:], (64, 64)
+    tform_centering = data.build_centering_transform(image_shape, target_shape)
+    tform_center, tform_uncenter = data.build_center_uncenter_transforms(image_shape)
+    tform_augment = data.random_perturbation_transform(rng=np.random.RandomState(11), **AUG_PARAMS)
+    tform = tform_centering + (tform_uncenter + tform_augment + tform_center)
+    expected = data.fast_warp(img, tform, output_shape=target_shape)
+    out = data.perturb(img, AUG_PARAMS, target_shape, rng=np.random.RandomState(11))
+    self.assertAllClose(expected, out)
+
+  def testPerturbBatch(self):
+    imgs = np.random.RandomState(0).rand(4, 3, 64, 64).astype(np.float32)
+    out = data.perturb_batch(imgs, data.no_augmentation_params, (48, 48))
+    self.assertEqual((4, 3, 48, 48), out.shape)
+    self.assertAllClose(imgs[:, :, 8:56, 8:56], out)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -12,6 +12,7 @@ import tensorflow as tf
 from tefla.dataset.textdataset import TextDataset
 from tefla.dataset.textdecoder import TextDecoder
 from tefla.dataset.textdataflow import TextDataflow
+from tefla.dataset import textdataflow
 
 
 class TestDataset(TextDataset):
@@ -51,9 +52,9 @@ class DataReaderTest(tf.test.TestCase):
   @classmethod
   def setUpClass(cls):
     tf.set_random_seed(1)
-    cls.filepatterns, testdata = generate_test_data('/tmp', '/tmp')
-    cls.decoder = TextDecoder(testdata)
-    cls.dataflow = TextDataflow(testdata, cls.decoder)
+    cls.filepatterns, cls.testdata = generate_test_data('/tmp', '/tmp')
+    cls.decoder = TextDecoder(cls.testdata)
+    cls.dataflow = TextDataflow(cls.testdata, cls.decoder)
 
   def testBatchingSchemeMaxLength(self):
     scheme = self.dataflow._batching_scheme(
@@ -135,6 +136,73 @@ class DataReaderTest(tf.test.TestCase):
     self.assertEqual(list(range(30)), sorted(input_vals))
     self.assertTrue(len(set(obs_batch_sizes)) > 1)
 
+  def testPlanTokenBatches(self):
+    lengths = np.array([1, 30, 2, 7, 7, 3, 12, 5, 40, 9])
+    batches = textdataflow.plan_token_batches(lengths, 20, boundaries=[4, 8])
+    self.assertEqual(list(range(10)), sorted(np.concatenate(batches).tolist()))
+    for batch in batches:
+      self.assertTrue(len(batch) == 1 or len(batch) * lengths[batch].max() <= 20)
+    stats = textdataflow.batch_padding_stats(lengths, batches, [4, 8])
+    self.assertEqual(stats['tokens'], lengths.sum())
+    self.assertEqual(len(stats['bucket_padding_ratio']), 3)
+    dropped = textdataflow.plan_token_batches(lengths, 20, max_length=10)
+    self.assertEqual(8, sum(len(batch) for batch in dropped))
+
+  def testLengthIndex(self):
+    data_file = tf.gfile.Glob(self.filepatterns[0])[0]
+    index = textdataflow.load_length_index(data_file, rebuild=True)
+    self.assertEqual(list(range(1, 31)), sorted(index['lengths'].tolist()))
+    with tf.gfile.GFile(data_file, 'rb') as f:
+      records = textdataflow.read_records(f, index['offsets'][:2], index['sizes'][:2])
+    for record, length in zip(records, index['lengths'][:2]):
+      self.assertEqual(length, textdataflow.example_length(record))
+
+  def testLengthIndexInvalidation(self):
+    data_file = os.path.join(tempfile.mkdtemp(), 'shard.tfrecord')
+
+    def write_shard(lengths):
+      with tf.python_io.TFRecordWriter(data_file) as writer:
+        for length in lengths:
+          example = tf.train.Example(features=tf.train.Features(feature={
+              'inputs': tf.train.Feature(int64_list=tf.train.Int64List(value=[1] * length)),
+              'targets': tf.train.Feature(int64_list=tf.train.Int64List(value=[1] * 3)),
+          }))
+          writer.write(example.SerializeToString())
+
+    write_shard([1, 2])
+    os.utime(data_file, (1e9, 1e9))
+    self.assertEqual([3, 3], textdataflow.load_length_index(data_file)['lengths'].tolist())
+    self.assertEqual([1, 2],
+                     textdataflow.load_length_index(data_file, ['inputs'])['lengths'].tolist())
+    # a shard rewritten with the same modification time is detected by its size
+    write_shard([4, 5, 6])
+    os.utime(data_file, (1e9, 1e9))
+    self.assertEqual([4, 5, 6],
+                     textdataflow.load_length_index(data_file, ['inputs'])['lengths'].tolist())
+
+  def testTokenBatchEpochs(self):
+    dataflow = TextDataflow(self.testdata, self.decoder, num_epochs=2)
+    with self.assertRaises(ValueError):
+      dataflow.get_token_batch(40, preprocessing_fn=lambda ex, mode: ex)
+    batch = dataflow.get_token_batch(40, mode='training', seed=1)
+    input_vals = []
+    with tf.train.MonitoredSession() as sess:
+      while not sess.should_stop():
+        input_vals.extend(inputs[0] for inputs in sess.run(batch)["inputs"])
+    self.assertEqual(sorted(list(range(30)) * 2), sorted(input_vals))
+
+  def testTokenBatch(self):
+    batch = self.dataflow.get_token_batch(40, mode='eval', seed=1)
+    input_vals = []
+    with tf.train.MonitoredSession() as sess:
+      while not sess.should_stop():
+        batch_inputs = sess.run(batch)["inputs"]
+        batch_size, max_len = batch_inputs.shape
+        self.assertTrue(batch_size == 1 or batch_size * max_len <= 40)
+        input_vals.extend(inputs[0] for inputs in batch_inputs)
+    self.assertEqual(list(range(30)), sorted(input_vals))
+    self.assertGreater(self.dataflow.batching_stats.summary()['tokens'], 0)
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -276,6 +276,56 @@ class ClassifierMetricsTest(tf.test.TestCase):
 
     self.assertAllClose(actual_tsp, expected_tsp, 0.01)
 
+  def test_activation_statistics_value(self):
+    """Test that streamed statistics match the full batch mean and covariance."""
+    np.random.seed(0)
+    activations = np.float32(np.random.randn(300, 16) * 3 + 10)
+    stats = gan_metrics.ActivationStatistics()
+    for start in range(0, 300, 64):
+      stats.update(activations[start:start + 64])
+
+    self.assertEqual(300, stats.count)
+    self.assertAllClose(np.mean(activations, axis=0), stats.mean)
+    self.assertAllClose(np.cov(activations, rowvar=False), stats.cov)
+
+    filename = os.path.join(tempfile.mkdtemp(), 'stats.npz')
+    stats.save(filename)
+    loaded = gan_metrics.ActivationStatistics.load(filename)
+    self.assertEqual(stats.count, loaded.count)
+    self.assertAllClose(stats.cov, loaded.cov)
+
+  def test_streaming_frechet_distance_value(self):
+    """Test that the streaming FID matches `_expected_fid`."""
+    np.random.seed(0)
+    test_pool_real_a = np.float32(np.random.randn(512, 256))
+    test_pool_gen_a = np.float32(np.random.randn(512, 256))
+    cache_dir = tempfile.mkdtemp()
+
+    evaluator = gan_metrics.StreamingClassifierEvaluator(
+        lambda x: x, image_shape=[None, 256], cache_dir=cache_dir)
+    with self.test_session() as sess:
+      reference = evaluator.reference_statistics(sess, 'real', 'identity',
+                                                 np.split(test_pool_real_a, 4))
+      actual_fid = evaluator.frechet_distance(sess, reference, np.split(test_pool_gen_a, 8))
+
+    self.assertTrue(os.path.exists(evaluator.reference_filename('real', 'identity')))
+    self.assertAllClose(_expected_fid(test_pool_real_a, test_pool_gen_a), actual_fid, 0.0001)
+
+    # A cache hit does not read the batches.
+    with self.test_session() as sess:
+      cached = evaluator.reference_statistics(sess, 'real', 'identity', batches=None)
+    self.assertAllClose(reference.cov, cached.cov)
+
+  def test_streaming_classifier_score_value(self):
+    """Test that the streaming classifier score matches the inception score."""
+    np.random.seed(0)
+    logits = np.random.randn(90, 10)
+    evaluator = gan_metrics.StreamingClassifierEvaluator(lambda x: x, image_shape=[None, 10])
+    with self.test_session() as sess:
+      score = evaluator.classifier_score(sess, np.split(logits, 3))
+
+    self.assertAllClose(_expected_inception_score(logits), score)
+
   def test_preprocess_image_graph(self):
     """Test `preprocess_image` graph construction."""
     incorrectly_sized_image = tf.zeros([520, 240, 3])
@@ -0,0 +1,112 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+from tefla.core import grad_reduce
+
+NUM_TOWERS = 3
+
+
+class GradReduceTest(tf.test.TestCase):
+
+  def _tower_grads(self):
+    w = tf.get_variable('w', initializer=np.ones((4, 3), np.float32))
+    b = tf.get_variable('b', initializer=np.ones(3, np.float32))
+    emb = tf.get_variable('emb', initializer=np.ones((10, 3), np.float32))
+    unused = tf.get_variable('unused', initializer=np.ones(2, np.float32))
+    var_list = [w, b, emb, unused]
+    tower_grads = []
+    for i in range(NUM_TOWERS):
+      with tf.device('/cpu:%d' % i):
+        x = tf.constant(np.arange(8, dtype=np.float32).reshape(2, 4) * (i + 1))
+        ids = tf.constant([i, 2 * i])
+        loss = tf.reduce_sum(tf.matmul(x, w) + b) + tf.reduce_sum(tf.gather(emb, ids) * (i + 1))
+        tower_grads.append(tf.train.GradientDescentOptimizer(0.1).compute_gradients(
+            loss, var_list))
+    return var_list, tower_grads
+
+  def _expected(self, sess, tower_grads):
+    expected = []
+    for grad_and_vars in zip(*tower_grads):
+      grads = [g for g, _ in grad_and_vars]
+      if grads[0] is None:
+        expected.append(None)
+      else:
+        dense = [tf.convert_to_tensor(g) for g in grads]
+        expected.append(np.mean(sess.run(dense), axis=0))
+    return expected
+
+  def _check(self, method, bucket_size_mb):
+    config = tf.ConfigProto(device_count={'CPU': NUM_TOWERS})
+    with tf.Graph().as_default():
+      var_list, tower_grads = self._tower_grads()
+      average_grads = grad_reduce.average_gradients(
+          tower_grads, method=method, bucket_size_mb=bucket_size_mb)
+      self.assertEqual(var_list, [v for _, v in average_grads])
+      self.assertIsNone(average_grads[3][0])
+      self.assertIsInstance(average_grads[2][0], tf.IndexedSlices)
+      with self.test_session(config=config) as sess:
+        sess.run(tf.global_variables_initializer())
+        expected = self._expected(sess, tower_grads)
+        for (grad, _), value in zip(average_grads[:3], expected):
+          self.assertAllClose(value, sess.run(tf.convert_to_tensor(grad)))
+
+  def test_add_n(self):
+    self._check('add_n', 32)
+
+  def test_add_n_small_buckets(self):
+    self._check('add_n', 1e-5)
+
+  def test_concat(self):
+    self._check('concat', 32)
+
+  def test_nccl_fallback(self):
+    self._check('nccl', 32)
+
+  def test_nccl_all_outputs_run(self):
+    outputs = []
+
+    def all_sum(flats):
+      total = tf.add_n(flats)
+      sums = [tf.identity(total, name='nccl_out_%d' % i) for i in range(len(flats))]
+      outputs.extend(sums)
+      return sums
+
+    nccl_all_sum, is_gpu = grad_reduce._nccl_all_sum, grad_reduce._is_gpu
+    grad_reduce._nccl_all_sum, grad_reduce._is_gpu = lambda: all_sum, lambda device: True
+    try:
+      self._check('nccl', 32)
+      with tf.Graph().as_default():
+        _, tower_grads = self._tower_grads()
+        del outputs[:]
+        average_grads = grad_reduce.average_gradients(tower_grads, method='nccl')
+    finally:
+      grad_reduce._nccl_all_sum, grad_reduce._is_gpu = nccl_all_sum, is_gpu
+    # every output of the collective is run to compute the averaged gradients
+    ancestors, stack = set(), [average_grads[0][0].op]
+    while stack:
+      op = stack.pop()
+      if op not in ancestors:
+        ancestors.add(op)
+        stack.extend(t.op for t in op.inputs)
+        stack.extend(op.control_inputs)
+    self.assertEqual(NUM_TOWERS, len(outputs))
+    for output in outputs:
+      self.assertIn(output.op, ancestors)
+
+  def test_buckets(self):
+    grads_and_vars = [(tf.zeros([256]), None), (tf.zeros([256]), None),
+                      (tf.zeros([4], tf.float64), None), (tf.zeros([300]), None)]
+    self.assertEqual([[0, 1], [2], [3]], grad_reduce._buckets(grads_and_vars, 2048))
+    self.assertEqual([[0], [1], [2], [3]], grad_reduce._buckets(grads_and_vars, 1024))
+
+  def test_single_tower(self):
+    grads_and_vars = [(tf.zeros([2]), None)]
+    self.assertEqual(grads_and_vars, grad_reduce.average_gradients([grads_and_vars]))
+
+
+if __name__ == '__main__':
+  tf.test.main()
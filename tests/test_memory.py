@@ -0,0 +1,59 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+from tefla.core.memory import LSHMemory
+
+
+def normalized(rng, n, dim):
+  keys = rng.randn(n, dim).astype(np.float32)
+  return keys / np.linalg.norm(keys, axis=1, keepdims=True)
+
+
+class LSHMemoryTest(tf.test.TestCase):
+
+  def test_lookup(self):
+    rng = np.random.RandomState(0)
+    keys = normalized(rng, 64, 8)
+    with tf.Graph().as_default():
+      memory = LSHMemory(8, 64, 10, choose_k=8, num_hashes=2, num_per_hash_slot=64)
+      self.assertGreaterEqual(memory.num_libraries * memory.num_per_hash_slot, memory.choose_k)
+      set_op = memory.set(keys, np.arange(64, dtype=np.int32) % 10, np.zeros(64, np.float32))
+      query = tf.placeholder(tf.float32, (None, 8))
+      hint_pool_idxs = memory.get_hint_pool_idxs(query)
+      with self.test_session() as sess:
+        sess.run(tf.global_variables_initializer())
+        sess.run(set_op)
+        idxs = sess.run(hint_pool_idxs, {query: keys[:16]})
+        self.assertEqual((16, memory.choose_k), idxs.shape)
+        # a key is in its own buckets and is its nearest neighbour
+        self.assertAllEqual(np.arange(16), idxs[:, 0])
+
+  def test_update_maintains_index(self):
+    rng = np.random.RandomState(1)
+    keys = normalized(rng, 32, 8)
+    new_keys = normalized(rng, 4, 8)
+    with tf.Graph().as_default():
+      memory = LSHMemory(8, 32, 10, choose_k=4, num_hashes=1, num_per_hash_slot=40)
+      set_op = memory.set(keys, np.zeros(32, np.int32), np.zeros(32, np.float32))
+      upd_idxs = tf.constant([3, 5, 7, 9])
+      update_op = memory.make_update_op(upd_idxs, tf.constant(new_keys),
+                                        tf.constant([1, 2, 3, 4]), 4, False, None)
+      query = tf.placeholder(tf.float32, (None, 8))
+      hint_pool_idxs = memory.get_hint_pool_idxs(query)
+      with self.test_session() as sess:
+        sess.run(tf.global_variables_initializer())
+        sess.run(set_op)
+        sess.run(update_op)
+        self.assertAllEqual([3, 5, 7, 9], sess.run(hint_pool_idxs, {query: new_keys})[:, 0])
+        new_slot_idxs = sess.run(memory.get_hash_slots(tf.constant(new_keys)))
+        for i in range(memory.num_libraries):
+          self.assertAllEqual(new_slot_idxs[i], sess.run(memory.mem_hashes[i])[[3, 5, 7, 9]])
+          self.assertEqual(36, np.sum(sess.run(memory.hash_slot_ptrs[i])))
+
+
+if __name__ == '__main__':
+  tf.test.main()
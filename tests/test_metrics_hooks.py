@@ -125,6 +125,41 @@ class MetricsHookTest(tf.test.TestCase):
         for _ in range(30):
           sess.run(incr_global_step)
 
+  def testEarlyStoppingHookWithMetricTensor(self):
+    global_step = tf.train.create_global_step()
+    counter = tf.get_variable("count", initializer=0, dtype=tf.int32)
+    incr_global_step = tf.assign_add(global_step, 1)
+    incr_counter = tf.assign_add(counter, 1)
+
+    stop_hook = metrics_hook.EarlyStoppingHook(
+        None,
+        "count",
+        num_plateau_steps=20,
+        plateau_delta=1.,
+        plateau_decrease=False,
+        every_n_steps=10,
+        metric_tensor=counter)
+    with tf.train.MonitoredTrainingSession(hooks=[stop_hook]) as sess:
+      for _ in range(50):
+        sess.run((incr_global_step, incr_counter))
+
+      # Check that we ask for stop once the counter is not incremented
+      with self.assertRaisesRegexp(RuntimeError, "after should_stop requested"):
+        for _ in range(40):
+          sess.run(incr_global_step)
+
+  def testScalarSeries(self):
+    series = metrics_hook.ScalarSeries(capacity=2)
+    for step in range(5):
+      series.append(step, 0.5 * step)
+    self.assertEqual(5, len(series))
+    self.assertAllEqual([0, 1, 2, 3, 4], series.steps)
+    self.assertAllClose([0., 0.5, 1., 1.5, 2.], series.values)
+    self.assertTrue(metrics_hook.has_metric_plateaued(series.steps, series.values, 2, delta=1.))
+    self.assertFalse(
+        metrics_hook.has_metric_plateaued(
+            series.steps, series.values, 2, delta=1., decrease=False))
+
   def testPlateauOpHook(self):
     global_step = tf.train.create_global_step()
     counter = tf.get_variable("count", initializer=0, dtype=tf.int32)
@@ -0,0 +1,74 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+from tefla.core import mixed_precision
+from tefla.core.layers import batch_norm_tf, fully_connected
+
+
+def model(inputs, is_training, reuse, num_classes=2):
+  x = fully_connected(inputs, 4, is_training, reuse, name='fc1')
+  x = batch_norm_tf(x, is_training=is_training, reuse=reuse, scale=True)
+  logits = fully_connected(x, num_classes, is_training, reuse, name='logits')
+  return {'logits': logits, 'predictions': tf.nn.softmax(logits)}
+
+
+class MixedPrecisionTest(tf.test.TestCase):
+
+  def test_mixed_precision_model(self):
+    with tf.Graph().as_default():
+      inputs = tf.constant(np.random.RandomState(0).rand(8, 3), tf.float32)
+      end_points = mixed_precision.mixed_precision_model(model)(inputs, True, None)
+      self.assertEqual(tf.float32, end_points['logits'].dtype)
+      self.assertEqual(tf.float32, end_points['predictions'].dtype)
+      for var in tf.global_variables():
+        self.assertEqual(tf.float32, var.dtype.base_dtype)
+      self.assertEqual(tf.float16, tf.get_default_graph().get_tensor_by_name(
+          'fc1/MatMul:0').dtype)
+      loss = tf.reduce_sum(end_points['logits'])
+      grads = tf.gradients(loss, tf.trainable_variables())
+      for grad in grads:
+        self.assertEqual(tf.float32, grad.dtype)
+      with self.test_session() as sess:
+        sess.run(tf.global_variables_initializer())
+        self.assertTrue(np.all(np.isfinite(sess.run(grads[0]))))
+
+  def test_static_loss_scale(self):
+    with tf.Graph().as_default():
+      w = tf.get_variable('w', initializer=np.ones(3, np.float32))
+      loss = tf.reduce_sum(tf.square(w))
+      opt = mixed_precision.LossScaleOptimizer(
+          tf.train.GradientDescentOptimizer(0.1), loss_scale=128.0)
+      grads_and_vars = opt.compute_gradients(loss, [w])
+      train_op = opt.apply_gradients(grads_and_vars)
+      with self.test_session() as sess:
+        sess.run(tf.global_variables_initializer())
+        self.assertAllClose([2.0] * 3, sess.run(grads_and_vars[0][0]))
+        sess.run(train_op)
+        self.assertAllClose([0.8] * 3, sess.run(w))
+
+  def test_dynamic_loss_scale(self):
+    with tf.Graph().as_default():
+      x = tf.placeholder(tf.float32, (3,))
+      w = tf.get_variable('w', initializer=np.ones(3, np.float32))
+      loss = tf.reduce_sum(w * x)
+      opt = mixed_precision.LossScaleOptimizer(
+          tf.train.GradientDescentOptimizer(1.0), init_loss_scale=8.0, incr_every_n_steps=2)
+      train_op = opt.apply_gradients(opt.compute_gradients(loss, [w]))
+      with self.test_session() as sess:
+        sess.run(tf.global_variables_initializer())
+        sess.run(train_op, {x: [1, np.inf, 0]})
+        self.assertAllClose([1, 1, 1], sess.run(w))
+        self.assertEqual(4.0, sess.run(opt.loss_scale))
+        sess.run(train_op, {x: [1, 0, 0]})
+        self.assertEqual(4.0, sess.run(opt.loss_scale))
+        sess.run(train_op, {x: [0, 1, 0]})
+        self.assertAllClose([0, 0, 1], sess.run(w))
+        self.assertEqual(8.0, sess.run(opt.loss_scale))
+
+
+if __name__ == '__main__':
+  tf.test.main()
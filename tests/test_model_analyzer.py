@@ -0,0 +1,52 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+from tefla.core import model_analyzer
+
+
+def model(inputs):
+  with tf.variable_scope('conv1'):
+    w = tf.get_variable('W', [3, 3, 3, 4])
+    x = tf.nn.relu(tf.nn.conv2d(inputs, w, [1, 1, 1, 1], 'SAME'))
+  with tf.variable_scope('logits'):
+    w = tf.get_variable('W', [8 * 8 * 4, 10])
+    return tf.matmul(tf.reshape(x, [-1, 8 * 8 * 4]), w)
+
+
+class ModelAnalyzerTest(tf.test.TestCase):
+
+  def test_flops(self):
+    with tf.Graph().as_default() as graph:
+      inputs = tf.placeholder(tf.float32, (None, 8, 8, 3))
+      logits = model(inputs)
+      total_flops, layers = model_analyzer.analyze_flops(graph, batch_size=2, fetches=[logits])
+      conv_flops = 2 * (2 * 8 * 8 * 4) * (3 * 3 * 3)
+      relu_flops = 2 * 8 * 8 * 4
+      self.assertEqual((conv_flops + relu_flops, 0), layers['conv1'])
+      self.assertEqual((2 * 2 * 256 * 10, 0), layers['logits'])
+      self.assertEqual(conv_flops + relu_flops + 2 * 2 * 256 * 10, total_flops)
+
+      loss = tf.reduce_sum(logits)
+      train_op = tf.train.GradientDescentOptimizer(0.1).minimize(loss)
+      _, layers = model_analyzer.analyze_flops(graph, batch_size=2, fetches=[train_op])
+      # gradients of the inputs and the weights of the matmul
+      self.assertEqual(2 * 2 * 2 * 256 * 10, layers['logits'][1])
+      self.assertGreaterEqual(layers['conv1'][1], conv_flops)
+
+  def test_peak_memory(self):
+    with tf.Graph().as_default() as graph:
+      inputs = tf.placeholder(tf.float32, (None, 8, 8, 3))
+      logits = model(inputs)
+      peak_bytes, peak_op = model_analyzer.analyze_memory(graph, batch_size=2, fetches=[logits])
+      # the conv output and the relu output are live together
+      self.assertEqual(2 * (2 * 8 * 8 * 4 * 4), peak_bytes)
+      self.assertEqual('conv1/Relu', peak_op)
+      peak_bytes_4, _ = model_analyzer.analyze_memory(graph, batch_size=4, fetches=[logits])
+      self.assertEqual(2 * peak_bytes, peak_bytes_4)
+
+
+if __name__ == '__main__':
+  tf.test.main()
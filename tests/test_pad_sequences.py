@@ -0,0 +1,66 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+from tefla.utils import util
+
+
+def loop_pad_sequences(sequences, maxlen, dtype, padding, truncating, value):
+  x = np.full((len(sequences), maxlen), value, dtype=dtype)
+  for idx, s in enumerate(sequences):
+    if len(s) == 0:
+      continue
+    trunc = s[-maxlen:] if truncating == 'pre' else s[:maxlen]
+    if padding == 'post':
+      x[idx, :len(trunc)] = trunc
+    else:
+      x[idx, -len(trunc):] = trunc
+  return x
+
+
+class PadSequencesTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(PadSequencesTest, self).setUp()
+    rng = np.random.RandomState(0)
+    self.sequences = [list(rng.randint(1, 100, rng.randint(0, 20))) for _ in range(100)]
+
+  def test_pad_sequences(self):
+    for maxlen in [None, 5]:
+      for padding in ['pre', 'post']:
+        for truncating in ['pre', 'post']:
+          for dtype, value in [('int32', 0), ('float32', -1.5)]:
+            x = util.pad_sequences(self.sequences, maxlen, dtype, padding, truncating, value)
+            expected = loop_pad_sequences(self.sequences, maxlen or 19, dtype, padding,
+                                          truncating, value)
+            self.assertEqual(np.dtype(dtype), x.dtype)
+            self.assertAllEqual(expected, x)
+
+  def test_invalid_padding(self):
+    with self.assertRaises(ValueError):
+      util.pad_sequences(self.sequences, padding='middle')
+
+  def test_non_scalar_elements(self):
+    with self.assertRaises(ValueError):
+      util.pad_sequences([[[1, 2], [3, 4]], [[5, 6]]])
+    with self.assertRaises(ValueError):
+      util.pad_sequences([np.ones((2, 2)), np.ones((1, 2))], dtype='float32')
+
+  def test_bucket_pad_sequences(self):
+    batches = util.bucket_pad_sequences(self.sequences, 16, shuffle=True, seed=0)
+    indices = np.concatenate([idx for idx, _ in batches])
+    self.assertAllEqual(np.arange(len(self.sequences)), np.sort(indices))
+    for idx, x in batches:
+      self.assertEqual(max(len(self.sequences[i]) for i in idx), x.shape[1])
+      self.assertAllEqual(util.pad_sequences([self.sequences[i] for i in idx], x.shape[1]), x)
+    lengths = [len(s) for s in self.sequences]
+    self.assertLess(
+        util.padding_overhead(lengths, [x.shape for _, x in batches]),
+        util.padding_overhead(lengths, [(len(lengths), max(lengths))]))
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,132 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+from tefla.core.optimizer import (AmortizedAccountant, AmortizedGaussianSanitizer, ClipOption,
+                                  Conv2DPXG, DPGradientDescentOptimizer, PerExampleGradients)
+
+BATCH_SIZE = 4
+
+
+def model(images):
+  """Conv, bias, depthwise conv, scale, fully connected and bias model,
+  returning its parameters and the per-example losses."""
+  rng = np.random.RandomState(0)
+
+  def variable(name, shape):
+    return tf.get_variable(name, initializer=rng.randn(*shape).astype(np.float32) * 0.1)
+
+  conv_w = variable('conv_w', (3, 3, 2, 4))
+  conv_b = variable('conv_b', (4,))
+  dw_w = variable('dw_w', (3, 3, 4, 2))
+  gamma = variable('gamma', (1, 1, 8))
+  fc_w = variable('fc_w', (8 * 3 * 3, 3))
+  fc_b = variable('fc_b', (3,))
+  x = tf.nn.conv2d(images, conv_w, [1, 1, 1, 1], 'SAME')
+  x = tf.nn.relu(tf.nn.bias_add(x, conv_b))
+  x = tf.nn.depthwise_conv2d(x, dw_w, [1, 2, 2, 1], 'SAME')
+  x = tf.multiply(x, gamma)
+  x = tf.reshape(x, [BATCH_SIZE, -1])
+  logits = tf.matmul(x, fc_w) + fc_b
+  losses = tf.reduce_sum(tf.square(logits), 1)
+  return [conv_w, conv_b, dw_w, gamma, fc_w, fc_b], losses
+
+
+class PerExampleGradientsTest(tf.test.TestCase):
+
+  def test_per_example_gradients(self):
+    images = np.random.RandomState(1).rand(BATCH_SIZE, 6, 6, 2).astype(np.float32)
+    with tf.Graph().as_default():
+      params, losses = model(tf.constant(images))
+      px_grads = PerExampleGradients(tf.reduce_sum(losses), params)
+      expected = [tf.gradients(losses[b], params) for b in range(BATCH_SIZE)]
+      with self.test_session() as sess:
+        sess.run(tf.global_variables_initializer())
+        px_grads, expected = sess.run([px_grads, expected])
+      for i, param in enumerate(params):
+        self.assertEqual([BATCH_SIZE] + param.get_shape().as_list(), list(px_grads[i].shape))
+        for b in range(BATCH_SIZE):
+          self.assertAllClose(expected[b][i], px_grads[i][b], rtol=1e-4, atol=1e-5)
+
+  def test_conv2d_nchw(self):
+    rng = np.random.RandomState(5)
+    images = rng.rand(BATCH_SIZE, 2, 7, 7).astype(np.float32)
+    for strides, dilations in [([1, 1, 2, 2], [1, 1, 1, 1]), ([1, 1, 1, 1], [1, 1, 2, 2])]:
+      with tf.Graph().as_default():
+        w = tf.constant(rng.randn(3, 3, 2, 4).astype(np.float32))
+        # the NCHW convolution is not run, CPUs have no NCHW Conv2D kernel
+        conv = tf.nn.conv2d(
+            tf.constant(images), w, strides, 'SAME', data_format='NCHW', dilations=dilations)
+        z_grads = rng.randn(*conv.get_shape().as_list()).astype(np.float32)
+        px_grads = Conv2DPXG(conv.op)(w, [tf.constant(z_grads)])
+        nhwc = [0, 2, 3, 1]
+        expected = []
+        for b in range(BATCH_SIZE):
+          conv_b = tf.nn.conv2d(
+              tf.constant(images[b:b + 1].transpose(nhwc)),
+              w, [strides[i] for i in nhwc],
+              'SAME',
+              dilations=[dilations[i] for i in nhwc])
+          expected.append(
+              tf.gradients(tf.reduce_sum(conv_b * z_grads[b:b + 1].transpose(nhwc)), w)[0])
+        with self.test_session() as sess:
+          px_grads, expected = sess.run([px_grads, expected])
+        self.assertAllClose(np.stack(expected), px_grads, rtol=1e-4, atol=1e-5)
+
+  def test_shared_weights(self):
+    with tf.Graph().as_default():
+      x = tf.constant(np.random.RandomState(2).rand(BATCH_SIZE, 3), tf.float32)
+      w = tf.get_variable('w', initializer=np.ones((3, 3), np.float32))
+      losses = tf.reduce_sum(tf.matmul(tf.matmul(x, w), w), 1)
+      px_grad, = PerExampleGradients(tf.reduce_sum(losses), [w])
+      expected = [tf.gradients(losses[b], w)[0] for b in range(BATCH_SIZE)]
+      with self.test_session() as sess:
+        sess.run(tf.global_variables_initializer())
+        px_grad, expected = sess.run([px_grad, expected])
+      self.assertAllClose(np.stack(expected), px_grad)
+
+  def test_microbatches(self):
+
+    class SumSanitizer(object):
+
+      def sanitize(self, x, *args, **kwargs):
+        return tf.reduce_sum(x, 0)
+
+    images = np.random.RandomState(3).rand(BATCH_SIZE, 6, 6, 2).astype(np.float32)
+    with tf.Graph().as_default():
+      params, losses = model(tf.constant(images))
+      opt = DPGradientDescentOptimizer(
+          0.1, (1.0, 1e-5), SumSanitizer(), sigma=1.0, num_microbatches=2)
+      grads = opt.compute_sanitized_gradients(tf.reduce_sum(losses), params)
+      # sum over the micro-batches of their mean gradient
+      expected = tf.gradients(tf.reduce_sum(losses) / 2, params)
+      with self.test_session() as sess:
+        sess.run(tf.global_variables_initializer())
+        self.assertAllClose(sess.run(expected), sess.run(grads), rtol=1e-4, atol=1e-5)
+
+  def test_microbatches_privacy_spending(self):
+    eps, delta, total_examples = 1.0, 1e-5, 100
+    images = np.random.RandomState(4).rand(BATCH_SIZE, 6, 6, 2).astype(np.float32)
+    for num_microbatches in [None, 2]:
+      with tf.Graph().as_default():
+        params, losses = model(tf.constant(images))
+        accountant = AmortizedAccountant(total_examples)
+        sanitizer = AmortizedGaussianSanitizer(accountant, ClipOption(1.0, True))
+        opt = DPGradientDescentOptimizer(
+            0.1, (eps, delta), sanitizer, sigma=1.0, num_microbatches=num_microbatches)
+        grads = opt.compute_sanitized_gradients(tf.reduce_sum(losses), params)
+        with self.test_session() as sess:
+          sess.run(tf.global_variables_initializer())
+          sess.run(grads)
+          eps_spent, delta_spent = accountant.get_privacy_spent(sess)
+      # one amortized spending per sanitized variable, sampling BATCH_SIZE examples
+      ratio = BATCH_SIZE / total_examples
+      self.assertAllClose(len(params) * np.log(1 + ratio * (np.exp(eps) - 1)), eps_spent)
+      self.assertAllClose(len(params) * ratio * delta, delta_spent)
+
+
+if __name__ == '__main__':
+  tf.test.main()
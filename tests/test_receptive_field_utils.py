@@ -211,6 +211,31 @@ class GraphComputeOrderTest(test.TestCase):
     }
     self.check_topological_sort_and_sizes(node_info, expected_input_sizes, expected_output_sizes)
 
+  def testDeepGraphOrder(self):
+    """Tests a graph deeper than the recursion limit."""
+    g = tf.Graph()
+    with g.as_default():
+      x = tf.placeholder(dtypes.float32, (None, None, None, 1), name='input_image')
+      for i in range(3000):
+        x = tf.nn.relu(x, name='relu_%d' % i)
+    node_info, _ = receptive_field.get_compute_order(
+        g.as_graph_def(), input_node_name='input_image', input_node_size=[8, 8])
+    self.assertEqual(3000, node_info['relu_2999'].order)
+    self.assertEqual([8, 8], node_info['relu_2999'].output_size)
+
+  def testComputeOrderIsCached(self):
+    """Tests that the traversals are cached by graph content."""
+    g = create_test_network()[0]
+    node_info, name_to_node = receptive_field.get_compute_order(g.as_graph_def())
+    node_info_2, name_to_node_2 = receptive_field.get_compute_order(g.as_graph_def())
+    self.assertIs(node_info, node_info_2)
+    self.assertIs(name_to_node, name_to_node_2)
+    node_info_3, name_to_node_3 = receptive_field.get_compute_order(
+        g.as_graph_def(), input_node_name='input_image', input_node_size=[224, 224])
+    self.assertIsNot(node_info, node_info_3)
+    self.assertIs(name_to_node, name_to_node_3)
+    self.assertEqual([56, 56], node_info_3['L1/Conv2D'].output_size)
+
 
 if __name__ == '__main__':
   test.main()
@@ -0,0 +1,74 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import tempfile
+
+import numpy as np
+import tensorflow as tf
+
+from tefla.core import restore_ops
+
+
+class RestoreOpsTest(tf.test.TestCase):
+
+  def _save_checkpoint(self):
+    checkpoint = os.path.join(tempfile.mkdtemp(), 'model.ckpt')
+    with tf.Graph().as_default():
+      with tf.variable_scope('teacher'):
+        tf.get_variable('w', initializer=np.arange(6, dtype=np.float32).reshape(2, 3))
+        tf.get_variable('b', initializer=np.ones(3, dtype=np.float32))
+        tf.get_variable('head', initializer=np.ones(4, dtype=np.float32))
+      with self.test_session() as sess:
+        sess.run(tf.global_variables_initializer())
+        tf.train.Saver().save(sess, checkpoint)
+    return checkpoint
+
+  def test_plan_restore(self):
+    checkpoint = self._save_checkpoint()
+    with tf.Graph().as_default():
+      w = tf.get_variable('teacher/w', shape=[2, 3])
+      tf.get_variable('teacher/head', shape=[5])
+      tf.get_variable('teacher/extra', shape=[1])
+      plan = restore_ops.plan_restore(checkpoint)
+    self.assertEqual({'teacher/w': w}, plan.var_list)
+    skipped = dict(plan.skipped)
+    self.assertTrue(skipped['teacher/head'].startswith(restore_ops.SKIP_SHAPE_MISMATCH))
+    self.assertEqual(restore_ops.SKIP_NOT_IN_CHECKPOINT, skipped['teacher/extra'])
+    self.assertEqual(restore_ops.SKIP_NOT_IN_MODEL, skipped['teacher/b'])
+
+  def test_restore_partial_with_rules(self):
+    checkpoint = self._save_checkpoint()
+    with tf.Graph().as_default():
+      with tf.variable_scope('student'):
+        w = tf.get_variable('w', shape=[2, 3], initializer=tf.zeros_initializer())
+        b = tf.get_variable('b', shape=[3], initializer=tf.zeros_initializer())
+        head = tf.get_variable('head', shape=[5], initializer=tf.zeros_initializer())
+      with self.test_session() as sess:
+        sess.run(tf.global_variables_initializer())
+        plan = restore_ops.restore_partial(sess, checkpoint, rules=[('^student/', 'teacher/')])
+        self.assertEqual(2, len(plan.var_list))
+        self.assertAllEqual(np.arange(6).reshape(2, 3), sess.run(w))
+        self.assertAllEqual(np.ones(3), sess.run(b))
+        self.assertAllEqual(np.zeros(5), sess.run(head))
+
+  def test_plan_restore_name_collision(self):
+    checkpoint = self._save_checkpoint()
+    with tf.Graph().as_default():
+      w0 = tf.get_variable('tower_0/teacher/w', shape=[2, 3])
+      tf.get_variable('tower_1/teacher/w', shape=[2, 3])
+      plan = restore_ops.plan_restore(checkpoint, rules=[('^tower_[0-9]+/', '')])
+    self.assertEqual({'teacher/w': w0}, plan.var_list)
+    skipped = dict(plan.skipped)
+    self.assertTrue(skipped['tower_1/teacher/w'].startswith(restore_ops.SKIP_DUPLICATE))
+    self.assertIn('tower_0/teacher/w', skipped['tower_1/teacher/w'])
+
+  def test_checkpoint_name(self):
+    rules = [('^tower_0/', ''), ('/kernel$', '/weights')]
+    self.assertEqual('conv1/weights', restore_ops.checkpoint_name('tower_0/conv1/kernel', rules))
+    self.assertEqual('conv1/b', restore_ops.checkpoint_name('conv1/b', rules))
+
+
+if __name__ == '__main__':
+  tf.test.main()
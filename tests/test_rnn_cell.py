@@ -360,6 +360,48 @@ class RNN_CellTest(tf.test.TestCase):
       self.assertEqual(res_[1][0].shape, (1, 2))
       self.assertEqual(res_[1][1].shape, (1, 2))
 
+  def _lstm_graph(self, num_steps, unroll):
+    with tf.Graph().as_default() as graph:
+      inputs = tf.placeholder(tf.float32, [2, num_steps, 3])
+      outputs = rnn_cell.lstm(
+          inputs, 4, None, True, unroll=unroll, layer_norm=rnn_cell.layer_norm)
+      tf.gradients(outputs, tf.trainable_variables())
+    return graph
+
+  def testLSTMLoopGraphSize(self):
+    loop_sizes = [len(self._lstm_graph(n, False).get_operations()) for n in (5, 50)]
+    self.assertEqual(loop_sizes[0], loop_sizes[1])
+    unrolled_sizes = [len(self._lstm_graph(n, True).get_operations()) for n in (5, 50)]
+    self.assertLess(unrolled_sizes[0], unrolled_sizes[1])
+
+  def testLSTMLoopMatchesUnrolled(self):
+    x = np.random.RandomState(0).rand(2, 6, 3).astype(np.float32) + 0.1
+    with tf.Graph().as_default():
+      inputs = tf.constant(x)
+      unrolled = rnn_cell.lstm(
+          inputs, 4, None, True, return_seq=True, unroll=True, layer_norm=rnn_cell.layer_norm)
+      loop = rnn_cell.lstm(
+          inputs, 4, True, True, return_seq=True, unroll=False, layer_norm=rnn_cell.layer_norm)
+      last = rnn_cell.lstm(inputs, 4, True, True, unroll=False, layer_norm=rnn_cell.layer_norm)
+      with self.test_session() as sess:
+        sess.run(tf.global_variables_initializer())
+        unrolled, loop, last = sess.run([tf.stack(unrolled, axis=1), loop, last])
+    self.assertEqual((2, 6, 4), loop.shape)
+    self.assertAllClose(unrolled, loop)
+    self.assertAllClose(loop[:, -1], last)
+
+  def testGateLayerNorm(self):
+    x = np.random.RandomState(0).randn(3, 8).astype(np.float32)
+    with tf.Graph().as_default():
+      output = rnn_cell.gate_layer_norm(tf.constant(x), 2, None, epsilon=1e-6)
+      with self.test_session() as sess:
+        sess.run(tf.global_variables_initializer())
+        output = sess.run(output)
+    expected = np.concatenate(
+        [(g - g.mean(1, keepdims=True)) / np.sqrt(g.var(1, keepdims=True) + 1e-6)
+         for g in np.split(x, 2, axis=1)], 1)
+    self.assertAllClose(expected, output, atol=1e-5)
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -0,0 +1,67 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from tefla.utils import seq2seq_utils
+
+
+class Seq2SeqDataTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(Seq2SeqDataTest, self).setUp()
+    rng = np.random.RandomState(0)
+    words = [b'w%d' % i for i in range(50)] + [b'a1', b'b22']
+    self.data_path = os.path.join(self.get_temp_dir(), 'data')
+    with open(self.data_path, 'wb') as f:
+      for _ in range(200):
+        n = rng.randint(0, 8)
+        f.write(b' '.join(words[j] for j in rng.randint(0, len(words), n)) + b'\n')
+
+  def test_count_tokens_workers(self):
+    counts = seq2seq_utils.count_tokens(self.data_path)
+    self.assertEqual(counts,
+                     seq2seq_utils.count_tokens(self.data_path, num_workers=2, chunk_size=64))
+
+  def test_binary_token_ids(self):
+    vocab_path = os.path.join(self.get_temp_dir(), 'vocab')
+    ids_path = os.path.join(self.get_temp_dir(), 'ids')
+    seq2seq_utils.create_vocabulary(vocab_path, self.data_path, 30)
+    seq2seq_utils.data_to_token_ids(self.data_path, ids_path, vocab_path)
+    with open(ids_path) as f:
+      expected = [[int(tok) for tok in line.split()] for line in f]
+    outputs = []
+    for num_workers, chunk_size in [(1, 1 << 20), (3, 50)]:
+      bin_path = os.path.join(self.get_temp_dir(), 'ids%d.bin' % chunk_size)
+      seq2seq_utils.data_to_token_ids_binary(
+          self.data_path, bin_path, vocab_path, num_workers=num_workers, chunk_size=chunk_size)
+      token_ids = seq2seq_utils.BinaryTokenIds(bin_path)
+      self.assertEqual(np.uint16, token_ids.ids.dtype)
+      self.assertEqual(len(expected), len(token_ids))
+      for sentence, expected_sentence in zip(token_ids, expected):
+        self.assertAllEqual(expected_sentence, sentence)
+      self.assertAllEqual([len(sentence) for sentence in expected], token_ids.lengths())
+      with open(bin_path, 'rb') as f:
+        outputs.append(f.read())
+    self.assertEqual(outputs[0], outputs[1])
+
+  def test_map_chunks_read_ahead(self):
+    started = []
+
+    def chunks():
+      for i in range(40):
+        started.append(i)
+        yield -i
+
+    for i, result in enumerate(seq2seq_utils._map_chunks(abs, chunks(), 3)):
+      self.assertEqual(i, result)
+      # at most 2 * num_workers chunks are in flight
+      self.assertLessEqual(len(started), i + 7)
+
+
+if __name__ == '__main__':
+  tf.test.main()
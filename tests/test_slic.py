@@ -0,0 +1,87 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import sys
+import tempfile
+
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+from skimage.measure import label
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tools'))
+import slic  # noqa: E402
+import sliclayer  # noqa: E402
+
+
+class SlicTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(SlicTest, self).setUp()
+    rng = np.random.RandomState(0)
+    self.image = rng.rand(24, 20, 3)
+    # blocky segments, with labels 3 and 7 unused
+    segments = rng.choice([0, 1, 2, 4, 5, 6, 8], size=(6, 5))
+    self.segments = np.kron(segments, np.ones((4, 4), dtype=segments.dtype))
+
+  def test_segment_statistics(self):
+    num_segments = 10
+    means, stds, maxs, mins = slic.segment_statistics(self.image, self.segments, num_segments)
+    for i in range(num_segments):
+      pixels = self.image[self.segments == i]
+      if not len(pixels):
+        pixels = np.zeros((1, 3))
+      self.assertAllClose(pixels.mean(0), means[i], atol=1e-5)
+      self.assertAllClose(pixels.std(0), stds[i], atol=1e-5)
+      self.assertAllClose(pixels.max(0), maxs[i], atol=1e-6)
+      self.assertAllClose(pixels.min(0), mins[i], atol=1e-6)
+
+  def test_filter_clusters(self):
+    num_clusters = 9
+    max_component_size, max_cluster_size = 40, 60
+    expected = np.zeros_like(self.segments)
+    for i in range(num_clusters):
+      components = label(self.segments == i, background=0, connectivity=1)
+      kept = np.zeros(self.segments.shape, dtype=bool)
+      for j in range(1, components.max() + 1):
+        if np.sum(components == j) <= max_component_size:
+          kept |= components == j
+      if np.sum(kept) <= max_cluster_size:
+        expected[kept] = i
+    self.assertAllEqual(expected,
+                        slic.filter_clusters(self.segments, num_clusters, max_component_size,
+                                             max_cluster_size))
+
+  def test_segment_means_and_pixels(self):
+    means = sliclayer.segment_means(self.image, self.segments)
+    pixels = sliclayer.segment_pixels(self.segments)
+    self.assertEqual(self.segments.max() + 1, len(means))
+    self.assertEqual(self.segments.max() + 1, len(pixels))
+    for i in range(self.segments.max() + 1):
+      rows, cols = np.where(self.segments == i)
+      self.assertAllEqual(rows, pixels[i][0])
+      self.assertAllEqual(cols, pixels[i][1])
+      if len(rows):
+        self.assertAllClose(self.image[rows, cols].mean(0), means[i])
+      else:
+        self.assertAllEqual(np.zeros(3), means[i])
+
+  def test_segment_directory(self):
+    image_dir, output_dir = tempfile.mkdtemp(), tempfile.mkdtemp()
+    rng = np.random.RandomState(1)
+    for name in ['a.png', 'b.png']:
+      Image.fromarray(rng.randint(0, 256, (40, 40, 3)).astype(np.uint8)).save(
+          os.path.join(image_dir, name))
+    with open(os.path.join(image_dir, 'notes.txt'), 'w') as f:
+      f.write('not an image')
+    self.assertEqual(2, slic.segment_directory(image_dir, output_dir, 20, 3, 32, num_workers=1))
+    for name in ['a', 'b']:
+      segment = np.load(os.path.join(output_dir, name + '_segments.npy'))
+      self.assertEqual((32, 32), segment.shape)
+      self.assertTrue(os.path.exists(os.path.join(output_dir, name + '_segments.png')))
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -0,0 +1,82 @@
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+from tefla.core.base import Base
+
+
+class TrainingStepTest(tf.test.TestCase):
+
+  def _build(self, stage_inputs):
+    learner = Base(None, {'staging_device': '/cpu:0'}, classification=False)
+    learner.inputs = tf.placeholder(tf.float32, (2, 3))
+    learner.labels = tf.placeholder(tf.float32, (2, 1))
+    if stage_inputs:
+      learner._stage_inputs()
+    num_updates = tf.get_variable('num_updates', initializer=0, trainable=False)
+    learner.update_ops = [tf.assign_add(num_updates, 1)]
+    learner.training_loss = tf.reduce_sum(learner.inputs) + tf.reduce_sum(learner.labels)
+    learner.train_op = tf.no_op()
+    return learner, num_updates
+
+  def _run_epoch(self, stage_inputs):
+    batches = [(np.full((2, 3), i, np.float32), np.full((2,), 10 * i, np.float32))
+               for i in range(4)]
+    with tf.Graph().as_default():
+      learner, num_updates = self._build(stage_inputs)
+      with self.test_session() as sess:
+        sess.run(tf.global_variables_initializer())
+        losses = []
+        for Xb, feed_dict in learner._training_feeds(sess, iter(batches)):
+          step = learner._run_training_step(sess, feed_dict)
+          self.assertAllEqual(np.sum(Xb) + 20 * Xb[0, 0], step['loss'])
+          losses.append(step['loss'])
+        self.assertEqual(len(batches), sess.run(num_updates))
+    return losses
+
+  def test_training_step(self):
+    self.assertAllEqual([0, 26, 52, 78], self._run_epoch(stage_inputs=False))
+
+  def test_staged_training_step(self):
+    self.assertAllEqual([0, 26, 52, 78], self._run_epoch(stage_inputs=True))
+
+  def test_integer_inputs(self):
+    with tf.Graph().as_default():
+      learner = Base(None, {})
+      learner.inputs = tf.placeholder(tf.uint8, (2, 3))
+      learner.labels = tf.placeholder(tf.float32, (2, 1))
+      raw = [(np.full((2, 3), 200, np.uint8), np.zeros((2,), np.float32))]
+      feeds = list(learner._training_feeds(None, iter(raw)))
+      self.assertEqual(np.uint8, feeds[0][1][learner.inputs].dtype)
+      standardized = [(np.full((2, 3), -0.5, np.float32), np.zeros((2,), np.float32))]
+      with self.assertRaises(ValueError):
+        list(learner._training_feeds(None, iter(standardized)))
+
+  def test_gradient_accumulation(self):
+    with tf.Graph().as_default():
+      learner = Base(None, {'accumulate_steps': 2})
+      x = tf.placeholder(tf.float32, (3,))
+      w = tf.get_variable('w', initializer=np.zeros(3, np.float32))
+      unused = tf.get_variable('unused', initializer=np.zeros(1, np.float32))
+      learner.training_loss = tf.reduce_sum(w * x)
+      learner.update_ops = None
+      optimizer = tf.train.GradientDescentOptimizer(1.0)
+      grads_and_vars = optimizer.compute_gradients(learner.training_loss, [w, unused])
+      clip_fn = lambda gvs: [(None if g is None else tf.clip_by_norm(g, 1.0), v) for g, v in gvs]
+      _, learner.train_op = learner._apply_gradients(optimizer, grads_and_vars, clip_fn)
+      with self.test_session() as sess:
+        sess.run([tf.global_variables_initializer(), tf.local_variables_initializer()])
+        steps = [learner._run_training_step(sess, {x: value})
+                 for value in ([1, 0, 0], [3, 0, 0], [0, 1, 0])]
+        self.assertEqual([False, True, False], [step['applied'] for step in steps])
+        # mean gradient [2, 0, 0] clipped to norm 1
+        self.assertAllClose([-1, 0, 0], sess.run(w))
+        learner._run_training_step(sess, {x: [0, 1, 0]})
+        self.assertAllClose([-1, -1, 0], sess.run(w))
+
+
+if __name__ == '__main__':
+  tf.test.main()
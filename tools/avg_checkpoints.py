@@ -1,5 +1,5 @@
 # -------------------------------------------------------------------#
-# Tool to save tenorflow model def file as GraphDef prototxt file
+# Tool to average the variables of checkpoints
 # Released under the MIT license (https://opensource.org/licenses/MIT)
 # Contact: mrinalhaloi11@gmail.com
 # Copyright 2017, Mrinal Haloi
@@ -10,15 +10,9 @@ from __future__ import print_function
 
 import os
 import click
-import numpy as np
-import six
-from six.moves import zip
 import tensorflow as tf
 
-
-def checkpoint_exists(path):
-  return (tf.gfile.Exists(path) or tf.gfile.Exists(path + ".meta")
-          or tf.gfile.Exists(path + ".index"))
+from tefla.core import checkpoint_ops
 
 
 @click.command()
@@ -26,7 +20,7 @@ def checkpoint_exists(path):
     '--checkpoints',
     default='',
     show_default=True,
-    help="Comma-separated list of checkpoints to average.")
+    help="Comma-separated list of checkpoints to average, from oldest to newest.")
 @click.option(
     '--weights',
     default=None,
@@ -37,53 +31,44 @@ def checkpoint_exists(path):
     default=None,
     show_default=True,
     help="Prefix (e.g., directory) to append to each checkpoint.")
+@click.option(
+    '--last_k',
+    default=None,
+    type=int,
+    show_default=True,
+    help="Average the last k model-epoch-*.ckpt checkpoints of --prefix, without --checkpoints.")
+@click.option(
+    '--mode',
+    default=None,
+    type=click.Choice(checkpoint_ops.AVERAGING_MODES),
+    help="Averaging mode, weighted if --weights is given, else uniform.")
+@click.option('--decay', default=0.9, show_default=True, help="Decay of the ema mode.")
+@click.option(
+    '--num_threads', default=4, show_default=True, help="Number of variables averaged in parallel.")
 @click.option(
     '--output_path',
     default='data/train',
     show_default=True,
     help="Path to output the averaged checkpoint to.")
-def checkpoint_mean(checkpoints, prefix, output_path, weights):
+def checkpoint_mean(checkpoints, prefix, last_k, output_path, weights, mode, decay, num_threads):
   checkpoints = [c.strip() for c in checkpoints.split(",")]
   checkpoints = [c for c in checkpoints if c]
+  if not checkpoints and prefix and last_k:
+    checkpoints = checkpoint_ops.epoch_checkpoints(prefix, last_k)
+  elif prefix:
+    checkpoints = [os.path.join(prefix, c) for c in checkpoints]
+  checkpoints = [c for c in checkpoints if checkpoint_ops.checkpoint_exists(c)]
   if not checkpoints:
     raise ValueError("No checkpoints provided for averaging.")
-  if prefix:
-    checkpoints = [os.path.join(prefix, c) for c in checkpoints]
-  checkpoints = [c for c in checkpoints if checkpoint_exists(c)]
-
-  var_list = tf.contrib.framework.list_variables(checkpoints[0])
-  var_values, var_dtypes = {}, {}
-  for (name, shape) in var_list:
-    if not name.startswith("global_step"):
-      var_values[name] = np.zeros(shape)
-  if weights is None:
-    weights = np.ones(len(checkpoints), dtype=np.float32)
-  else:
-    weights = np.array([float(w.strip()) for w in weights.split(",")])
-    print(weights)
-  for idx, checkpoint in enumerate(checkpoints):
-    reader = tf.contrib.framework.load_checkpoint(checkpoint)
-    for name in var_values:
-      tensor = reader.get_tensor(name)
-      var_dtypes[name] = tensor.dtype
-      var_values[name] += tensor * weights[idx]
-    print("Read from checkpoint %s", checkpoint)
-  for name in var_values:  # Average.
-    var_values[name] /= len(checkpoints)
-
-  tf_vars = [tf.get_variable(v, shape=var_values[v].shape, dtype=var_dtypes[v]) for v in var_values]
-  placeholders = [tf.placeholder(v.dtype, shape=v.shape) for v in tf_vars]
-  assign_ops = [tf.assign(v, p) for (v, p) in zip(tf_vars, placeholders)]
-  global_step = tf.Variable(0, name="global_step", trainable=False, dtype=tf.int64)
-  saver = tf.train.Saver(tf.global_variables())
-
-  with tf.Session() as sess:
-    sess.run(tf.global_variables_initializer())
-    for p, assign_op, (name, value) in zip(placeholders, assign_ops, six.iteritems(var_values)):
-      sess.run(assign_op, {p: value})
-    saver.save(sess, output_path, global_step=global_step)
+  if weights is not None:
+    weights = [float(w.strip()) for w in weights.split(",")]
+  if mode is None:
+    mode = 'uniform' if weights is None else 'weighted'
 
-  print("Averaged checkpoints saved in %s", output_path)
+  checkpoint_ops.average_checkpoints(
+      checkpoints, output_path, mode=mode, weights=weights, decay=decay, num_threads=num_threads)
+  tf.train.update_checkpoint_state(os.path.dirname(os.path.abspath(output_path)), output_path)
+  print("Averaged checkpoints saved in %s" % output_path)
 
 
 if __name__ == '__main__':
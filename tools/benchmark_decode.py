@@ -0,0 +1,78 @@
+# -------------------------------------------------------------------#
+# Tool to benchmark image decoding throughput
+# Released under the MIT license (https://opensource.org/licenses/MIT)
+# -------------------------------------------------------------------#
+"""Compares full resolution decoding, reduced-size (draft mode) decoding and
+cached loading of images resized to a target size."""
+from __future__ import division, print_function
+
+import os
+import shutil
+import tempfile
+import time
+
+import click
+import numpy as np
+from PIL import Image
+
+from tefla.da import data
+
+# pylint: disable=no-value-for-parameter
+
+
+def full_decode(fname, target_size):
+  img = Image.open(fname).convert('RGB')
+  return img.resize((target_size, target_size), Image.BILINEAR)
+
+
+def make_images(directory, num_images, width, height):
+  rng = np.random.RandomState(0)
+  fnames = []
+  for i in range(num_images):
+    # smooth random images compress like photographs, unlike white noise
+    small = rng.randint(0, 256, (height // 16, width // 16, 3)).astype(np.uint8)
+    img = Image.fromarray(small).resize((width, height), Image.BILINEAR)
+    fname = os.path.join(directory, '%d.jpg' % i)
+    img.save(fname, quality=90)
+    fnames.append(fname)
+  return fnames
+
+
+def bench(name, fn, fnames, target_size):
+  start = time.time()
+  for fname in fnames:
+    np.asarray(fn(fname, target_size))
+  elapsed = time.time() - start
+  print('{:<20} {:8.1f} images/sec'.format(name, len(fnames) / elapsed))
+  return elapsed
+
+
+@click.command()
+@click.option('--image_dir', default=None, show_default=True, help='Directory with JPEG images.')
+@click.option('--num_images', default=50, show_default=True, help='Number of images to decode.')
+@click.option('--target_size', default=256, show_default=True, help='Output image size.')
+@click.option(
+    '--source_size',
+    default='3000,2000',
+    show_default=True,
+    help='Width,height of synthetic images, used without --image_dir.')
+def main(image_dir, num_images, target_size, source_size):
+  tmp_dir = tempfile.mkdtemp()
+  try:
+    if image_dir is None:
+      width, height = [int(v) for v in source_size.split(',')]
+      fnames = make_images(tmp_dir, num_images, width, height)
+    else:
+      fnames = sorted(data.get_image_files(image_dir))[:num_images]
+    cache = data.reduced_preprocessor(target_size, os.path.join(tmp_dir, 'cache'))
+    full = bench('full decode', full_decode, fnames, target_size)
+    reduced = bench('draft decode', data.image_reduced, fnames, target_size)
+    bench('cache fill', lambda f, _: cache(f), fnames, target_size)
+    cached = bench('cache hit', lambda f, _: cache(f), fnames, target_size)
+    print('speedup: draft {:.1f}x, cache hit {:.1f}x'.format(full / reduced, full / cached))
+  finally:
+    shutil.rmtree(tmp_dir)
+
+
+if __name__ == '__main__':
+  main()
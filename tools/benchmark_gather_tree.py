@@ -0,0 +1,63 @@
+# -------------------------------------------------------------------#
+# Tool to benchmark the beam search backtracking
+# Released under the MIT license (https://opensource.org/licenses/MIT)
+# -------------------------------------------------------------------#
+"""Compares the run time of the beam backtracking of `beam_search.gather_tree`,
+in the graph, with `beam_search.gather_tree_py` run through `tf.py_func`, at
+several beam widths and lengths, and checks that their outputs are equal."""
+from __future__ import division, print_function
+
+import time
+
+import click
+import numpy as np
+import tensorflow as tf
+
+from tefla.core import beam_search
+
+# pylint: disable=no-value-for-parameter
+
+
+def gather_tree_py_func(values, parents):
+  res = tf.py_func(func=beam_search.gather_tree_py, inp=[values, parents], Tout=values.dtype)
+  res.set_shape(values.get_shape().as_list())
+  return res
+
+
+def bench(gather_tree, values, parents, num_runs):
+  with tf.Graph().as_default():
+    values_ph = tf.placeholder(tf.int32, values.shape)
+    parents_ph = tf.placeholder(tf.int32, parents.shape)
+    res = gather_tree(values_ph, parents_ph)
+    feed_dict = {values_ph: values, parents_ph: parents}
+    with tf.Session() as sess:
+      output = sess.run(res, feed_dict)
+      times = []
+      for _ in range(num_runs):
+        tic = time.time()
+        sess.run(res, feed_dict)
+        times.append(time.time() - tic)
+  return output, np.median(times)
+
+
+@click.command()
+@click.option('--beam_widths', default='4,16,64', show_default=True, help='Beam widths.')
+@click.option('--lengths', default='20,50,200', show_default=True, help='Decoded lengths.')
+@click.option('--num_runs', default=20, show_default=True, help='Number of timed runs.')
+def main(beam_widths, lengths, num_runs):
+  rng = np.random.RandomState(0)
+  print('{:>6} {:>8} {:>12} {:>12} {:>6}'.format('beam', 'length', 'py_func ms', 'graph ms',
+                                                 'equal'))
+  for beam_width in [int(b) for b in beam_widths.split(',')]:
+    for length in [int(l) for l in lengths.split(',')]:
+      values = rng.randint(0, 10000, (length, beam_width)).astype(np.int32)
+      parents = rng.randint(0, beam_width, (length, beam_width)).astype(np.int32)
+      expected, py_time = bench(gather_tree_py_func, values, parents, num_runs)
+      output, graph_time = bench(beam_search.gather_tree, values, parents, num_runs)
+      print('{:>6} {:>8} {:>12.3f} {:>12.3f} {:>6}'.format(beam_width, length, 1000 * py_time,
+                                                          1000 * graph_time,
+                                                          str(np.array_equal(expected, output))))
+
+
+if __name__ == '__main__':
+  main()
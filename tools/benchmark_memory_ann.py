@@ -0,0 +1,77 @@
+# -------------------------------------------------------------------#
+# Tool to benchmark the nearest neighbour lookups of the memory module
+# Released under the MIT license (https://opensource.org/licenses/MIT)
+# -------------------------------------------------------------------#
+"""Compares the dense lookup of `Memory` (matmul against all the keys and
+`top_k`) with the maintained LSH index of `LSHMemory`: latency of
+`get_hint_pool_idxs` and recall@k of the LSH lookup against the exact
+neighbours, at several memory sizes."""
+from __future__ import division, print_function
+
+import time
+
+import click
+import numpy as np
+import tensorflow as tf
+
+from tefla.core.memory import LSHMemory, Memory
+
+# pylint: disable=no-value-for-parameter
+
+
+def make_keys(rng, memory_size, key_dim, num_clusters):
+  centers = rng.randn(num_clusters, key_dim)
+  keys = centers[rng.randint(0, num_clusters, memory_size)] + 0.5 * rng.randn(memory_size, key_dim)
+  return (keys / np.linalg.norm(keys, axis=1, keepdims=True)).astype(np.float32)
+
+
+def bench(memory_cls, keys, queries, choose_k, num_runs, **kwargs):
+  memory_size, key_dim = keys.shape
+  with tf.Graph().as_default():
+    memory = memory_cls(key_dim, memory_size, 10, choose_k=choose_k, **kwargs)
+    keys_ph = tf.placeholder(tf.float32, keys.shape)
+    set_op = memory.set(keys_ph, tf.zeros([memory_size], tf.int32), tf.zeros([memory_size]))
+    query = tf.placeholder(tf.float32, (None, key_dim))
+    hint_pool_idxs = memory.get_hint_pool_idxs(query)
+    with tf.Session() as sess:
+      sess.run(tf.global_variables_initializer())
+      sess.run(set_op, {keys_ph: keys})
+      idxs = sess.run(hint_pool_idxs, {query: queries})
+      times = []
+      for _ in range(num_runs):
+        tic = time.time()
+        sess.run(hint_pool_idxs, {query: queries})
+        times.append(time.time() - tic)
+  return idxs, np.median(times)
+
+
+def recall_at_k(exact_idxs, idxs, k):
+  return np.mean([len(set(e[:k]) & set(i[:k])) / k for e, i in zip(exact_idxs, idxs)])
+
+
+@click.command()
+@click.option(
+    '--memory_sizes', default='10000,100000,1000000', show_default=True, help='Memory sizes.')
+@click.option('--key_dim', default=64, show_default=True, help='Key dimension.')
+@click.option('--choose_k', default=256, show_default=True, help='Size of the hint pool.')
+@click.option('--batch_size', default=64, show_default=True, help='Number of queries.')
+@click.option('--k', default=10, show_default=True, help='k of recall@k.')
+@click.option('--num_libraries', default=16, show_default=True, help='Number of hash tables.')
+@click.option('--num_runs', default=20, show_default=True, help='Number of timed lookups.')
+def main(memory_sizes, key_dim, choose_k, batch_size, k, num_libraries, num_runs):
+  rng = np.random.RandomState(0)
+  print('{:>10} {:>12} {:>12} {:>10}'.format('size', 'dense ms', 'lsh ms', 'recall@%d' % k))
+  for memory_size in [int(size) for size in memory_sizes.split(',')]:
+    keys = make_keys(rng, memory_size, key_dim, max(memory_size // 100, 1))
+    queries = keys[rng.randint(0, memory_size, batch_size)] + 0.05 * rng.randn(batch_size, key_dim)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    exact_idxs, dense_time = bench(Memory, keys, queries, choose_k, num_runs)
+    idxs, lsh_time = bench(
+        LSHMemory, keys, queries, choose_k, num_runs, num_libraries=num_libraries)
+    print('{:>10} {:>12.2f} {:>12.2f} {:>10.3f}'.format(memory_size, 1000 * dense_time,
+                                                       1000 * lsh_time,
+                                                       recall_at_k(exact_idxs, idxs, k)))
+
+
+if __name__ == '__main__':
+  main()
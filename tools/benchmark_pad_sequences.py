@@ -0,0 +1,65 @@
+# -------------------------------------------------------------------#
+# Tool to benchmark the padding of variable length sequences
+# Released under the MIT license (https://opensource.org/licenses/MIT)
+# -------------------------------------------------------------------#
+"""Compares, on sequences with a skewed (log-normal) length distribution, the
+throughput of `util.pad_sequences` with the former per-sequence loop, and the
+padding overhead (padding elements / sequence elements) of padding all the
+sequences to the longest one with `util.bucket_pad_sequences`."""
+from __future__ import division, print_function
+
+import time
+
+import click
+import numpy as np
+
+from tefla.utils import util
+
+# pylint: disable=no-value-for-parameter
+
+
+def loop_pad_sequences(sequences, maxlen, dtype='int32', value=0.):
+  x = (np.ones((len(sequences), maxlen)) * value).astype(dtype)
+  for idx, s in enumerate(sequences):
+    if len(s) == 0:
+      continue
+    trunc = s[:maxlen]
+    x[idx, :len(trunc)] = trunc
+  return x
+
+
+def timed(fn, *args, **kwargs):
+  tic = time.time()
+  res = fn(*args, **kwargs)
+  return res, time.time() - tic
+
+
+@click.command()
+@click.option('--num_sequences', default=100000, show_default=True, help='Number of sequences.')
+@click.option('--mean_log_length', default=3.0, show_default=True, help='Mean of log lengths.')
+@click.option('--sigma_log_length', default=1.0, show_default=True, help='Std of log lengths.')
+@click.option('--batch_size', default=64, show_default=True, help='Batch size of the buckets.')
+def main(num_sequences, mean_log_length, sigma_log_length, batch_size):
+  rng = np.random.RandomState(0)
+  lengths = np.maximum(rng.lognormal(mean_log_length, sigma_log_length, num_sequences),
+                       1).astype(np.int64)
+  tokens = rng.randint(1, 30000, int(np.sum(lengths)))
+  sequences = [s.tolist() for s in np.split(tokens, np.cumsum(lengths)[:-1])]
+  print('sequences: %d, tokens: %d, max length: %d, median length: %d' %
+        (num_sequences, len(tokens), np.max(lengths), np.median(lengths)))
+
+  expected, loop_time = timed(loop_pad_sequences, sequences, int(np.max(lengths)))
+  padded, vector_time = timed(util.pad_sequences, sequences)
+  assert np.array_equal(expected, padded)
+  batches, bucket_time = timed(util.bucket_pad_sequences, sequences, batch_size, shuffle=True)
+
+  print('{:>10} {:>14} {:>12}'.format('mode', 'Mtokens/s', 'overhead'))
+  full_overhead = util.padding_overhead(lengths, [padded.shape])
+  for mode, duration, overhead in (
+      ('loop', loop_time, full_overhead), ('vector', vector_time, full_overhead),
+      ('bucketed', bucket_time, util.padding_overhead(lengths, [x.shape for _, x in batches]))):
+    print('{:>10} {:>14.2f} {:>12.3f}'.format(mode, len(tokens) / duration / 1e6, overhead))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,79 @@
+# -------------------------------------------------------------------#
+# Tool to benchmark the per-example gradients of the DP optimizer
+# Released under the MIT license (https://opensource.org/licenses/MIT)
+# -------------------------------------------------------------------#
+"""Compares the examples/sec of the sanitized gradients of
+`DPGradientDescentOptimizer` on a small convolutional network, with the
+vectorized per-example gradient rules, with the former per-example conv2d
+loop and with micro-batch clipping."""
+from __future__ import division, print_function
+
+import time
+
+import click
+import numpy as np
+import tensorflow as tf
+
+from tefla.core import optimizer
+from tefla.core.layers import conv2d, fully_connected, relu
+from tefla.core.optimizer import DPGradientDescentOptimizer
+
+# pylint: disable=no-value-for-parameter
+
+
+class ClipSanitizer(object):
+  """Clips the per-example gradients and sums them, without privacy accounting."""
+
+  def __init__(self, l2norm_bound):
+    self.l2norm_bound = l2norm_bound
+
+  def sanitize(self, x, *args, **kwargs):
+    return tf.reduce_sum(optimizer.BatchClipByL2norm(x, self.l2norm_bound), 0)
+
+
+def build(batch_size, image_size, num_filters, num_microbatches):
+  images = tf.placeholder(tf.float32, (batch_size, image_size, image_size, 3))
+  x = conv2d(images, num_filters, True, None, stride=2, activation=relu, name='conv1')
+  x = conv2d(x, num_filters * 2, True, None, stride=2, activation=relu, name='conv2')
+  logits = fully_connected(tf.reshape(x, [batch_size, -1]), 10, True, None, name='logits')
+  loss = tf.reduce_sum(tf.square(logits))
+  opt = DPGradientDescentOptimizer(
+      0.01, (1.0, 1e-5), ClipSanitizer(1.0), sigma=1.0, num_microbatches=num_microbatches)
+  grads = opt.compute_sanitized_gradients(loss, tf.trainable_variables())
+  return images, tf.group(*grads)
+
+
+def bench(batch_size, image_size, num_filters, num_microbatches, num_runs):
+  x = np.random.RandomState(0).rand(batch_size, image_size, image_size, 3).astype(np.float32)
+  with tf.Graph().as_default():
+    images, grads_op = build(batch_size, image_size, num_filters, num_microbatches)
+    with tf.Session() as sess:
+      sess.run(tf.global_variables_initializer())
+      sess.run(grads_op, {images: x})
+      times = []
+      for _ in range(num_runs):
+        tic = time.time()
+        sess.run(grads_op, {images: x})
+        times.append(time.time() - tic)
+  return batch_size / np.median(times)
+
+
+@click.command()
+@click.option('--batch_sizes', default='16,64,256', show_default=True, help='Batch sizes.')
+@click.option('--image_size', default=32, show_default=True, help='Image size.')
+@click.option('--num_filters', default=16, show_default=True, help='Filters of the first conv.')
+@click.option('--num_microbatches', default=8, show_default=True, help='Micro-batches.')
+@click.option('--num_runs', default=10, show_default=True, help='Number of timed steps.')
+def main(batch_sizes, image_size, num_filters, num_microbatches, num_runs):
+  print('{:>6} {:>12} {:>12} {:>12}'.format('batch', 'loop ex/s', 'vector ex/s', 'micro ex/s'))
+  for batch_size in [int(b) for b in batch_sizes.split(',')]:
+    optimizer.pxg_registry.Register('Conv2D', optimizer.Conv2DLoopPXG)
+    loop = bench(batch_size, image_size, num_filters, None, num_runs)
+    optimizer.pxg_registry.Register('Conv2D', optimizer.Conv2DPXG)
+    vectorized = bench(batch_size, image_size, num_filters, None, num_runs)
+    micro = bench(batch_size, image_size, num_filters, num_microbatches, num_runs)
+    print('{:>6} {:>12.1f} {:>12.1f} {:>12.1f}'.format(batch_size, loop, vectorized, micro))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,62 @@
+# -------------------------------------------------------------------#
+# Tool to benchmark the receptive field analysis of deep graphs
+# Released under the MIT license (https://opensource.org/licenses/MIT)
+# -------------------------------------------------------------------#
+"""Times `receptive_field.compute_receptive_field_from_graph_def` on a deep
+convolutional graph: the first query traversing the graph, repeated queries
+for other layers answered from the cached traversal and queries at other
+input resolutions reusing the cached topological order."""
+from __future__ import division, print_function
+
+import time
+
+import click
+import tensorflow as tf
+
+from tefla.core import receptive_field
+from tefla.core.layers import conv2d, relu
+
+# pylint: disable=no-value-for-parameter
+
+
+def build(num_layers):
+  g = tf.Graph()
+  with g.as_default():
+    x = tf.placeholder(tf.float32, (None, None, None, 3), name='input_image')
+    outputs = []
+    for i in range(num_layers):
+      x = conv2d(x, 4, False, None, filter_size=3, activation=relu, name='conv%d' % i)
+      outputs.append(x.op.name)
+  return g.as_graph_def(), outputs
+
+
+def timed(fn, *args, **kwargs):
+  tic = time.time()
+  res = fn(*args, **kwargs)
+  return res, time.time() - tic
+
+
+@click.command()
+@click.option('--num_layers', default=2000, show_default=True, help='Number of conv layers.')
+@click.option('--resolutions', default='224,299,321', show_default=True, help='Input sizes.')
+def main(num_layers, resolutions):
+  graph_def, outputs = build(num_layers)
+  print('nodes: %d' % len(graph_def.node))
+  rf, first_time = timed(receptive_field.compute_receptive_field_from_graph_def, graph_def,
+                         'input_image', outputs[-1])
+  print('first query: %.3f s, rf %s' % (first_time, rf.size))
+  _, other_time = timed(receptive_field.compute_receptive_field_from_graph_def, graph_def,
+                        'input_image', outputs[len(outputs) // 2])
+  print('other layer, cached: %.3f s' % other_time)
+  for resolution in [int(r) for r in resolutions.split(',')]:
+    _, res_time = timed(
+        receptive_field.compute_receptive_field_from_graph_def,
+        graph_def,
+        'input_image',
+        outputs[-1],
+        input_resolution=[resolution, resolution])
+    print('input %d, cached order: %.3f s' % (resolution, res_time))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,70 @@
+# -------------------------------------------------------------------#
+# Tool to benchmark the statically unrolled and the loop based RNN layers
+# Released under the MIT license (https://opensource.org/licenses/MIT)
+# -------------------------------------------------------------------#
+"""Compares the graph build time, the graph def size and the training step time
+of `rnn_cell.lstm`/`rnn_cell.gru` statically unrolled over the timesteps and
+run as a single loop, at several sequence lengths."""
+from __future__ import division, print_function
+
+import time
+
+import click
+import numpy as np
+import tensorflow as tf
+
+from tefla.core import rnn_cell
+
+# pylint: disable=no-value-for-parameter
+
+
+def build(layer, batch_size, num_steps, input_dim, num_units, unroll, layer_norm):
+  inputs = tf.placeholder(tf.float32, (batch_size, num_steps, input_dim))
+  kwargs = {'layer_norm': rnn_cell.layer_norm} if layer == 'lstm' and layer_norm else {}
+  rnn = rnn_cell.lstm if layer == 'lstm' else rnn_cell.gru
+  outputs = rnn(inputs, num_units, None, True, dynamic=False, unroll=unroll, **kwargs)
+  loss = tf.reduce_mean(tf.square(outputs))
+  train_op = tf.train.GradientDescentOptimizer(0.01).minimize(loss)
+  return inputs, train_op
+
+
+def bench(layer, batch_size, num_steps, input_dim, num_units, unroll, layer_norm, num_runs):
+  x = np.random.RandomState(0).rand(batch_size, num_steps, input_dim).astype(np.float32)
+  with tf.Graph().as_default() as graph:
+    tic = time.time()
+    inputs, train_op = build(layer, batch_size, num_steps, input_dim, num_units, unroll,
+                             layer_norm)
+    build_time = time.time() - tic
+    graph_def_size = graph.as_graph_def().ByteSize()
+    with tf.Session() as sess:
+      sess.run(tf.global_variables_initializer())
+      sess.run(train_op, {inputs: x})
+      times = []
+      for _ in range(num_runs):
+        tic = time.time()
+        sess.run(train_op, {inputs: x})
+        times.append(time.time() - tic)
+  return build_time, graph_def_size, np.median(times)
+
+
+@click.command()
+@click.option('--layer', default='lstm', type=click.Choice(['lstm', 'gru']), show_default=True)
+@click.option('--timesteps', default='50,200,1000', show_default=True, help='Sequence lengths.')
+@click.option('--batch_size', default=32, show_default=True, help='Batch size.')
+@click.option('--input_dim', default=32, show_default=True, help='Input dimension.')
+@click.option('--num_units', default=128, show_default=True, help='Number of units.')
+@click.option('--layer_norm', is_flag=True, help='Layer normalization of the LSTM gates.')
+@click.option('--num_runs', default=10, show_default=True, help='Number of timed steps.')
+def main(layer, timesteps, batch_size, input_dim, num_units, layer_norm, num_runs):
+  print('{:>6} {:>8} {:>10} {:>12} {:>10}'.format('steps', 'mode', 'build s', 'graph KB',
+                                                   'step ms'))
+  for num_steps in [int(t) for t in timesteps.split(',')]:
+    for mode, unroll in (('unrolled', True), ('loop', False)):
+      build_time, graph_def_size, step_time = bench(layer, batch_size, num_steps, input_dim,
+                                                    num_units, unroll, layer_norm, num_runs)
+      print('{:>6} {:>8} {:>10.2f} {:>12.1f} {:>10.2f}'.format(
+          num_steps, mode, build_time, graph_def_size / 1024, 1000 * step_time))
+
+
+if __name__ == '__main__':
+  main()
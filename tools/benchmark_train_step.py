@@ -0,0 +1,104 @@
+# -------------------------------------------------------------------#
+# Tool to benchmark the training step of the learners
+# Released under the MIT license (https://opensource.org/licenses/MIT)
+# -------------------------------------------------------------------#
+"""Compares the step time of the former two `sess.run` training step (train op,
+then update ops again), the fused single `sess.run` step, and the fused step
+with inputs staged on the device through a `StagingArea`."""
+from __future__ import division, print_function
+
+import time
+
+import click
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.ops import data_flow_ops
+
+from tefla.core.layers import batch_norm_tf, conv2d, fully_connected, global_avg_pool, relu
+
+# pylint: disable=no-value-for-parameter
+
+
+def model(inputs, num_classes):
+  x = inputs
+  for i, channels in enumerate([32, 64, 128]):
+    x = conv2d(
+        x,
+        channels,
+        True,
+        None,
+        stride=(2, 2),
+        batch_norm=batch_norm_tf,
+        batch_norm_args={'fused': True},
+        activation=relu,
+        name='conv%d' % i)
+  return fully_connected(global_avg_pool(x), num_classes, True, None, name='logits')
+
+
+def build(batch_size, image_size, num_classes, staged):
+  inputs = tf.placeholder(tf.float32, (batch_size, image_size, image_size, 3))
+  labels = tf.placeholder(tf.int64, (batch_size,))
+  stage_op = None
+  if staged:
+    with tf.device('/gpu:0'):
+      area = data_flow_ops.StagingArea(
+          dtypes=[tf.float32, tf.int64], shapes=[inputs.get_shape(), labels.get_shape()])
+      stage_op = area.put([inputs, labels])
+      model_inputs, model_labels = area.get()
+  else:
+    model_inputs, model_labels = inputs, labels
+  logits = model(model_inputs, num_classes)
+  loss = tf.losses.sparse_softmax_cross_entropy(model_labels, logits)
+  update_ops = tf.get_collection(tf.GraphKeys.UPDATE_OPS)
+  with tf.control_dependencies([tf.group(*update_ops)]):
+    loss = tf.identity(loss)
+  train_op = tf.train.MomentumOptimizer(0.01, 0.9).minimize(loss)
+  return inputs, labels, loss, train_op, update_ops, stage_op
+
+
+def bench(name, batches, batch_size, image_size, num_classes, mode):
+  with tf.Graph().as_default():
+    inputs, labels, loss, train_op, update_ops, stage_op = build(batch_size, image_size,
+                                                                 num_classes, mode == 'staged')
+    config = tf.ConfigProto(allow_soft_placement=True)
+    with tf.Session(config=config) as sess:
+      sess.run(tf.global_variables_initializer())
+      if stage_op is not None:
+        sess.run(stage_op, {inputs: batches[0][0], labels: batches[0][1]})
+      times = []
+      for i, (Xb, yb) in enumerate(batches):
+        tic = time.time()
+        if mode == 'two_runs':
+          sess.run([loss, train_op], {inputs: Xb, labels: yb})
+          sess.run(update_ops, {inputs: Xb, labels: yb})
+        elif mode == 'fused':
+          sess.run([loss, train_op, update_ops], {inputs: Xb, labels: yb})
+        else:
+          Xn, yn = batches[(i + 1) % len(batches)]
+          sess.run([loss, train_op, update_ops, stage_op], {inputs: Xn, labels: yn})
+        times.append(time.time() - tic)
+  # the first steps include graph setup and autotuning
+  step_time = np.median(times[len(times) // 5:])
+  print('{:<12} {:8.2f} ms/step'.format(name, 1000 * step_time))
+  return step_time
+
+
+@click.command()
+@click.option('--batch_size', default=64, show_default=True, help='Batch size.')
+@click.option('--image_size', default=128, show_default=True, help='Input image size.')
+@click.option('--num_classes', default=10, show_default=True, help='Number of classes.')
+@click.option('--num_steps', default=50, show_default=True, help='Number of training steps.')
+def main(batch_size, image_size, num_classes, num_steps):
+  rng = np.random.RandomState(0)
+  batches = [(rng.rand(batch_size, image_size, image_size, 3).astype(np.float32),
+              rng.randint(0, num_classes, batch_size)) for _ in range(min(num_steps, 8))]
+  batches = [batches[i % len(batches)] for i in range(num_steps)]
+  two_runs = bench('two runs', batches, batch_size, image_size, num_classes, 'two_runs')
+  fused = bench('fused', batches, batch_size, image_size, num_classes, 'fused')
+  staged = bench('staged', batches, batch_size, image_size, num_classes, 'staged')
+  print('speedup: fused {:.2f}x, fused + staged {:.2f}x'.format(two_runs / fused,
+                                                                 two_runs / staged))
+
+
+if __name__ == '__main__':
+  main()
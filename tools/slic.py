@@ -4,16 +4,22 @@
 # Contact: mrinalhaloi11@gmail.com
 # Copyright 2017, Mrinal Haloi
 # -------------------------------------------------------------------#
+import os
+from multiprocessing import cpu_count
+from multiprocessing.pool import Pool
+
 import click
 import numpy as np
+from matplotlib.image import imsave
+from skimage.measure import label
 from skimage.segmentation import slic
 from skimage.segmentation import mark_boundaries
 from skimage.util import img_as_float
 from sklearn.cluster import KMeans
-from scipy import ndimage
-import matplotlib.pyplot as plt
 from tefla.convert import convert
 
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.bmp')
+
 
 def process_image(image_filename, image_size):
   image = convert(image_filename, image_size)
@@ -21,54 +27,93 @@ def process_image(image_filename, image_size):
   return image
 
 
+def segment_statistics(image, segments, num_segments=None):
+  """Computes the mean, std, max and min color of all the segments at once.
+
+  The pixels are sorted by segment once and every statistic is reduced over
+  the contiguous pixels of each segment, instead of scanning the image once
+  per segment.
+
+  Args:
+    image: a (height, width, channels) image.
+    segments: a (height, width) int array of segment labels.
+    num_segments: number of segments, by default the largest label + 1.
+
+  Returns:
+    a tuple of (num_segments, channels) float32 arrays (means, stds, maxs,
+      mins), zeros for the empty segments.
+  """
+  labels = segments.ravel()
+  if num_segments is None:
+    num_segments = int(labels.max()) + 1
+  pixels = image.reshape(labels.size, -1).astype(np.float64)
+  order = np.argsort(labels, kind='mergesort')
+  pixels = pixels[order]
+  counts = np.bincount(labels, minlength=num_segments)[:num_segments]
+  starts = np.cumsum(counts) - counts
+  present = counts > 0
+  stats = [np.zeros((num_segments, pixels.shape[1]), dtype=np.float32) for _ in range(4)]
+  if not np.any(present):
+    return tuple(stats)
+  means, stds, maxs, mins = stats
+  sums = np.add.reduceat(pixels, starts[present], axis=0)
+  sq_sums = np.add.reduceat(np.square(pixels), starts[present], axis=0)
+  mean = sums / counts[present, np.newaxis]
+  means[present] = mean
+  stds[present] = np.sqrt(np.maximum(sq_sums / counts[present, np.newaxis] - np.square(mean), 0))
+  maxs[present] = np.maximum.reduceat(pixels, starts[present], axis=0)
+  mins[present] = np.minimum.reduceat(pixels, starts[present], axis=0)
+  return means, stds, maxs, mins
+
+
+def filter_clusters(clusters, num_clusters, max_component_size=500, max_cluster_size=4000):
+  """Keeps the small connected components of the clusters.
+
+  The connected components of all the clusters are labeled in one pass. The
+  components larger than `max_component_size` pixels are removed, then the
+  clusters keeping more than `max_cluster_size` pixels are removed.
+
+  Args:
+    clusters: a (height, width) int array of cluster labels.
+    num_clusters: number of clusters.
+    max_component_size: maximum size of a kept connected component.
+    max_cluster_size: maximum size of a kept cluster.
+
+  Returns:
+    a (height, width) int array, the cluster label of the kept pixels and 0
+      elsewhere.
+  """
+  components = label(clusters, background=-1, connectivity=1)
+  component_sizes = np.bincount(components.ravel())
+  kept = component_sizes[components] <= max_component_size
+  cluster_sizes = np.bincount(clusters[kept], minlength=num_clusters)
+  kept &= cluster_sizes[clusters] <= max_cluster_size
+  return np.where(kept, clusters, 0)
+
+
 def segment_image(image, numSegments, numClusters):
+  """Segments an image in superpixels clustered by color.
+
+  Args:
+    image: a (height, width, 3) float image.
+    numSegments: number of segmented regions for slic.
+    numClusters: number of color clusters of the segments.
+
+  Returns:
+    a (height, width) int array of cluster labels, 0 for the filtered pixels.
+  """
   segments = slic(
       image, n_segments=numSegments, compactness=1.5, max_iter=50, sigma=8, convert2lab=True)
-  idxs = []
-  means = []
-  stds = []
-  maxrgb = []
-  minrgb = []
-  for i in range(numSegments):
-    idxs.append(np.where(segments == i))
-    means.append(np.mean(image[idxs[i][0], idxs[i][1], :], axis=(0)))
-    stds.append(np.std(image[idxs[i][0], idxs[i][1], :], axis=(0)))
-    try:
-      maxrgb.append(np.max(image[idxs[i][0], idxs[i][1], :], axis=(0)))
-      minrgb.append(np.min(image[idxs[i][0], idxs[i][1], :], axis=(0)))
-    except Exception:
-      maxrgb.append((0, 0, 0))
-      minrgb.append((0, 0, 0))
-  means = np.reshape(np.asarray(means, dtype=np.float32), (numSegments, 3))
-  stds = np.reshape(np.asarray(stds, dtype=np.float32), (numSegments, 3))
-  maxrgb = np.reshape(np.asarray(maxrgb, dtype=np.float32), (numSegments, 3))
-  minrgb = np.reshape(np.asarray(minrgb, dtype=np.float32), (numSegments, 3))
+  means, stds, _, _ = segment_statistics(image, segments)
   features = np.concatenate((means, stds), axis=1)
-  nanidx = np.argwhere(np.isnan(features))
-  features[nanidx] = 0.0
-  kmeans = KMeans(n_clusters=numClusters, random_state=0).fit(features)
-
-  for i in range(numSegments):
-    segments[idxs[i][0], idxs[i][1]] = kmeans.labels_[i]
-
-  all_labeled = []
-  for i in range(numClusters):
-    labeled, nr_objects = ndimage.label(segments == i)
-    for j in range(nr_objects):
-      idx = np.where(labeled == j)
-      if len(idx[0]) > 500:
-        labeled[idx] = 0
-    class_idx = np.where(labeled > 0)
-    if len(class_idx[0]) > 4000:
-      labeled[class_idx] = 0
-    else:
-      labeled[class_idx] = i
-    all_labeled.append(labeled)
-
-  segment = all_labeled[0].copy()
-
-  for i in range(1, numClusters):
-    segment = np.add(segment, all_labeled[i])
+  features[np.isnan(features)] = 0.0
+  kmeans = KMeans(n_clusters=min(numClusters, len(features)), random_state=0).fit(features)
+  clusters = kmeans.labels_[segments]
+  return filter_clusters(clusters, numClusters)
+
+
+def show_segments(image, segment):
+  import matplotlib.pyplot as plt
   plt.imshow(segment)
 
   fig = plt.figure("segments")
@@ -78,15 +123,79 @@ def segment_image(image, numSegments, numClusters):
   plt.show()
 
 
+def _segment_task(task):
+  """Pool worker, segments one image and writes the segments and their
+  boundaries overlay to the output directory."""
+  image_filename, output_dir, num_segments, num_clusters, image_size = task
+  name = os.path.splitext(os.path.basename(image_filename))[0]
+  try:
+    image = process_image(image_filename, image_size)
+    segment = segment_image(image, num_segments, num_clusters)
+    np.save(os.path.join(output_dir, name + '_segments.npy'), segment.astype(np.int32))
+    imsave(os.path.join(output_dir, name + '_segments.png'), mark_boundaries(image, segment))
+    return image_filename, 'ok'
+  except Exception as e:
+    return image_filename, str(e)
+
+
+def segment_directory(image_dir, output_dir, num_segments, num_clusters, image_size,
+                      num_workers=None):
+  """Segments all the images of a directory with a pool of worker processes.
+
+  Args:
+    image_dir: directory of the images.
+    output_dir: directory where the segments are written.
+    num_segments: number of segmented regions for slic.
+    num_clusters: number of color clusters of the segments.
+    image_size: size of the converted images.
+    num_workers: number of worker processes, all the cpus if None.
+
+  Returns:
+    the number of segmented images.
+  """
+  if not os.path.exists(output_dir):
+    os.makedirs(output_dir)
+  filenames = sorted(
+      os.path.join(image_dir, fname)
+      for fname in os.listdir(image_dir)
+      if fname.lower().endswith(IMAGE_EXTENSIONS))
+  tasks = [(fname, output_dir, num_segments, num_clusters, image_size) for fname in filenames]
+  num_done = 0
+  pool = Pool(num_workers or cpu_count())
+  try:
+    for fname, status in pool.imap_unordered(_segment_task, tasks):
+      if status != 'ok':
+        print('Failed to segment %s (%s)' % (fname, status))
+        continue
+      num_done += 1
+      print('Segmented %d/%d: %s' % (num_done, len(filenames), fname))
+    pool.close()
+  except BaseException:
+    pool.terminate()
+    raise
+  finally:
+    pool.join()
+  return num_done
+
+
 @click.command()
 @click.option('--image_filename', show_default=True, help="path to image.")
+@click.option(
+    '--image_dir', default=None, show_default=True, help="Directory of images, batch mode.")
+@click.option(
+    '--output_dir', default='segments', show_default=True, help="Output directory, batch mode.")
 @click.option(
     '--num_segments', default=2000, show_default=True, help="Number of segmented region for slic")
 @click.option('--num_clusters', default=30, show_default=True, help="Num clusters")
 @click.option('--image_size', default=896, show_default=True, help="Size of converted images.")
-def main(image_filename, num_segments, num_clusters, image_size):
+@click.option('--num_workers', default=cpu_count(), show_default=True, help="Worker processes.")
+def main(image_filename, image_dir, output_dir, num_segments, num_clusters, image_size,
+         num_workers):
+  if image_dir is not None:
+    segment_directory(image_dir, output_dir, num_segments, num_clusters, image_size, num_workers)
+    return
   image = process_image(image_filename, image_size)
-  segment_image(image, num_segments, num_clusters)
+  show_segments(image, segment_image(image, num_segments, num_clusters))
 
 
 if __name__ == '__main__':
@@ -10,7 +10,6 @@ from skimage.segmentation import slic
 from skimage.segmentation import mark_boundaries
 from skimage.util import img_as_float
 from sklearn.cluster import KMeans
-from scipy import ndimage
 import cv2
 import matplotlib.pyplot as plt
 from tefla.convert import convert
@@ -30,15 +29,44 @@ def compute_hog(image, locations):
   return hist
 
 
+def segment_means(feature, segments):
+  """Mean of the features of each segment, computed for all the segments and
+  channels in one pass.
+
+  Args:
+    feature: a (height, width, channels) array.
+    segments: a (height, width) int array of segment labels.
+
+  Returns:
+    a (num_segments, channels) array, num_segments is the largest label + 1.
+  """
+  labels = segments.ravel()
+  order = np.argsort(labels, kind='mergesort')
+  counts = np.bincount(labels)
+  present = counts > 0
+  starts = (np.cumsum(counts) - counts)[present]
+  sums = np.add.reduceat(
+      feature.reshape(labels.size, -1)[order].astype(np.float64), starts, axis=0)
+  means = np.zeros((len(counts), sums.shape[1]))
+  means[present] = sums / counts[present, np.newaxis]
+  return means
+
+
+def segment_pixels(segments):
+  """Returns the (rows, cols) pixel coordinates of every segment, grouped by
+  sorting the pixels once."""
+  labels = segments.ravel()
+  order = np.argsort(labels, kind='mergesort')
+  bounds = np.cumsum(np.bincount(labels))[:-1]
+  rows, cols = np.unravel_index(order, segments.shape)
+  return list(zip(np.split(rows, bounds), np.split(cols, bounds)))
+
+
 def superpixel_smoothing(image, feature, numSegments, numClusters):
   segments = slic(
       image, n_segments=numSegments, compactness=1.5, max_iter=50, sigma=8, convert2lab=True)
   # feature = np.random.randn(image.shape[0], image.shape[1], 32)
-  for i in range(feature.shape[-1]):
-    for j in range(numSegments):
-      temp_idx = np.where(segments == j)
-      slic_mean = feature[temp_idx[0], temp_idx[1], i].mean()
-      feature[temp_idx[0], temp_idx[1], i] = slic_mean
+  feature[...] = segment_means(feature, segments)[segments].reshape(feature.shape)
 
 
 def cross_sp_voting(image, segments, numSegments):
@@ -46,12 +74,12 @@ def cross_sp_voting(image, segments, numSegments):
   rgb = []
   lab = []
   image_lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
-  for i in range(numSegments):
-    temp_idx = np.where(segments == i)
-    locations = zip(tuple(temp_idx[0]), tuple(idx[1]))
+  for temp_idx in segment_pixels(segments)[:numSegments]:
+    locations = list(zip(tuple(temp_idx[0]), tuple(temp_idx[1])))
     hogfeats.append(compute_hog(image, locations))
     rgb.append(image[temp_idx[0], temp_idx[1], :])
     lab.append(image_lab[temp_idx[0], temp_idx[1], :])
+  return hogfeats, rgb, lab
 
 
 @click.command()
@@ -4,6 +4,9 @@
 # Contact: mrinalhaloi11@gmail.com
 # Copyright 2017, Mrinal Haloi
 # -------------------------------------------------------------------#
+import json
+import os
+
 import click
 import tensorflow as tf
 import matplotlib.pyplot as plt
@@ -33,6 +36,89 @@ def get_activation(sess, layer, inputs, data):
   return activations
 
 
+def _read_progress(progress_path, num_examples, layer_names):
+  """Number of examples already extracted, 0 if there is no progress file or
+  if it was written for other data or layers."""
+  if not os.path.exists(progress_path):
+    return 0
+  with open(progress_path) as f:
+    progress = json.load(f)
+  if progress['num_examples'] != num_examples or progress['layers'] != layer_names:
+    print('%s was written for other data or layers, restarting' % progress_path)
+    return 0
+  return progress['done']
+
+
+def _write_progress(progress_path, num_examples, layer_names, done):
+  tmp_path = progress_path + '.tmp'
+  with open(tmp_path, 'w') as f:
+    json.dump({'num_examples': num_examples, 'layers': layer_names, 'done': done}, f)
+  os.rename(tmp_path, progress_path)
+
+
+def extract_activations(sess,
+                        inputs,
+                        layers,
+                        data,
+                        output_dir,
+                        batch_size=32,
+                        preprocess=None,
+                        resume=True):
+  """Extracts the activations of several layers to memory-mapped arrays.
+
+  The data is processed batch by batch, all the layers are fetched by one
+  `sess.run` per batch and written to one `.npy` memory-mapped array per
+  layer in `output_dir`, so that only one batch is held in memory. The
+  number of completed examples is saved after every batch and an interrupted
+  extraction resumes from there.
+
+  Args:
+    sess: the session of the model.
+    inputs: the input placeholder of the model.
+    layers: a dict of layer names to layer tensors.
+    data: an array of the model inputs indexable by slices, e.g. a `.npy`
+      array loaded with `mmap_mode='r'`.
+    output_dir: directory of the activation arrays.
+    batch_size: number of examples of a batch.
+    preprocess: optional function applied to each batch of data before
+      feeding it.
+    resume: if true, continue a previous extraction to `output_dir`.
+
+  Returns:
+    a dict of layer names to the memory-mapped activation arrays.
+  """
+  if not os.path.exists(output_dir):
+    os.makedirs(output_dir)
+  layer_names = sorted(layers)
+  num_examples = len(data)
+  paths = dict((name, os.path.join(output_dir, name.replace('/', '_') + '.npy'))
+               for name in layer_names)
+  progress_path = os.path.join(output_dir, 'progress.json')
+  done = _read_progress(progress_path, num_examples, layer_names) if resume else 0
+  arrays = {}
+  if done:
+    arrays = dict((name, np.lib.format.open_memmap(paths[name], mode='r+')) for name in layer_names)
+    print('Resuming the extraction at example %d of %d' % (done, num_examples))
+  fetches = [layers[name] for name in layer_names]
+  for start in range(done, num_examples, batch_size):
+    batch = data[start:start + batch_size]
+    if preprocess is not None:
+      batch = preprocess(batch)
+    activations = sess.run(fetches, {inputs: batch})
+    for name, activation in zip(layer_names, activations):
+      if name not in arrays:
+        arrays[name] = np.lib.format.open_memmap(
+            paths[name],
+            mode='w+',
+            dtype=activation.dtype,
+            shape=(num_examples,) + activation.shape[1:])
+      arrays[name][start:start + len(activation)] = activation
+      arrays[name].flush()
+    _write_progress(progress_path, num_examples, layer_names, start + len(batch))
+    print('Extracted %d of %d examples' % (start + len(batch), num_examples))
+  return arrays
+
+
 @click.command()
 @click.option(
     '--model', default='models/c_multiclass.py', show_default=True, help='Relative path to model.')
@@ -45,7 +131,17 @@ def get_activation(sess, layer, inputs, data):
     help='Relative path to training config file.')
 @click.option('--data_path', help='Directory with Test Images')
 @click.option('--weights_from', help='Path to initial weights file.')
-def load_model(model, model_cnf, weights_from, layer_name, data_path):
+@click.option(
+    '--data_npy',
+    default=None,
+    show_default=True,
+    help='Array of images at the model input size, e.g. from convert.py --output_format npy; '
+    'extracts the activations of --layer_name, comma separated, to --output_dir.')
+@click.option(
+    '--output_dir', default='activations', show_default=True, help='Activation arrays directory.')
+@click.option('--batch_size', default=32, show_default=True, help='Batch size of the extraction.')
+def load_model(model, model_cnf, weights_from, layer_name, data_path, data_npy, output_dir,
+               batch_size):
   model_def = util.load_module(model)
   cnf = util.load_module(model_cnf).cnf
   standardizer = cnf['standardizer']
@@ -60,6 +156,19 @@ def load_model(model, model_cnf, weights_from, layer_name, data_path):
     print('not loaded')
 
   inputs = end_points['inputs']
+  if data_npy is not None:
+    images = tf.placeholder(tf.float32, [None] + inputs.get_shape().as_list()[1:])
+    standardized = tf.map_fn(lambda image: standardizer(image, False), images)
+    layers = dict((name, end_points[name]) for name in layer_name.split(','))
+    extract_activations(
+        sess,
+        inputs,
+        layers,
+        np.load(data_npy, mmap_mode='r'),
+        output_dir,
+        batch_size,
+        preprocess=lambda batch: sess.run(standardized, {images: batch}))
+    return
   layer = end_points[layer_name]
   data = tf.read_file(data_path)
   data = tf.to_float(tf.image.decode_jpeg(data))